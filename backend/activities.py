@@ -0,0 +1,277 @@
+# CloudProof activity batches
+#
+# Scored activities travel through ingestion as columns rather than one dict
+# per event: day ordinals, integer service/action/source codes into small
+# per-batch vocabularies, and int scores. Caps are enforced with grouped
+# cumulative sums instead of a per-row loop.
+#
+# Cap semantics match the original sequential rule exactly: in chronological
+# order, an activity is kept while its day, (day, service) and
+# (day, service, action) totals are still below DAILY_SCORE_CAP /
+# SERVICE_DAILY_CAP / ACTION_DAILY_CAP, and kept activities add to all three.
+# Because a service or day that has hit its cap rejects every later activity
+# in it, the caps can be applied level by level — action, then service over
+# the survivors, then day over those — with the same result.
+
+from datetime import date
+
+import numpy as np
+
+from scoring import DAILY_SCORE_CAP, SERVICE_DAILY_CAP, ACTION_DAILY_CAP
+
+# activity_logs.verification_status values
+VERIFIED    = 'verified'
+PROVISIONAL = 'provisional'   # Counted now; its log file still has CloudTrail API samples queued
+
+
+class ActivityBatch:
+    """Scored activities for one user as parallel NumPy columns."""
+
+    __slots__ = ('user_id', 'day', 'service', 'action', 'score', 'event_id', 'source',
+                 'services', 'actions', 'sources')
+
+    def __init__(self, user_id, day, service, action, score, event_id, source, services, actions, sources):
+        self.user_id  = user_id
+        self.day      = day        # int32 date ordinals
+        self.service  = service    # int32 codes into self.services
+        self.action   = action     # int32 codes into self.actions
+        self.score    = score      # int32
+        self.event_id = event_id   # object array of str / None
+        self.source   = source     # int32 codes into self.sources
+        self.services = services   # list of service names
+        self.actions  = actions    # list of action names
+        self.sources  = sources    # list of (log file key, verification status)
+
+    @classmethod
+    def empty(cls, user_id=None):
+        ints = np.empty(0, dtype=np.int32)
+        return cls(user_id, ints, ints, ints, ints, np.empty(0, dtype=object), ints, [], [], [])
+
+    def __len__(self):
+        return len(self.score)
+
+    def take(self, index):
+        """Rows selected by an index or boolean mask, sharing this batch's vocabularies."""
+        return ActivityBatch(
+            self.user_id, self.day[index], self.service[index], self.action[index],
+            self.score[index], self.event_id[index], self.source[index],
+            self.services, self.actions, self.sources,
+        )
+
+    def with_status(self, status):
+        """The same rows with every source's verification status set to status."""
+        return ActivityBatch(
+            self.user_id, self.day, self.service, self.action, self.score, self.event_id, self.source,
+            self.services, self.actions, [(key, status) for key, _ in self.sources],
+        )
+
+    @classmethod
+    def concat(cls, batches):
+        """One batch from many, with their vocabularies merged and codes remapped."""
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+
+        service_codes, action_codes, source_codes = {}, {}, {}
+        services, actions, sources = [], [], []
+        for b in batches:
+            service_map = np.array([service_codes.setdefault(s, len(service_codes)) for s in b.services], dtype=np.int32)
+            action_map  = np.array([action_codes.setdefault(a, len(action_codes)) for a in b.actions], dtype=np.int32)
+            source_map  = np.array([source_codes.setdefault(s, len(source_codes)) for s in b.sources], dtype=np.int32)
+            services.append(service_map[b.service])
+            actions.append(action_map[b.action])
+            sources.append(source_map[b.source])
+
+        return cls(
+            batches[0].user_id,
+            np.concatenate([b.day for b in batches]),
+            np.concatenate(services),
+            np.concatenate(actions),
+            np.concatenate([b.score for b in batches]),
+            np.concatenate([b.event_id for b in batches]),
+            np.concatenate(sources),
+            list(service_codes),
+            list(action_codes),
+            list(source_codes),
+        )
+
+    def to_dicts(self):
+        """Activity dicts in the shape store_activities() expects."""
+        dates = {d: date.fromordinal(d) for d in np.unique(self.day).tolist()}
+        return [
+            {
+                'user_id':             self.user_id,
+                'date':                dates[d],
+                'service':             self.services[s],
+                'action':              self.actions[a],
+                'score':               score,
+                'event_id':            event_id,
+                'source_key':          self.sources[src][0],
+                'verification_status': self.sources[src][1],
+            }
+            for d, s, a, score, event_id, src in zip(
+                self.day.tolist(), self.service.tolist(), self.action.tolist(),
+                self.score.tolist(), self.event_id.tolist(), self.source.tolist(),
+            )
+        ]
+
+
+class ActivityBatchBuilder:
+    """Accumulates one log file's scored events row by row and freezes them into an ActivityBatch."""
+
+    __slots__ = ('user_id', 'source_key', 'day', 'service', 'action', 'score', 'event_id',
+                 '_service_codes', '_action_codes')
+
+    def __init__(self, user_id, source_key=None):
+        self.user_id    = user_id
+        self.source_key = source_key
+        self.day      = []
+        self.service  = []
+        self.action   = []
+        self.score    = []
+        self.event_id = []
+        self._service_codes = {}
+        self._action_codes  = {}
+
+    def __len__(self):
+        return len(self.score)
+
+    def append(self, day, service, action, score, event_id):
+        service_code = self._service_codes.get(service)
+        if service_code is None:
+            service_code = self._service_codes[service] = len(self._service_codes)
+        action_code = self._action_codes.get(action)
+        if action_code is None:
+            action_code = self._action_codes[action] = len(self._action_codes)
+        self.day.append(day)
+        self.service.append(service_code)
+        self.action.append(action_code)
+        self.score.append(score)
+        self.event_id.append(event_id)
+
+    def build(self):
+        event_id = np.empty(len(self.event_id), dtype=object)
+        event_id[:] = self.event_id
+        return ActivityBatch(
+            self.user_id,
+            np.array(self.day, dtype=np.int32),
+            np.array(self.service, dtype=np.int32),
+            np.array(self.action, dtype=np.int32),
+            np.array(self.score, dtype=np.int32),
+            event_id,
+            np.zeros(len(self.score), dtype=np.int32),
+            list(self._service_codes),
+            list(self._action_codes),
+            [(self.source_key, VERIFIED)],
+        )
+
+
+class CapTotals:
+    """Running daily / per-service / per-action totals, carried across flushes of one sync.
+    Keyed by date, (date, service) and (date, service, action)."""
+
+    __slots__ = ('daily', 'service', 'action')
+
+    def __init__(self):
+        self.daily   = {}
+        self.service = {}
+        self.action  = {}
+
+    def forget_before(self, day):
+        """Drop the per-service and per-action totals of dates before day; daily totals are kept."""
+        for table in (self.service, self.action):
+            for key in [k for k in table if k[0] < day]:
+                del table[key]
+
+
+# ── Cap enforcement ───────────────────────────────────────────────────────────
+
+def _under_cap(groups, scores, cap, seeded, seed_of):
+    """
+    Mask of rows whose group total before them is below cap. Rows are in time order;
+    groups whose first row is flagged in `seeded` start from seed_of(first row) instead of 0.
+    """
+    order  = np.argsort(groups, kind='stable')
+    ranked = groups[order]
+    starts = np.flatnonzero(np.r_[True, ranked[1:] != ranked[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+
+    values = scores[order]
+    before = np.cumsum(values) - values                      # sum over all earlier rows, group order
+    before -= np.repeat(before[starts], counts)              # ... restricted to the row's own group
+
+    first = order[starts]
+    seeds = np.zeros(len(starts), dtype=np.int64)
+    for g in np.flatnonzero(seeded[first]).tolist():
+        seeds[g] = seed_of(int(first[g]))
+    before += np.repeat(seeds, counts)
+
+    mask = np.empty(len(groups), dtype=bool)
+    mask[order] = before < cap
+    return mask
+
+
+def _add_group_totals(groups, scores, totals, key_of):
+    uniq, first, inverse = np.unique(groups, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse, weights=scores, minlength=len(uniq))
+    for row, added in zip(first.tolist(), sums.tolist()):
+        key = key_of(row)
+        totals[key] = totals.get(key, 0) + int(added)
+
+
+def apply_caps(batch, totals=None):
+    """Return the rows of batch that fit under the daily, per-service and per-action caps,
+    in chronological order. Pass a CapTotals to continue from the totals of earlier batches;
+    it is updated with the rows kept."""
+    totals = totals or CapTotals()
+    if not len(batch):
+        return batch
+
+    order   = np.argsort(batch.day, kind='stable')
+    day     = batch.day[order]
+    service = batch.service[order]
+    action  = batch.action[order]
+    scores  = batch.score[order].astype(np.int64)
+
+    day_group     = (day - day[0]).astype(np.int64)
+    service_group = day_group * len(batch.services) + service
+    action_group  = service_group * len(batch.actions) + action
+
+    # Only days already present in the running totals can start above zero
+    seeded   = np.isin(day, np.array([d.toordinal() for d in totals.daily], dtype=np.int32))
+    dates    = {d: date.fromordinal(d) for d in np.unique(day).tolist()}
+    services = batch.services
+    actions  = batch.actions
+
+    def day_key(row):
+        return dates[int(day[row])]
+
+    def service_key(row):
+        return (day_key(row), services[service[row]])
+
+    def action_key(row):
+        return (day_key(row), services[service[row]], actions[action[row]])
+
+    kept = np.arange(len(batch))
+    for groups, cap, table, key_of in (
+        (action_group,  ACTION_DAILY_CAP,  totals.action,  action_key),
+        (service_group, SERVICE_DAILY_CAP, totals.service, service_key),
+        (day_group,     DAILY_SCORE_CAP,   totals.daily,   day_key),
+    ):
+        if not len(kept):
+            break
+        mask = _under_cap(groups[kept], scores[kept], cap, seeded[kept],
+                          lambda i: table.get(key_of(kept[i]), 0))
+        kept = kept[mask]
+
+    for groups, table, key_of in (
+        (action_group,  totals.action,  action_key),
+        (service_group, totals.service, service_key),
+        (day_group,     totals.daily,   day_key),
+    ):
+        if len(kept):
+            _add_group_totals(groups[kept], scores[kept], table, lambda i: key_of(kept[i]))
+
+    return batch.take(order[kept])
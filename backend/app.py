@@ -1,7 +1,8 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from database import execute_query
+from database import execute_query, pool_stats, transaction, REPLICA_DSN
 from datetime import datetime, timedelta
+import hashlib
 import logging
 import os
 import re
@@ -20,11 +21,20 @@ from auth import (
     generate_reset_token, verify_reset_token, consume_reset_token,
 )
 from credentials import encrypt_credential, decrypt_credential
+from summaries import get_user_summary
+from percentiles import histogram_version, percentile
+import leaderboard
 from oauth import generate_state, verify_state, github_auth_url, github_get_user, google_auth_url, google_get_user
 from emailer import send_verification_email, send_reset_email
 
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000')
 
+# Public profile responses: seconds browsers and proxies may reuse them without
+# revalidating (0 = always revalidate, answered with 304 while unchanged), and a
+# number to bump when their JSON shape changes so cached copies are not reused.
+PROFILE_CACHE_SECONDS   = int(os.getenv('PROFILE_CACHE_SECONDS', '0'))
+PROFILE_PAYLOAD_VERSION = 1
+
 # In-memory store for async sync jobs: job_id → state dict
 sync_jobs = {}
 sync_jobs_lock = threading.Lock()
@@ -52,7 +62,14 @@ def internal_error(error):
 def health_check():
     try:
         execute_query("SELECT 1", fetch=True)
-        return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()}), 200
+        health = {'status': 'healthy', 'timestamp': datetime.now().isoformat()}
+        pool = pool_stats()
+        if pool is not None:
+            health['db_pool'] = pool
+        replica = pool_stats(replica=True)
+        if replica is not None:
+            health['db_replica_pool'] = replica
+        return jsonify(health), 200
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 503
 
@@ -93,7 +110,7 @@ def get_user_activity(user_id):
         user = execute_query(
             "SELECT id FROM users WHERE id = %s",
             (user_id,),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         if not user:
@@ -108,19 +125,19 @@ def get_user_activity(user_id):
         daily_scores = execute_query(
             "SELECT date, total_score FROM daily_scores WHERE user_id = %s AND date >= %s ORDER BY date",
             (user_id, start_date),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         service_breakdown = execute_query(
-            "SELECT service, SUM(score) as total FROM activity_logs WHERE user_id = %s AND date >= %s GROUP BY service ORDER BY total DESC",
+            "SELECT service, SUM(total) as total FROM service_daily_totals WHERE user_id = %s AND date >= %s GROUP BY service ORDER BY total DESC",
             (user_id, start_date),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         recent_actions = execute_query(
             "SELECT date, service, action, score FROM activity_logs WHERE user_id = %s ORDER BY date DESC, id DESC LIMIT 20",
             (user_id,),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         heatmap = {row['date'].isoformat(): int(row['total_score']) for row in daily_scores}
@@ -153,7 +170,7 @@ def get_user_dashboard(user_id):
         user = execute_query(
             "SELECT id, name, email FROM users WHERE id = %s",
             (user_id,),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         if not user:
@@ -175,7 +192,7 @@ def get_user_dashboard(user_id):
             ORDER BY date DESC, COALESCE(timestamp, created_at) DESC
             """,
             (user_id, start_date),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         dashboard_data = {}
@@ -355,7 +372,7 @@ def get_user_resources(user_id):
         user = execute_query(
             "SELECT id FROM users WHERE id = %s",
             (user_id,),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         if not user:
@@ -375,7 +392,7 @@ def get_user_resources(user_id):
             ORDER BY last_updated DESC
             """,
             (user_id,),
-            fetch=True
+            fetch=True, read_only=True
         )
         
         result = []
@@ -406,6 +423,45 @@ def get_user_resources(user_id):
         return jsonify({'error': 'Failed to fetch resources'}), 500
 
 # ─── Public Profile Endpoints ────────────────────────────────────────────────
+# Profile and dashboard responses change only when a sync stores or revokes
+# activity, which bumps users.data_version. Their strong ETag combines that
+# version with the request URL and today's date (the ?days windows move daily),
+# plus the score histogram's version for the profile, whose percentile moves
+# with everyone's scores. A matching If-None-Match is answered 304 from one
+# indexed lookup.
+#
+# data_version is always read from the primary, so a lagging replica cannot
+# confirm a stale ETag; the body is read from the replica only once it has
+# caught up to that version. Resources share the scheme, so code that writes
+# resource_state must bump data_version as well (see bump_data_version).
+
+def _profile_etag(user_row, *extra):
+    key = ':'.join(map(str, (PROFILE_PAYLOAD_VERSION, user_row['id'], user_row['data_version'],
+                             datetime.now().date(), request.full_path) + extra))
+    return hashlib.blake2s(key.encode(), digest_size=12).hexdigest()
+
+
+def _replica_current(user_row):
+    """True if the read replica (when there is one) has the user's data as of user_row['data_version']."""
+    if not REPLICA_DSN:
+        return True
+    rows = execute_query(
+        "SELECT data_version FROM users WHERE id = %s", (user_row['id'],), fetch=True, read_only=True
+    )
+    return bool(rows) and rows[0]['data_version'] >= user_row['data_version']
+
+
+def _cacheable(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={PROFILE_CACHE_SECONDS}, must-revalidate"
+    return response
+
+
+def _not_modified(etag):
+    if request.if_none_match.contains(etag):
+        return _cacheable(app.response_class(status=304), etag)
+    return None
+
 
 @app.route('/api/register', methods=['POST'])
 def register_user():
@@ -455,7 +511,7 @@ def register_user():
 def get_profile(username):
     """Return the full public profile for a username — used by the profile page."""
     user = execute_query(
-        "SELECT id, username, name, email, s3_bucket, aws_region, created_at FROM users WHERE username = %s",
+        "SELECT id, username, name, email, s3_bucket, aws_region, created_at, data_version FROM users WHERE username = %s",
         (username.lower(),),
         fetch=True
     )
@@ -464,6 +520,11 @@ def get_profile(username):
 
     user_row = user[0]
     user_id = user_row['id']
+    etag = _profile_etag(user_row, histogram_version())
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    replica = _replica_current(user_row)
 
     days = int(request.args.get('days', 365))
     if days < 1 or days > 730:
@@ -473,48 +534,26 @@ def get_profile(username):
     daily_scores = execute_query(
         "SELECT date, total_score FROM daily_scores WHERE user_id = %s AND date >= %s ORDER BY date",
         (user_id, start_date),
-        fetch=True
+        fetch=True, read_only=replica
     )
     service_breakdown = execute_query(
-        "SELECT service, SUM(score) as total FROM activity_logs WHERE user_id = %s AND date >= %s GROUP BY service ORDER BY total DESC",
+        "SELECT service, SUM(total) as total FROM service_daily_totals WHERE user_id = %s AND date >= %s GROUP BY service ORDER BY total DESC",
         (user_id, start_date),
-        fetch=True
+        fetch=True, read_only=replica
     )
     recent_actions = execute_query(
         "SELECT date, service, action, score FROM activity_logs WHERE user_id = %s ORDER BY date DESC, id DESC LIMIT 20",
         (user_id,),
-        fetch=True
+        fetch=True, read_only=replica
     )
 
     heatmap = {row['date'].isoformat() if hasattr(row['date'], 'isoformat') else str(row['date']): int(row['total_score']) for row in daily_scores}
     services = {row['service']: int(row['total']) for row in service_breakdown}
     total_score = sum(services.values())
 
-    # Compute streaks server-side
-    sorted_dates = sorted(heatmap.keys())
-    current_streak = 0
-    max_streak = 0
-    if sorted_dates:
-        temp = 1
-        for i in range(1, len(sorted_dates)):
-            prev = datetime.strptime(sorted_dates[i - 1], '%Y-%m-%d').date()
-            curr = datetime.strptime(sorted_dates[i], '%Y-%m-%d').date()
-            if (curr - prev).days == 1:
-                temp += 1
-                max_streak = max(max_streak, temp)
-            else:
-                temp = 1
-        max_streak = max(max_streak, 1)
-
-        # Current streak: walk back from most recent active day
-        current_streak = 1
-        for i in range(len(sorted_dates) - 2, -1, -1):
-            prev = datetime.strptime(sorted_dates[i], '%Y-%m-%d').date()
-            nxt = datetime.strptime(sorted_dates[i + 1], '%Y-%m-%d').date()
-            if (nxt - prev).days == 1:
-                current_streak += 1
-            else:
-                break
+    # Streaks come from the user's summary row; the percentile ranks the all-time
+    # total it holds, as the score histogram does
+    summary = get_user_summary(user_id, read_only=replica)
 
     created_at = user_row['created_at']
     if hasattr(created_at, 'isoformat'):
@@ -522,7 +561,7 @@ def get_profile(username):
     else:
         created_at = str(created_at)
 
-    return jsonify({
+    return _cacheable(jsonify({
         'user': {
             'username': user_row['username'],
             'name': user_row['name'],
@@ -539,10 +578,11 @@ def get_profile(username):
             } for row in recent_actions
         ],
         'total_score': total_score,
-        'streaks': {'current': current_streak, 'longest': max_streak},
+        'streaks': {'current': int(summary['current_streak']), 'longest': int(summary['longest_streak'])},
         'credibility': get_credibility(total_score),
+        'percentile': percentile(int(summary['total_score'])),
         'tiers': CREDIBILITY_TIERS,
-    }), 200
+    }), etag), 200
 
 
 @app.route('/api/profile/<username>/sync', methods=['POST'])
@@ -588,12 +628,17 @@ def sync_profile(username):
 def get_profile_dashboard(username):
     """Dashboard view for a profile — daily breakdown by service and action."""
     user = execute_query(
-        "SELECT id FROM users WHERE username = %s", (username.lower(),), fetch=True
+        "SELECT id, data_version FROM users WHERE username = %s", (username.lower(),), fetch=True
     )
     if not user:
         return jsonify({'error': 'Profile not found'}), 404
 
     user_id = user[0]['id']
+    etag = _profile_etag(user[0])
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    replica = _replica_current(user[0])
     days = int(request.args.get('days', 30))
     if days < 1 or days > 365:
         days = 30
@@ -608,7 +653,7 @@ def get_profile_dashboard(username):
         ORDER BY date DESC, COALESCE(timestamp, created_at) DESC
         """,
         (user_id, start_date),
-        fetch=True
+        fetch=True, read_only=replica
     )
 
     dashboard_data = {}
@@ -632,21 +677,26 @@ def get_profile_dashboard(username):
         dashboard_data[date_str]['total_actions'] += 1
         dashboard_data[date_str]['total_score'] += row['score']
 
-    return jsonify({
+    return _cacheable(jsonify({
         'dashboard': sorted(dashboard_data.values(), key=lambda x: x['date'], reverse=True)
-    }), 200
+    }), etag), 200
 
 
 @app.route('/api/profile/<username>/resources', methods=['GET'])
 def get_profile_resources(username):
     """Resource inventory for a profile."""
     user = execute_query(
-        "SELECT id FROM users WHERE username = %s", (username.lower(),), fetch=True
+        "SELECT id, data_version FROM users WHERE username = %s", (username.lower(),), fetch=True
     )
     if not user:
         return jsonify({'error': 'Profile not found'}), 404
 
     user_id = user[0]['id']
+    etag = _profile_etag(user[0])
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    replica = _replica_current(user[0])
     resources = execute_query(
         """
         SELECT resource_type, resource_id, parent_resource_id, state, metadata, last_updated
@@ -655,7 +705,7 @@ def get_profile_resources(username):
         ORDER BY last_updated DESC
         """,
         (user_id,),
-        fetch=True
+        fetch=True, read_only=replica
     )
 
     result = []
@@ -670,7 +720,50 @@ def get_profile_resources(username):
             'last_updated': ts.isoformat() if hasattr(ts, 'isoformat') else str(ts) if ts else None,
         })
 
-    return jsonify({'resources': result}), 200
+    return _cacheable(jsonify({'resources': result}), etag), 200
+
+
+# ─── Leaderboards ────────────────────────────────────────────────────────────
+
+def _leaderboard_args():
+    """(window, service) from the query string, or raise ValueError."""
+    window = request.args.get('window', 'all')
+    if window not in leaderboard.WINDOWS:
+        raise ValueError(f"window must be one of: {', '.join(leaderboard.WINDOWS)}")
+    service = request.args.get('service')
+    if not service:
+        return window, None
+    if service.upper() not in leaderboard.SERVICES:
+        raise ValueError(f"Unknown service: {service}")
+    return window, service.upper()
+
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """Top users overall, or for ?service=, over ?window=all|week|month."""
+    try:
+        window, service = _leaderboard_args()
+        limit = int(request.args.get('limit', 20))
+        if limit < 1:
+            raise ValueError('limit must be positive')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(leaderboard.top(window, service, limit)), 200
+
+
+@app.route('/api/leaderboard/<username>', methods=['GET'])
+def get_leaderboard_rank(username):
+    """One user's rank on a leaderboard (same query parameters as /api/leaderboard)."""
+    try:
+        window, service = _leaderboard_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    user = execute_query(
+        "SELECT id FROM users WHERE username = %s", (username.lower(),), fetch=True, read_only=True
+    )
+    if not user:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(leaderboard.rank_of(user[0]['id'], window, service)), 200
 
 
 @app.route('/api/profile/<username>/test-sync', methods=['POST'])
@@ -1199,43 +1292,44 @@ def _oauth_upsert_user(provider: str, info: dict) -> dict:
     oauth_id = info['oauth_id']
     email    = (info.get('email') or '').strip().lower() or None
 
-    # 1. Find by provider + oauth_id
-    existing = execute_query(
-        "SELECT id, username, name, email, s3_bucket FROM users WHERE oauth_provider = %s AND oauth_id = %s",
-        (provider, oauth_id), fetch=True
-    )
-    if existing:
-        return existing[0]
-
-    # 2. Find by email — link the OAuth provider to the existing account
-    if email:
-        by_email = execute_query(
-            "SELECT id, username, name, email, s3_bucket FROM users WHERE email = %s",
-            (email,), fetch=True
+    with transaction() as tx:
+        # 1. Find by provider + oauth_id
+        existing = tx.fetch_one(
+            "SELECT id, username, name, email, s3_bucket FROM users WHERE oauth_provider = %s AND oauth_id = %s",
+            (provider, oauth_id)
         )
-        if by_email:
-            execute_query(
-                "UPDATE users SET oauth_provider = %s, oauth_id = %s, email_verified = 1 WHERE id = %s",
-                (provider, oauth_id, by_email[0]['id'])
-            )
-            return by_email[0]
-
-    # 3. Create new user
-    username = _unique_username(info.get('username_hint', 'user'))
-    name     = (info.get('name') or username).strip()
-    verified = 1 if info.get('email_verified') else 0
+        if existing:
+            return existing
 
-    execute_query(
-        "INSERT INTO users (username, name, email, oauth_provider, oauth_id, email_verified) "
-        "VALUES (%s, %s, %s, %s, %s, %s)",
-        (username, name, email, provider, oauth_id, verified)
-    )
-    user = execute_query(
-        "SELECT id, username, name, email, s3_bucket FROM users WHERE username = %s",
-        (username,), fetch=True
-    )
+        # 2. Find by email — link the OAuth provider to the existing account
+        if email:
+            by_email = tx.fetch_one(
+                "SELECT id, username, name, email, s3_bucket FROM users WHERE email = %s",
+                (email,)
+            )
+            if by_email:
+                tx.execute(
+                    "UPDATE users SET oauth_provider = %s, oauth_id = %s, email_verified = 1 WHERE id = %s",
+                    (provider, oauth_id, by_email['id'])
+                )
+                return by_email
+
+        # 3. Create new user
+        username = _unique_username(info.get('username_hint', 'user'))
+        name     = (info.get('name') or username).strip()
+        verified = 1 if info.get('email_verified') else 0
+
+        tx.execute(
+            "INSERT INTO users (username, name, email, oauth_provider, oauth_id, email_verified) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            (username, name, email, provider, oauth_id, verified)
+        )
+        user = tx.fetch_one(
+            "SELECT id, username, name, email, s3_bucket FROM users WHERE username = %s",
+            (username,)
+        )
     logger.info(f"New OAuth user created: {username} via {provider}")
-    return user[0]
+    return user
 
 
 def _oauth_error_redirect(msg: str):
@@ -1398,11 +1492,12 @@ if __name__ == '__main__':
     # Start auto-sync scheduler in a background daemon thread
     import schedule
     import time
-    from scheduler import sync_all_users
+    from scheduler import sync_all_users, rebuild_score_histogram, HISTOGRAM_REBUILD_MINUTES
 
     SYNC_TIME = '02:00'
 
     schedule.every().day.at(SYNC_TIME).do(sync_all_users)
+    schedule.every(HISTOGRAM_REBUILD_MINUTES).minutes.do(rebuild_score_histogram)
 
     # Periodically purge stale sync jobs (every 10 minutes)
     def _cleanup_sync_jobs():
@@ -1423,4 +1518,8 @@ if __name__ == '__main__':
     t = threading.Thread(target=_run_scheduler, daemon=True)
     t.start()
 
+    # Drain the CloudTrail API verification queue in the background
+    from verification import start_verifier
+    start_verifier()
+
     app.run(host='0.0.0.0', debug=True, port=5000, use_reloader=False)
\ No newline at end of file
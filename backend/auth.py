@@ -91,18 +91,19 @@ def generate_verification_token(user_id: int) -> str:
     Create a 32-byte random hex token, store it in email_verification_tokens,
     and return the token string.  Expires in 24 hours.
     """
-    from database import execute_query
+    from database import transaction
     token = secrets.token_urlsafe(32)
     expires = datetime.now(timezone.utc) + timedelta(hours=24)
     # Remove any previous unused tokens for this user
-    execute_query(
-        "DELETE FROM email_verification_tokens WHERE user_id = %s AND used = 0",
-        (user_id,)
-    )
-    execute_query(
-        "INSERT INTO email_verification_tokens (user_id, token, expires_at) VALUES (%s, %s, %s)",
-        (user_id, token, expires)
-    )
+    with transaction() as tx:
+        tx.execute(
+            "DELETE FROM email_verification_tokens WHERE user_id = %s AND used = 0",
+            (user_id,)
+        )
+        tx.execute(
+            "INSERT INTO email_verification_tokens (user_id, token, expires_at) VALUES (%s, %s, %s)",
+            (user_id, token, expires)
+        )
     return token
 
 
@@ -111,25 +112,24 @@ def verify_email_token(token: str) -> int | None:
     Validate the token. If valid, mark it used, mark the user's email as verified,
     and return the user_id. Returns None if invalid or expired.
     """
-    from database import execute_query
-    rows = execute_query(
-        "SELECT id, user_id, expires_at, used FROM email_verification_tokens WHERE token = %s",
-        (token,), fetch=True
-    )
-    if not rows:
-        return None
-    row = rows[0]
-    if row['used']:
-        return None
-    exp = row['expires_at']
-    if isinstance(exp, str):
-        exp = datetime.fromisoformat(exp)
-    if exp.replace(tzinfo=None) < datetime.utcnow():
-        return None
-    user_id = row['user_id']
-    execute_query("UPDATE email_verification_tokens SET used = 1 WHERE id = %s", (row['id'],))
-    execute_query("UPDATE users SET email_verified = 1 WHERE id = %s", (user_id,))
-    return user_id
+    from database import transaction
+    with transaction() as tx:
+        row = tx.fetch_one(
+            "SELECT id, user_id, expires_at, used FROM email_verification_tokens WHERE token = %s",
+            (token,)
+        )
+        if not row or row['used']:
+            return None
+        exp = row['expires_at']
+        if isinstance(exp, str):
+            exp = datetime.fromisoformat(exp)
+        if exp.replace(tzinfo=None) < datetime.utcnow():
+            return None
+        # used = 0 guards against a concurrent request consuming the same token
+        if not tx.execute("UPDATE email_verification_tokens SET used = 1 WHERE id = %s AND used = 0", (row['id'],)):
+            return None
+        tx.execute("UPDATE users SET email_verified = 1 WHERE id = %s", (row['user_id'],))
+    return row['user_id']
 
 
 # ── Password reset tokens ────────────────────────────────────────────────────
@@ -139,17 +139,18 @@ def generate_reset_token(user_id: int) -> str:
     Create a 32-byte random hex reset token, store it, and return it.
     Expires in 1 hour.
     """
-    from database import execute_query
+    from database import transaction
     token = secrets.token_urlsafe(32)
     expires = datetime.now(timezone.utc) + timedelta(hours=1)
-    execute_query(
-        "DELETE FROM password_reset_tokens WHERE user_id = %s AND used = 0",
-        (user_id,)
-    )
-    execute_query(
-        "INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (%s, %s, %s)",
-        (user_id, token, expires)
-    )
+    with transaction() as tx:
+        tx.execute(
+            "DELETE FROM password_reset_tokens WHERE user_id = %s AND used = 0",
+            (user_id,)
+        )
+        tx.execute(
+            "INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (%s, %s, %s)",
+            (user_id, token, expires)
+        )
     return token
 
 
@@ -0,0 +1,82 @@
+"""
+CloudProof backfills
+Rebuild derived tables from activity_logs — after adding one to a database
+that already holds activity, or to repair one. Safe to re-run.
+Run from backend/:  python backfill.py <name> [user_id ...]
+With no user ids every user with activity is rebuilt.
+"""
+import logging
+import sys
+
+from database import execute_query, run_write
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def _user_ids(user_ids):
+    if user_ids:
+        return [int(user_id) for user_id in user_ids]
+    rows = execute_query("SELECT DISTINCT user_id FROM activity_logs ORDER BY user_id", fetch=True)
+    return [row['user_id'] for row in rows]
+
+
+def backfill_service_daily_totals(user_ids=None):
+    """Recompute service_daily_totals from activity_logs, one user per transaction."""
+    from database import DB_ENGINE
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+
+    def rebuild(user_id):
+        def write(cursor):
+            cursor.execute(f"DELETE FROM service_daily_totals WHERE user_id = {placeholder}", (user_id,))
+            cursor.execute(
+                f"INSERT INTO service_daily_totals (user_id, date, service, total) "
+                f"SELECT user_id, date, service, SUM(score) FROM activity_logs "
+                f"WHERE user_id = {placeholder} GROUP BY user_id, date, service",
+                (user_id,)
+            )
+            return cursor.rowcount
+        return run_write(write)
+
+    users = _user_ids(user_ids)
+    rows = 0
+    for user_id in users:
+        rows += rebuild(user_id)
+    logger.info(f"service_daily_totals: {rows} rows for {len(users)} user(s)")
+    return rows
+
+
+def backfill_user_summary(user_ids=None):
+    """Recompute user_summary from daily_scores and service_daily_totals (run service-daily-totals first)."""
+    from summaries import refresh_user_summary
+
+    users = _user_ids(user_ids)
+    for user_id in users:
+        run_write(lambda cursor: refresh_user_summary(cursor, user_id))
+    logger.info(f"user_summary: {len(users)} user(s)")
+    return len(users)
+
+
+def backfill_score_histogram(user_ids=None):
+    """Recount score_histogram from user_summary (run user-summary first); user ids are ignored."""
+    from percentiles import rebuild_histogram
+
+    buckets = rebuild_histogram()
+    logger.info(f"score_histogram: {buckets} bucket(s)")
+    return buckets
+
+
+BACKFILLS = {
+    'service-daily-totals': backfill_service_daily_totals,
+    'user-summary': backfill_user_summary,
+    'score-histogram': backfill_score_histogram,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BACKFILLS:
+        sys.exit(f"Usage: python backfill.py <name> [user_id ...]. Choose from: {', '.join(BACKFILLS)}")
+    BACKFILLS[sys.argv[1]](sys.argv[2:])
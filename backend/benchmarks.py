@@ -0,0 +1,466 @@
+"""
+CloudProof micro-benchmarks
+Synthetic, self-contained timings for hot paths in ingestion and scoring.
+Run from backend/:  python benchmarks.py [name ...]
+With no arguments every benchmark runs.
+"""
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from activities import ActivityBatchBuilder, CapTotals, apply_caps
+from scoring import (
+    SCORING_RULES, IGNORED_ACTIONS, DAILY_SCORE_CAP, SERVICE_DAILY_CAP, ACTION_DAILY_CAP,
+    calculate_score, score_event,
+)
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def _report(label, seconds, count, unit='record'):
+    per_item_ns = seconds / count * 1e9 if count else 0.0
+    print(f"  {label:<28} {seconds:8.3f}s   {per_item_ns:8.1f} ns/{unit}")
+
+
+# ── Scoring ───────────────────────────────────────────────────────────────────
+
+def _legacy_calculate_score(service, action):
+    """calculate_score as it was before the compiled lookup table."""
+    for ignored in IGNORED_ACTIONS:
+        if action.startswith(ignored):
+            return 0
+    return SCORING_RULES.get(service, {}).get(action, 0)
+
+
+def _scoring_corpus(n, seed=42):
+    """(eventSource, eventName) pairs: ~50% scored, ~40% read-only, ~10% unknown."""
+    rng = random.Random(seed)
+    scored = [
+        (f"{service.lower()}.amazonaws.com", action)
+        for service, actions in SCORING_RULES.items()
+        for action in actions
+    ]
+    read_only = [
+        (source, f"{verb}{action}")
+        for source, action in scored[:200]
+        for verb in ('Describe', 'Get', 'List')
+    ]
+    unknown = [(f"svc{i}.amazonaws.com", f"DoThing{i % 50}") for i in range(500)]
+    pools = [scored] * 5 + [read_only] * 4 + [unknown]
+    return [rng.choice(rng.choice(pools)) for _ in range(n)]
+
+
+def bench_scoring(n=1_000_000):
+    """Per-record scoring cost before/after the compiled (eventSource, eventName) table."""
+    corpus = _scoring_corpus(n)
+    print(f"scoring: {n:,} synthetic CloudTrail events")
+
+    def legacy():
+        total = 0
+        for source, name in corpus:
+            total += _legacy_calculate_score(source.split('.')[0].upper(), name)
+        return total
+
+    def wrapper():
+        total = 0
+        for source, name in corpus:
+            total += calculate_score(source.split('.')[0].upper(), name)
+        return total
+
+    def compiled():
+        total = 0
+        for source, name in corpus:
+            total += score_event(source, name)[1]
+        return total
+
+    legacy_s, expected = _timed(legacy)
+    _report('legacy split+calculate', legacy_s, n)
+    wrapper_s, got = _timed(wrapper)
+    assert got == expected, "calculate_score wrapper disagrees with legacy scoring"
+    _report('split+calculate_score', wrapper_s, n)
+    compiled_s, got = _timed(compiled)
+    assert got == expected, "score_event disagrees with legacy scoring"
+    _report('score_event', compiled_s, n)
+    print(f"  speedup: {legacy_s / compiled_s:.1f}x")
+
+
+# ── Parse stage ───────────────────────────────────────────────────────────────
+
+def _synthetic_log_files(files, records_per_file, seed=7):
+    """Gzipped CloudTrail files shaped like real deliveries, as (key, bytes) pairs."""
+    rng = random.Random(seed)
+    corpus = _scoring_corpus(files * records_per_file, seed)
+    start = datetime(2026, 1, 1)
+    blobs = []
+    for i in range(files):
+        file_time = start + timedelta(minutes=5 * i)
+        records = []
+        for source, name in corpus[i * records_per_file:(i + 1) * records_per_file]:
+            records.append({
+                'eventVersion': '1.08',
+                'userIdentity': {'type': 'IAMUser', 'arn': 'arn:aws:iam::123456789012:user/bench'},
+                'eventTime': (file_time + timedelta(seconds=rng.randint(0, 300))).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'eventSource': source,
+                'eventName': name,
+                'awsRegion': 'us-east-1',
+                'sourceIPAddress': '203.0.113.10',
+                'readOnly': name.startswith(('Describe', 'Get', 'List')),
+                'eventID': str(uuid.UUID(int=rng.getrandbits(128))),
+            })
+        key = f"AWSLogs/123456789012/CloudTrail/us-east-1/{file_time:%Y/%m/%d}/" \
+              f"123456789012_CloudTrail_us-east-1_{file_time:%Y%m%dT%H%M}Z_{i:016x}.json.gz"
+        blobs.append((key, gzip.compress(json.dumps({'Records': records}).encode())))
+    return blobs
+
+
+def bench_parse(files=64, records_per_file=2000):
+    """Records/sec of the inflate → parse → validate → score stage, threads vs process pool."""
+    from ingestion import _scan_log_blob
+
+    blobs = _synthetic_log_files(files, records_per_file)
+    total = files * records_per_file
+    scan_args = (1, True, '123456789012', False)
+    print(f"parse: {files} files × {records_per_file:,} records, {os.cpu_count()} CPUs")
+
+    def run(executor):
+        return sum(len(result[0]) for result in executor.map(
+            _scan_log_blob, [k for k, _ in blobs], [b for _, b in blobs], [scan_args] * len(blobs)
+        ))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        seconds, _ = _timed(run, pool)
+    print(f"  {'threads (8)':<28} {total / seconds:12,.0f} records/s")
+
+    process_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    for processes in process_counts:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            run(pool)  # warm up worker imports
+            seconds, _ = _timed(run, pool)
+        print(f"  {f'processes ({processes})':<28} {total / seconds:12,.0f} records/s")
+
+
+def bench_validate(files=20, records_per_file=5000):
+    """Scan cost of already-decoded records with and without the fused fraud checks."""
+    from ingestion import _scan_records
+
+    decoded = [
+        (key, json.loads(gzip.decompress(blob))['Records'])
+        for key, blob in _synthetic_log_files(files, records_per_file)
+    ]
+    total = files * records_per_file
+    print(f"validate: {files} files × {records_per_file:,} decoded records")
+
+    def scan(fraud_checks):
+        return sum(
+            len(_scan_records(records, key, 1, fraud_checks, '123456789012', fraud_checks)[0])
+            for key, records in decoded
+        )
+
+    plain_s, expected = _timed(scan, False)
+    _report('score only', plain_s, total)
+    checked_s, got = _timed(scan, True)
+    assert got == expected, "fraud checks rejected clean synthetic files"
+    _report('validate + score', checked_s, total)
+    print(f"  validation overhead: {checked_s / plain_s - 1:.0%} of scoring")
+
+
+# ── Caps ──────────────────────────────────────────────────────────────────────
+
+def _legacy_apply_daily_caps(activities, totals):
+    """The per-row dict loop that activities.apply_caps replaced."""
+    capped = []
+    for activity in sorted(activities, key=lambda x: x['date']):
+        date_key    = activity['date']
+        service_key = (date_key, activity['service'])
+        action_key  = (date_key, activity['service'], activity['action'])
+        if totals.daily.get(date_key, 0)       >= DAILY_SCORE_CAP:   continue
+        if totals.service.get(service_key, 0)  >= SERVICE_DAILY_CAP: continue
+        if totals.action.get(action_key, 0)    >= ACTION_DAILY_CAP:  continue
+        capped.append(activity)
+        totals.daily[date_key]       = totals.daily.get(date_key, 0) + activity['score']
+        totals.service[service_key]  = totals.service.get(service_key, 0) + activity['score']
+        totals.action[action_key]    = totals.action.get(action_key, 0) + activity['score']
+    return capped
+
+
+def bench_caps(n=2_000_000, years=3):
+    """Cap enforcement over a multi-year backfill: dict-per-row loop vs ActivityBatch."""
+    rng    = random.Random(11)
+    corpus = [(source, name) for source, name in _scoring_corpus(50_000) if score_event(source, name)[1] > 0]
+    first  = date(2023, 1, 1).toordinal()
+    days   = 365 * years
+    rows   = []
+    for i in range(n):
+        source, name = corpus[i % len(corpus)]
+        service, score = score_event(source, name)
+        rows.append((first + rng.randrange(days), service, name, score, f"evt-{i}"))
+    print(f"caps: {n:,} scored events over {days:,} days")
+
+    def build_dicts():
+        return [
+            {'user_id': 1, 'date': date.fromordinal(d), 'service': s, 'action': a, 'score': sc, 'event_id': e}
+            for d, s, a, sc, e in rows
+        ]
+
+    def build_batch():
+        builder = ActivityBatchBuilder(1)
+        for row in rows:
+            builder.append(*row)
+        return builder.build()
+
+    for label, build in (('dict rows', build_dicts), ('ActivityBatch', build_batch)):
+        tracemalloc.start()
+        held = build()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {label + ' memory':<28} {peak / 2**20:8.1f} MiB")
+        del held
+
+    activities = build_dicts()
+    legacy_s, expected = _timed(_legacy_apply_daily_caps, activities, CapTotals())
+    _report('legacy dict loop', legacy_s, n)
+    del activities
+
+    batch = build_batch()
+    vector_s, got = _timed(apply_caps, batch, CapTotals())
+    assert [a['event_id'] for a in got.to_dicts()] == [a['event_id'] for a in expected], \
+        "apply_caps disagrees with the legacy loop"
+    _report('apply_caps (vectorized)', vector_s, n)
+    print(f"  speedup: {legacy_s / vector_s:.1f}x")
+
+
+# ── Store ─────────────────────────────────────────────────────────────────────
+
+def _legacy_store_activities(activities):
+    """store_activities as it was before the bulk loader: one execute per row and per day."""
+    from database import get_db_connection, release_db_connection, DB_ENGINE
+
+    sqlite = DB_ENGINE == 'sqlite'
+    mark   = '?' if sqlite else '%s'
+    conn   = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        insert_sql = (
+            f"INSERT {'OR IGNORE ' if sqlite else ''}INTO activity_logs "
+            f"(user_id, date, service, action, score, event_id, source_key, verification_status, sync_id) "
+            f"VALUES ({', '.join([mark] * 9)})"
+            + ('' if sqlite else " ON CONFLICT (user_id, event_id) DO NOTHING")
+        )
+        daily = {}
+        for a in activities:
+            cursor.execute(insert_sql, (a['user_id'], a['date'], a['service'], a['action'], a['score'], a['event_id'],
+                                        a.get('source_key'), a.get('verification_status') or 'verified', a.get('sync_id')))
+            if cursor.rowcount > 0:
+                key = (a['user_id'], a['date'])
+                daily[key] = daily.get(key, 0) + a['score']
+        for (user_id, day), total in daily.items():
+            if sqlite:
+                cursor.execute("SELECT total_score FROM daily_scores WHERE user_id = ? AND date = ?", (user_id, day))
+                row = cursor.fetchone()
+                new_total = min((int(row[0]) if row else 0) + total, DAILY_SCORE_CAP)
+                if row:
+                    cursor.execute("UPDATE daily_scores SET total_score = ? WHERE user_id = ? AND date = ?",
+                                   (new_total, user_id, day))
+                else:
+                    cursor.execute("INSERT INTO daily_scores (user_id, date, total_score) VALUES (?, ?, ?)",
+                                   (user_id, day, new_total))
+            else:
+                cursor.execute(
+                    "INSERT INTO daily_scores (user_id, date, total_score) VALUES (%s, %s, %s) "
+                    "ON CONFLICT (user_id, date) DO UPDATE "
+                    "SET total_score = LEAST(daily_scores.total_score + EXCLUDED.total_score, %s)",
+                    (user_id, day, min(total, DAILY_SCORE_CAP), DAILY_SCORE_CAP)
+                )
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
+
+def _postgres_scratch_schema(database, schema):
+    """
+    Create schema with the CloudProof tables in the configured PostgreSQL
+    database and route every new pooled connection to it, so the benchmark
+    never writes to the real tables. Returns the PGOPTIONS value to restore.
+    """
+    previous = os.environ.get('PGOPTIONS')
+    database.close_db_connections()
+    os.environ['PGOPTIONS'] = f"{previous or ''} -c search_path={schema}".strip()
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')) as f:
+        ddl = f.read()
+    with database.transaction() as tx:
+        tx.execute(f"CREATE SCHEMA {schema}")
+        tx.execute(ddl)
+    return previous
+
+
+def _drop_postgres_scratch_schema(database, schema, previous_options):
+    try:
+        with database.transaction() as tx:
+            tx.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    finally:
+        database.close_db_connections()
+        if previous_options is None:
+            os.environ.pop('PGOPTIONS', None)
+        else:
+            os.environ['PGOPTIONS'] = previous_options
+
+
+def bench_store(n=100_000, days=365):
+    """
+    store_activities vs the per-row store it replaced, in scratch storage: a
+    temporary SQLite file, or on PostgreSQL a throwaway schema dropped afterwards.
+    """
+    import database
+    from ingestion import store_activities
+
+    tag = uuid.uuid4().hex[:8]
+    scratch, schema, previous_options = None, None, None
+    if database.DB_ENGINE == 'sqlite':
+        scratch = tempfile.mkdtemp(prefix='cloudproof-bench-')
+        original_path = database.SQLITE_DB_PATH
+        database.SQLITE_DB_PATH = os.path.join(scratch, 'bench.db')
+        database.SQLITE_INITIALIZED = False
+    else:
+        schema = f"cloudproof_bench_{tag}"
+        previous_options = _postgres_scratch_schema(database, schema)
+
+    rng    = random.Random(5)
+    corpus = [(source, name) for source, name in _scoring_corpus(20_000) if score_event(source, name)[1] > 0]
+    first  = date(2025, 1, 1).toordinal()
+    try:
+        user_ids = []
+        for label in ('legacy', 'current'):
+            email = f"bench-{label}@example.invalid"
+            database.execute_query("INSERT INTO users (name, email) VALUES (%s, %s)", (f"bench {label}", email))
+            user_ids.append(database.execute_query("SELECT id FROM users WHERE email = %s", (email,), fetch=True)[0]['id'])
+
+        rows = []
+        for i in range(n):
+            source, name = corpus[i % len(corpus)]
+            service, score = score_event(source, name)
+            rows.append((date.fromordinal(first + rng.randrange(days)), service, name, score, f"{tag}-{i}"))
+
+        def activities(user_id):
+            return [
+                {'user_id': user_id, 'date': day, 'service': service, 'action': action, 'score': score,
+                 'event_id': f"{user_id}-{event_id}"}
+                for day, service, action, score, event_id in rows
+            ]
+
+        current = 'bulk load (COPY)' if schema else 'row by row + rollups'
+        print(f"store: {n:,} activities over {days} days into {database.DB_ENGINE}")
+        seconds, totals = [], []
+        for user_id, label, store in ((user_ids[0], 'per-row inserts', _legacy_store_activities),
+                                      (user_ids[1], current, store_activities)):
+            elapsed, _ = _timed(store, activities(user_id))
+            _report(label, elapsed, n, 'activity')
+            seconds.append(elapsed)
+            totals.append([
+                (str(r['date']), r['total_score']) for r in database.execute_query(
+                    "SELECT date, total_score FROM daily_scores WHERE user_id = %s ORDER BY date", (user_id,), fetch=True
+                )
+            ])
+            # Each run starts from the same table size
+            database.execute_query("DELETE FROM activity_logs WHERE user_id = %s", (user_id,))
+        assert totals[0] == totals[1], "store_activities disagrees with per-row daily_scores"
+        if schema:
+            print(f"  speedup: {seconds[0] / seconds[1]:.1f}x")
+        else:
+            # Both insert row by row on SQLite; store_activities also keeps service_daily_totals,
+            # user_summary and the score histogram current
+            print(f"  ratio: {seconds[0] / seconds[1]:.1f}x (the bulk load is PostgreSQL only)")
+    finally:
+        if schema:
+            _drop_postgres_scratch_schema(database, schema, previous_options)
+        if scratch:
+            database.close_db_connections()
+            database.SQLITE_DB_PATH = original_path
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+# ── Queries ───────────────────────────────────────────────────────────────────
+
+def _legacy_sqlite_query(path, query, params=()):
+    """execute_query on SQLite as it was before connections were reused: connect, four PRAGMAs, query, close."""
+    import sqlite3
+
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, check_same_thread=False)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute("PRAGMA cache_size = -32000;")
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def bench_queries(n=20_000):
+    """Per-query overhead of execute_query on SQLite: a connection per call vs the thread's reused connection."""
+    import database
+
+    if database.DB_ENGINE != 'sqlite':
+        print("queries: skipped (DB_ENGINE is not sqlite)")
+        return
+    scratch = tempfile.mkdtemp(prefix='cloudproof-bench-')
+    original_path = database.SQLITE_DB_PATH
+    database.SQLITE_DB_PATH = os.path.join(scratch, 'bench.db')
+    database.SQLITE_INITIALIZED = False
+    try:
+        database.execute_query("INSERT INTO users (name, email) VALUES (%s, %s)", ('bench', 'bench@example.invalid'))
+        query = "SELECT id, name, email FROM users WHERE email = ?"
+        print(f"queries: {n:,} indexed single-row SELECTs")
+
+        def legacy():
+            for _ in range(n):
+                _legacy_sqlite_query(database.SQLITE_DB_PATH, query, ('bench@example.invalid',))
+
+        def reused():
+            for _ in range(n):
+                database.execute_query(query, ('bench@example.invalid',), fetch=True)
+
+        legacy_s, _ = _timed(legacy)
+        _report('connect per query', legacy_s, n, 'query')
+        reused_s, _ = _timed(reused)
+        _report('thread connection', reused_s, n, 'query')
+        print(f"  speedup: {legacy_s / reused_s:.1f}x")
+    finally:
+        database.close_db_connections()
+        database.SQLITE_DB_PATH = original_path
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'scoring': bench_scoring,
+    'parse': bench_parse,
+    'validate': bench_validate,
+    'caps': bench_caps,
+    'store': bench_store,
+    'queries': bench_queries,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit(f"Unknown benchmark '{name}'. Choose from: {', '.join(BENCHMARKS)}")
+        BENCHMARKS[name]()
@@ -1,14 +1,20 @@
+import atexit
+import logging
 import os
+import queue
 import sqlite3
 import time
 import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 
 import psycopg2
-import psycopg2.pool
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 DB_ENGINE = os.getenv("DB_ENGINE", "sqlite").lower()
 BASE_DIR = os.path.dirname(__file__)
@@ -18,8 +24,30 @@ SQLITE_INITIALIZED = False
 # PostgreSQL connection pool (created lazily)
 _pg_pool = None
 _pg_pool_lock = threading.Lock()
+PG_POOL_MIN       = int(os.getenv("DB_POOL_MIN", "2"))
+PG_POOL_MAX       = int(os.getenv("DB_POOL_MAX", "20"))
+PG_POOL_TIMEOUT   = float(os.getenv("DB_POOL_TIMEOUT", "10"))      # Seconds a checkout waits for a free connection
+PG_PING_AFTER     = float(os.getenv("DB_POOL_PING_AFTER", "1"))    # Idle seconds after which a connection is pinged on checkout
+
+# Optional PostgreSQL read replica for execute_query(..., read_only=True)
+REPLICA_DSN           = os.getenv("DB_REPLICA_DSN", "")
+REPLICA_RETRY_SECONDS = 30   # After the replica fails, reads go to the primary this long before retrying it
+_replica_pool = None
+_replica_down_until = 0.0
 _sqlite_init_lock = threading.Lock()
 
+# SQLite connections are kept per thread and reused across queries
+_sqlite_local = threading.local()
+_sqlite_connections = {}   # thread → its connection, for reaping and close_db_connections()
+_sqlite_connections_lock = threading.Lock()
+
+SQLITE_WRITE_BATCH = 64   # Most write jobs group-committed in one SQLite transaction
+
+# The transaction() open on this thread, if any, which queries on the thread join
+_tx_local = threading.local()
+# Held by the SQLite writer thread while it commits and by transaction() blocks
+_sqlite_write_lock = threading.RLock()
+
 
 SQLITE_SCHEMA = """
 CREATE TABLE IF NOT EXISTS users (
@@ -38,6 +66,7 @@ CREATE TABLE IF NOT EXISTS users (
     sync_pin_hash TEXT,
     aws_access_key_encrypted TEXT,
     aws_secret_key_encrypted TEXT,
+    data_version INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -70,6 +99,9 @@ CREATE TABLE IF NOT EXISTS activity_logs (
     score INTEGER NOT NULL,
     event_id TEXT,
     timestamp TIMESTAMP,
+    source_key TEXT,
+    verification_status TEXT DEFAULT 'verified',
+    sync_id TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
     UNIQUE(user_id, event_id)
@@ -84,6 +116,36 @@ CREATE TABLE IF NOT EXISTS daily_scores (
     FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+CREATE TABLE IF NOT EXISTS service_daily_totals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    date DATE NOT NULL,
+    service TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    UNIQUE(user_id, date, service),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS user_summary (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    total_score INTEGER NOT NULL DEFAULT 0,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    longest_streak INTEGER NOT NULL DEFAULT 0,
+    last_active_date DATE,
+    tier TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS score_histogram (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket INTEGER NOT NULL,
+    users INTEGER NOT NULL DEFAULT 0,
+    UNIQUE(bucket)
+);
+
 CREATE TABLE IF NOT EXISTS processing_state (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -92,6 +154,56 @@ CREATE TABLE IF NOT EXISTS processing_state (
     FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+CREATE TABLE IF NOT EXISTS processed_objects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    object_key TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'done',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, object_key, etag),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS s3_listing_checkpoints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    region_prefix TEXT NOT NULL,
+    last_key TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, bucket, region_prefix),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS verification_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    sync_id TEXT,
+    object_key TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    event_name TEXT NOT NULL,
+    event_time TEXT NOT NULL,
+    aws_region TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    checked_at TIMESTAMP,
+    UNIQUE(user_id, event_id),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS verified_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    event_id TEXT NOT NULL,
+    event_name TEXT NOT NULL,
+    verified_at TIMESTAMP NOT NULL,
+    UNIQUE(user_id, event_id),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
 CREATE TABLE IF NOT EXISTS resource_state (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -113,6 +225,15 @@ CREATE INDEX IF NOT EXISTS idx_daily_scores_user_date
 
 CREATE INDEX IF NOT EXISTS idx_resource_state_user
     ON resource_state(user_id, resource_type, state);
+
+CREATE INDEX IF NOT EXISTS idx_verification_queue_status
+    ON verification_queue(status, id);
+
+CREATE INDEX IF NOT EXISTS idx_verification_queue_object
+    ON verification_queue(user_id, object_key);
+
+CREATE INDEX IF NOT EXISTS idx_verified_events_verified_at
+    ON verified_events(verified_at);
 """
 
 
@@ -123,14 +244,51 @@ def get_db_connection(retries=3):
         return _get_postgres_connection(retries=retries)
 
 
+def release_db_connection(conn):
+    """
+    Return a connection from get_db_connection() — to the pool on Postgres.
+    On SQLite it stays open for the thread's next query; anything left
+    uncommitted is rolled back.
+    """
+    if DB_ENGINE != "sqlite" and _pg_pool:
+        _pg_pool.putconn(conn)
+    elif DB_ENGINE == "sqlite":
+        tx = getattr(_tx_local, 'tx', None)
+        if conn.in_transaction and (tx is None or tx.conn is not conn):
+            conn.rollback()
+    else:
+        conn.close()
+
+
+def close_db_connections():
+    """Close every cached SQLite connection and the Postgres pools (process shutdown, tests)."""
+    global _pg_pool, _replica_pool
+    with _sqlite_connections_lock:
+        connections = list(_sqlite_connections.values())
+        _sqlite_connections.clear()
+    for conn in connections:
+        _close_quietly(conn)
+    _sqlite_local.__dict__.clear()
+    with _pg_pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool = None
+        if _replica_pool is not None:
+            _replica_pool.closeall()
+            _replica_pool = None
+
+
+atexit.register(close_db_connections)
+
+
 def _get_postgres_connection(retries=3):
     global _pg_pool
     if _pg_pool is None:
         with _pg_pool_lock:
             if _pg_pool is None:
-                _pg_pool = psycopg2.pool.ThreadedConnectionPool(
-                    minconn=2,
-                    maxconn=20,
+                _pg_pool = _PostgresPool(
+                    minconn=PG_POOL_MIN,
+                    maxconn=PG_POOL_MAX,
                     host=os.getenv("DB_HOST", "localhost"),
                     port=os.getenv("DB_PORT", "5432"),
                     database=os.getenv("DB_NAME", "cloudproof"),
@@ -140,7 +298,7 @@ def _get_postgres_connection(retries=3):
                 )
     for attempt in range(retries):
         try:
-            return _pg_pool.getconn()
+            return _pg_pool.getconn(timeout=PG_POOL_TIMEOUT)
         except psycopg2.OperationalError as e:
             if attempt < retries - 1:
                 time.sleep(2)
@@ -148,8 +306,248 @@ def _get_postgres_connection(retries=3):
             raise Exception(f"Database connection failed after {retries} attempts: {str(e)}")
 
 
+def _get_replica_pool():
+    global _replica_pool
+    if _replica_pool is None:
+        with _pg_pool_lock:
+            if _replica_pool is None:
+                _replica_pool = _PostgresPool(
+                    minconn=PG_POOL_MIN,
+                    maxconn=PG_POOL_MAX,
+                    name='replica',
+                    dsn=REPLICA_DSN,
+                    connect_timeout=5,
+                )
+    return _replica_pool
+
+
+def _read_from_replica(query, params):
+    """
+    Rows of a read run on the replica, or None when the replica cannot serve
+    it right now so the caller reads the primary instead. A connection failure
+    keeps reads off the replica for REPLICA_RETRY_SECONDS.
+    """
+    global _replica_down_until
+    if time.monotonic() < _replica_down_until:
+        return None
+    pool = conn = None
+    try:
+        pool = _get_replica_pool()
+        conn = pool.getconn(timeout=PG_POOL_TIMEOUT)
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        conn.rollback()   # End the read's transaction
+        return rows
+    except PoolTimeout:
+        return None
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        logger.warning(f"Read replica unavailable, using the primary for {REPLICA_RETRY_SECONDS}s: {str(e)}")
+        _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        return None
+    finally:
+        if conn is not None:
+            pool.putconn(conn)
+
+
+def pool_stats(replica=False):
+    """Counters of the PostgreSQL (or replica) pool — see _PostgresPool.stats — or None before it exists / on SQLite."""
+    pool = _replica_pool if replica else _pg_pool
+    return pool.stats() if pool is not None else None
+
+
+def set_pool_metrics_hook(hook):
+    """
+    Call hook(event, stats) on pool events: 'checkout' (stats include the
+    wait), 'exhausted' (a checkout gave up after DB_POOL_TIMEOUT) and
+    'reconnect' (a dead connection was replaced). Pass None to remove it.
+    The hook runs on the checking-out thread; exceptions from it are ignored.
+    """
+    global _pool_metrics_hook
+    _pool_metrics_hook = hook
+
+
+_pool_metrics_hook = None
+
+
+class PoolTimeout(Exception):
+    """No PostgreSQL connection came free within DB_POOL_TIMEOUT."""
+
+
+# ── PostgreSQL pool ───────────────────────────────────────────────────────────
+# psycopg2's ThreadedConnectionPool raises PoolError the moment all maxconn
+# connections are out, and closes every returned connection beyond minconn, so
+# a busy sync reconnects constantly. This pool keeps up to maxconn idle
+# connections (most recently used first), makes checkout wait up to a timeout
+# for one to come free, pings connections that have sat idle before handing
+# them out so a database restart is absorbed here, and counts what happens.
+
+class _PostgresPool:
+    def __init__(self, minconn, maxconn, name='primary', **connect_kwargs):
+        self.name = name
+        self.maxconn = maxconn
+        self.connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = []   # (connection, monotonic time it was returned)
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.exhaustions = 0
+        self.reconnects = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(**self.connect_kwargs)
+
+    def getconn(self, timeout=None):
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.exhaustions += 1
+                self._emit('exhausted')
+                raise PoolTimeout(f"No database connection free after {timeout}s ({self.maxconn} in use)")
+        waited = time.monotonic() - started
+
+        try:
+            conn = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+        self._emit('checkout', waited)
+        return conn
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if time.monotonic() - returned_at < PG_PING_AFTER or self._alive(conn):
+                return conn
+            _close_quietly(conn)
+            with self._lock:
+                self.reconnects += 1
+            self._emit('reconnect')
+        return self._connect()
+
+    @staticmethod
+    def _alive(conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn, close=False):
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed:
+            _close_quietly(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pool':         self.name,
+                'in_use':       self.in_use,
+                'idle':         len(self._idle),
+                'waiting':      self.waiting,
+                'max':          self.maxconn,
+                'checkouts':    self.checkouts,
+                'exhaustions':  self.exhaustions,
+                'reconnects':   self.reconnects,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'max_wait':     round(self.max_wait, 3),
+            }
+
+    def _emit(self, event, waited=None):
+        hook = _pool_metrics_hook
+        if hook is None:
+            return
+        stats = self.stats()
+        if waited is not None:
+            stats['wait'] = waited
+        try:
+            hook(event, stats)
+        except Exception:
+            pass
+
+
 def _get_sqlite_connection():
-    """Return a SQLite connection with WAL mode for better concurrent reads."""
+    """
+    This thread's SQLite connection, opened on first use and reused after.
+    A connection that was closed, or that points at a previous SQLITE_DB_PATH,
+    is replaced; connections of threads that have exited are closed then too.
+    """
+    conn = getattr(_sqlite_local, 'conn', None)
+    if conn is not None:
+        if _sqlite_local.path == SQLITE_DB_PATH and _sqlite_healthy(conn):
+            return conn
+        _close_quietly(conn)
+
+    conn = _open_sqlite_connection()
+    _sqlite_local.conn = conn
+    _sqlite_local.path = SQLITE_DB_PATH
+    with _sqlite_connections_lock:
+        for thread in [t for t in _sqlite_connections if not t.is_alive()]:
+            _close_quietly(_sqlite_connections.pop(thread))
+        _sqlite_connections[threading.current_thread()] = conn
+    return conn
+
+
+def _sqlite_healthy(conn):
+    try:
+        conn.total_changes  # Raises once the connection is closed
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _open_sqlite_connection():
+    """Open a SQLite connection with WAL mode for better concurrent reads; PRAGMAs run once here."""
     global SQLITE_INITIALIZED
 
     conn = sqlite3.connect(
@@ -196,7 +594,14 @@ def _migrate_sqlite(conn: sqlite3.Connection):
         "ALTER TABLE users ADD COLUMN aws_account_id TEXT",
         "ALTER TABLE users ADD COLUMN aws_user_arn TEXT",
         "ALTER TABLE users ADD COLUMN last_auto_synced_at TIMESTAMP",
+        "ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0",
         "ALTER TABLE activity_logs ADD COLUMN event_id TEXT",
+        "ALTER TABLE activity_logs ADD COLUMN source_key TEXT",
+        "ALTER TABLE activity_logs ADD COLUMN verification_status TEXT DEFAULT 'verified'",
+        "ALTER TABLE activity_logs ADD COLUMN sync_id TEXT",
+        "ALTER TABLE verification_queue ADD COLUMN sync_id TEXT",
+        "ALTER TABLE processed_objects ADD COLUMN status TEXT NOT NULL DEFAULT 'done'",
+        "ALTER TABLE processed_objects ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
     ]
     for sql in new_columns:
         try:
@@ -211,11 +616,142 @@ def _migrate_sqlite(conn: sqlite3.Connection):
             "CREATE UNIQUE INDEX IF NOT EXISTS idx_activity_logs_event_id "
             "ON activity_logs(user_id, event_id) WHERE event_id IS NOT NULL"
         )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_activity_logs_source "
+            "ON activity_logs(user_id, source_key) WHERE source_key IS NOT NULL"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_activity_logs_sync "
+            "ON activity_logs(user_id, sync_id) WHERE sync_id IS NOT NULL"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_verification_queue_sync "
+            "ON verification_queue(user_id, sync_id, status)"
+        )
         conn.commit()
     except Exception:
         pass
 
 
+# ── SQLite single writer ──────────────────────────────────────────────────────
+# SQLite allows one writer at a time. Rather than every thread opening its own
+# connection and racing for the WAL write lock ("database is locked"), writes
+# are handed to one thread that owns one connection. It drains whatever jobs
+# are queued, runs each in its own SAVEPOINT inside a single BEGIN IMMEDIATE
+# transaction, and commits them together; a failing job only rolls back
+# itself. Reads keep using their own connections.
+
+class _SQLiteWriter:
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.conn = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, fn):
+        future = Future()
+        if self.thread is None:
+            with self._start_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                    self.thread.start()
+        self.jobs.put((fn, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < SQLITE_WRITE_BATCH:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        done = []
+        with _sqlite_write_lock:
+            self._commit_locked(batch, done)
+        for future, result in done:
+            future.set_result(result)
+
+    def _commit_locked(self, batch, done):
+        try:
+            self.conn = _get_sqlite_connection()
+            self.conn.execute("BEGIN IMMEDIATE")
+            _tx_local.tx = Transaction(self.conn)   # Writes issued from inside a job join it
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor = self.conn.cursor()
+                cursor.execute("SAVEPOINT write_job")
+                try:
+                    result = fn(cursor)
+                    cursor.execute("RELEASE write_job")
+                    done.append((future, result))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write_job")
+                    cursor.execute("RELEASE write_job")
+                    future.set_exception(e)
+                finally:
+                    cursor.close()
+            self.conn.commit()
+        except Exception as e:
+            if self.conn is not None and self.conn.in_transaction:
+                self.conn.rollback()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            done.clear()
+        finally:
+            _tx_local.tx = None
+
+
+_sqlite_writer = _SQLiteWriter()
+
+
+def submit_write(fn):
+    """
+    Queue fn(cursor) to run in a write transaction and return a Future of its
+    result. On SQLite it runs on the writer thread, group-committed with other
+    writes; on PostgreSQL it runs right away on a pooled connection. Inside
+    transaction() it runs at once as part of that transaction.
+    """
+    tx = getattr(_tx_local, 'tx', None)
+    if tx is not None:
+        future = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn(tx.conn.cursor()))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    if DB_ENGINE == "sqlite":
+        return _sqlite_writer.submit(fn)
+    future = Future()
+    future.set_running_or_notify_cancel()
+    conn = get_db_connection()
+    try:
+        result = fn(conn.cursor())
+        conn.commit()
+        future.set_result(result)
+    except Exception as e:
+        conn.rollback()
+        future.set_exception(e)
+    finally:
+        release_db_connection(conn)
+    return future
+
+
+def run_write(fn):
+    """Run fn(cursor) in a write transaction (see submit_write) and return its result."""
+    return submit_write(fn).result()
+
+
+def _is_read_query(query):
+    return query.lstrip()[:7].upper().startswith(('SELECT', 'PRAGMA', 'EXPLAIN'))
+
+
 def _convert_sqlite_placeholders(query, params):
     """
     Convert psycopg2-style %s placeholders to SQLite ? placeholders.
@@ -233,10 +769,33 @@ def _convert_sqlite_placeholders(query, params):
     return query, params
 
 
-def execute_query(query, params=None, fetch=False):
+def execute_query(query, params=None, fetch=False, read_only=False):
+    """
+    Run one statement and commit it. read_only=True marks a SELECT that may be
+    served by the read replica (DB_REPLICA_DSN) when one is configured; it can
+    lag the primary slightly, so use it for pages, not read-modify-write.
+    """
+    tx = getattr(_tx_local, 'tx', None)
+    if tx is not None:
+        try:
+            rows = tx.execute(query, params, fetch=fetch)
+        except Exception as e:
+            raise Exception(f"Query execution failed: {str(e)}")
+        return rows if fetch else None
+
+    if DB_ENGINE == "sqlite" and not _is_read_query(query):
+        return _execute_sqlite_write(query, params, fetch)
+
+    if read_only and fetch and REPLICA_DSN and DB_ENGINE != "sqlite":
+        try:
+            rows = _read_from_replica(query, params)
+        except Exception as e:
+            raise Exception(f"Query execution failed: {str(e)}")
+        if rows is not None:
+            return rows
+
     conn = None
     cursor = None
-    is_pooled = DB_ENGINE != 'sqlite'
     try:
         conn = get_db_connection()
 
@@ -264,7 +823,129 @@ def execute_query(query, params=None, fetch=False):
         if cursor:
             cursor.close()
         if conn:
-            if is_pooled and _pg_pool:
-                _pg_pool.putconn(conn)  # return to pool instead of closing
-            else:
-                conn.close()
+            release_db_connection(conn)  # back to the pool, or kept for this thread on SQLite
+
+
+def _execute_sqlite_write(query, params, fetch):
+    query, params = _convert_sqlite_placeholders(query, params)
+
+    def write(cursor):
+        cursor.execute(query, params or [])
+        return [dict(row) for row in cursor.fetchall()] if fetch else None
+
+    try:
+        return run_write(write)
+    except Exception as e:
+        raise Exception(f"Query execution failed: {str(e)}")
+
+
+def fetch_one(query, params=None):
+    """The first row of a SELECT as a dict, or None."""
+    rows = execute_query(query, params, fetch=True)
+    return rows[0] if rows else None
+
+
+def execute_many(query, params_seq):
+    """
+    Run one statement for every parameter tuple in a single write transaction
+    and return the number of rows affected.
+    """
+    if DB_ENGINE == "sqlite":
+        query = query.replace("%s", "?")
+    params_seq = [tuple(params) for params in params_seq]
+    if not params_seq:
+        return 0
+
+    def write(cursor):
+        cursor.executemany(query, params_seq)
+        return cursor.rowcount
+
+    try:
+        return run_write(write)
+    except Exception as e:
+        raise Exception(f"Query execution failed: {str(e)}")
+
+
+# ── Transactions ──────────────────────────────────────────────────────────────
+# execute_query() commits each statement on its own connection checkout. A
+# transaction() block keeps one connection for several statements and commits
+# them once, or rolls all of them back if the block raises. Anything the same
+# thread runs inside the block — execute_query(), fetch_one(), execute_many(),
+# run_write() — joins it, and a nested transaction() is part of the outer one.
+#
+# On SQLite the block takes the write lock up front (BEGIN IMMEDIATE) and holds
+# off the writer thread until it ends, so keep it short and never wait on
+# another thread's writes from inside it.
+
+class Transaction:
+    """One connection inside transaction(). Queries use %s placeholders on both engines."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _cursor(self):
+        if DB_ENGINE == "sqlite":
+            return self.conn.cursor()
+        return self.conn.cursor(cursor_factory=RealDictCursor)
+
+    def execute(self, query, params=None, fetch=False):
+        """Run one statement; returns its rows as dicts if fetch, else the row count."""
+        if DB_ENGINE == "sqlite":
+            query, params = _convert_sqlite_placeholders(query, params)
+            params = params or []
+        cursor = self._cursor()
+        try:
+            cursor.execute(query, params)
+            if fetch:
+                return [dict(row) for row in cursor.fetchall()]
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+    def fetch_all(self, query, params=None):
+        return self.execute(query, params, fetch=True)
+
+    def fetch_one(self, query, params=None):
+        rows = self.execute(query, params, fetch=True)
+        return rows[0] if rows else None
+
+    def execute_many(self, query, params_seq):
+        return execute_many(query, params_seq)
+
+
+@contextmanager
+def transaction():
+    """
+    with transaction() as tx:
+        row = tx.fetch_one("SELECT ... WHERE id = %s", (id,))
+        tx.execute("UPDATE ...", (...))
+    """
+    outer = getattr(_tx_local, 'tx', None)
+    if outer is not None:
+        yield outer
+        return
+
+    if DB_ENGINE == "sqlite":
+        with _sqlite_write_lock:
+            conn = _get_sqlite_connection()
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("BEGIN IMMEDIATE")
+            yield from _run_transaction(conn)
+    else:
+        conn = get_db_connection()
+        yield from _run_transaction(conn)
+
+
+def _run_transaction(conn):
+    tx = Transaction(conn)
+    _tx_local.tx = tx
+    try:
+        yield tx
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _tx_local.tx = None
+        release_db_connection(conn)
@@ -1,14 +1,25 @@
+import asyncio
 import boto3
+import codecs
+import io
 import json
-import gzip
+import multiprocessing
+import queue
 import re
-import random
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timedelta
-from io import BytesIO
-from scoring import calculate_score, DAILY_SCORE_CAP, SERVICE_DAILY_CAP, ACTION_DAILY_CAP
+import uuid
+import zlib
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from scoring import score_event, DAILY_SCORE_CAP
+from activities import ActivityBatch, ActivityBatchBuilder, CapTotals, apply_caps, PROVISIONAL, VERIFIED
+from verification import (
+    VerificationPlanner, cached_event_names, cloudtrail_client, lookup_event_name, pick_sample, remember_verified,
+)
 from database import execute_query
+from summaries import bump_data_version, update_user_summaries
+from leaderboard import refresh_users
 import logging
 import os
 
@@ -28,560 +39,1134 @@ def assume_role(role_arn):
         logger.error(f"Failed to assume role {role_arn}: {str(e)}")
         raise
 
-def process_cloudtrail_logs(user_id, role_arn, bucket_name):
-    try:
-        credentials = assume_role(role_arn)
-        
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretAccessKey'],
-            aws_session_token=credentials['SessionToken']
-        )
-        
-        last_processed = get_last_processed_timestamp(user_id)
-        cutoff_time = last_processed or datetime.now() - timedelta(days=7)
-        
-        paginator = s3.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=bucket_name, Prefix='AWSLogs/')
-        
-        activities = []
-        daily_service_scores = {}
-        daily_totals = {}
-        daily_action_scores = {}
-        
-        for page in page_iterator:
-            for obj in page.get('Contents', []):
-                if obj['LastModified'].replace(tzinfo=None) <= cutoff_time:
-                    continue
-                    
-                if not obj['Key'].endswith('.json.gz'):
-                    continue
-                
-                try:
-                    file_obj = s3.get_object(Bucket=bucket_name, Key=obj['Key'])
-                    
-                    with gzip.GzipFile(fileobj=BytesIO(file_obj['Body'].read())) as gzipfile:
-                        content = gzipfile.read()
-                        log_data = json.loads(content)
-                        
-                        for record in log_data.get('Records', []):
-                            try:
-                                event_time = datetime.strptime(record['eventTime'], '%Y-%m-%dT%H:%M:%SZ')
-                                service = record.get('eventSource', '').split('.')[0].upper()
-                                action = record.get('eventName', '')
-                                
-                                if not service or not action:
-                                    continue
-                                
-                                score = calculate_score(service, action)
-                                
-                                if score > 0:
-                                    date_key = event_time.date()
-                                    service_key = f"{date_key}_{service}"
-                                    action_key = f"{date_key}_{service}_{action}"
-                                    
-                                    # Apply daily caps
-                                    if date_key not in daily_totals:
-                                        daily_totals[date_key] = 0
-                                    if service_key not in daily_service_scores:
-                                        daily_service_scores[service_key] = 0
-                                    if action_key not in daily_action_scores:
-                                        daily_action_scores[action_key] = 0
-                                    
-                                    if daily_totals[date_key] >= DAILY_SCORE_CAP:
-                                        continue
-                                    if daily_service_scores[service_key] >= SERVICE_DAILY_CAP:
-                                        continue
-                                    if daily_action_scores[action_key] >= ACTION_DAILY_CAP:
-                                        continue
-                                    
-                                    activities.append({
-                                        'user_id': user_id,
-                                        'date': date_key,
-                                        'service': service,
-                                        'action': action,
-                                        'score': score
-                                    })
-                                    
-                                    daily_totals[date_key] += score
-                                    daily_service_scores[service_key] += score
-                                    daily_action_scores[action_key] += score
-                                    
-                            except Exception as e:
-                                logger.warning(f"Error processing record: {str(e)}")
-                                continue
-                                
-                except Exception as e:
-                    logger.warning(f"Error processing file {obj['Key']}: {str(e)}")
+
+# ── Streaming decode ──────────────────────────────────────────────────────────
+# CloudTrail files are read as a stream: compressed bytes → incremental inflate
+# → incremental UTF-8 decode → pull parser that yields one record at a time.
+# Peak memory per worker is bounded by the largest record, not the file size.
+
+STREAM_CHUNK_SIZE = 64 * 1024
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_JSON_WS = re.compile(r'[ \t\n\r]*')
+_JSON_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+
+def _iter_text_chunks(fileobj, compressed=False):
+    """Yield decoded text from a binary stream, inflating gzip on the fly."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    inflater = zlib.decompressobj(_GZIP_WBITS) if compressed else None
+
+    while True:
+        chunk = fileobj.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        if inflater is None:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+            continue
+
+        pending = chunk
+        while pending:
+            # Cap each inflate step so a highly compressible chunk cannot balloon
+            data = inflater.decompress(pending, STREAM_CHUNK_SIZE * 4)
+            pending = inflater.unconsumed_tail
+            if inflater.eof and inflater.unused_data:
+                # Concatenated gzip members — continue with a fresh inflater
+                pending = inflater.unused_data
+                inflater = zlib.decompressobj(_GZIP_WBITS)
+            text = decoder.decode(data)
+            if text:
+                yield text
+
+    if inflater is not None:
+        if not inflater.eof:
+            raise ValueError("Truncated gzip stream")
+        text = decoder.decode(inflater.flush())
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+class _JsonPullParser:
+    """Minimal pull parser over text chunks — just enough to walk {"Records": [...]}."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buf = ''
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            self._pos = _JSON_WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Malformed log JSON: expected {char!r}, found {found!r}")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, pulling more text as needed."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
                     continue
-        
-        if activities:
-            store_activities(activities)
-            logger.info(f"Stored {len(activities)} activities for user {user_id}")
+                raise
+            # A number ending at or just short of the buffer edge may be truncated:
+            # '3.' | '25' decodes as 3 and '1e' | '5' as 1 until the rest arrives
+            if (isinstance(obj, (int, float)) and not isinstance(obj, bool)
+                    and _JSON_NUMBER_TAIL.match(self._buf, end).end() == len(self._buf)
+                    and self._fill()):
+                continue
+            self._pos = end
+            return obj
 
-        update_last_processed_timestamp(user_id, datetime.now())
 
-        return len(activities)
-        
-    except Exception as e:
-        logger.error(f"Error in process_cloudtrail_logs: {str(e)}")
-        raise
+def iter_cloudtrail_records(fileobj, compressed=False):
+    """
+    Yield CloudTrail records one at a time from a JSON (or gzipped JSON) stream.
+    fileobj only needs a read(n) method — botocore StreamingBody or an open file.
+    """
+    parser = _JsonPullParser(_iter_text_chunks(fileobj, compressed))
+    parser.expect('{')
+    if parser.peek() == '}':
+        return
+
+    while True:
+        key = parser.value()
+        parser.expect(':')
+        if key == 'Records' and parser.peek() == '[':
+            parser.expect('[')
+            if parser.peek() == ']':
+                parser.expect(']')
+            else:
+                while True:
+                    yield parser.value()
+                    if parser.peek() == ']':
+                        parser.expect(']')
+                        break
+                    parser.expect(',')
+        else:
+            parser.value()  # skip unrelated top-level keys
+
+        if parser.peek() == '}':
+            return
+        parser.expect(',')
 
 
 # ── Fraud Prevention ─────────────────────────────────────────────────────────
+# Layers 1 and 2 are checked record-by-record while the file streams in, so a
+# forged file is abandoned at its first bad record without reading the rest.
+# _classify_record fuses both layers with scoring: each record's fields are
+# read once, eventTime is parsed once, and only scored records are kept as
+# Layer 3 samples.
 
-def _validate_arn_ownership(records, registered_account_id):
-    """Layer 1: Verify every event ARN belongs to the registered AWS account."""
-    if not registered_account_id:
-        return True
-    for record in records:
-        arn = record.get('userIdentity', {}).get('arn', '')
-        if arn:
-            parts = arn.split(':')
-            if len(parts) >= 5 and parts[4] and parts[4] != registered_account_id:
-                logger.warning(f"ARN mismatch: {arn} vs registered {registered_account_id}")
-                return False
-    return True
+_UUID_PATTERN = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+)
+_FILENAME_TIME_PATTERN = re.compile(r'_(\d{8}T\d{4}Z)_')
+_KEY_DAY_PATTERN       = re.compile(r'/(\d{4})/(\d{2})/(\d{2})/')
 
+# Fields kept from each scoreable record for Layer 3 sampling
+_VERIFY_FIELDS = ('eventID', 'eventName', 'eventTime', 'eventSource', 'awsRegion', 'readOnly')
 
-def _validate_log_metadata(records, s3_key):
-    """Layer 2: Validate structural patterns - catches manually crafted fake logs."""
-    uuid_pattern = re.compile(
-        r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
-    )
+
+_SUSPICIOUS_SOURCE_IPS = frozenset(('127.0.0.1', 'localhost', '0.0.0.0'))
+_EVENT_TIME_WINDOW     = 7200   # Max seconds between eventTime and the file's delivery time
+
+_REJECT_ARN      = object()
+_REJECT_METADATA = object()
+
+_day_ordinals = {}   # 'YYYY-MM-DD' -> date ordinal, shared across files
+
+
+def _parse_event_time(value):
+    """
+    Split a CloudTrail 'YYYY-MM-DDTHH:MM:SSZ' timestamp into (date ordinal, second of day)
+    by slicing, caching the date part. Anything not in that exact shape goes through
+    strptime, so malformed values raise ValueError just as before.
+    """
+    if len(value) == 20 and value[19] == 'Z' and value[10] == 'T':
+        day = _day_ordinals.get(value[:10])
+        if day is None and value[4] == '-' and value[7] == '-':
+            day = date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal()
+            if len(_day_ordinals) > 10_000:
+                _day_ordinals.clear()
+            _day_ordinals[value[:10]] = day
+        clock = value[11:13] + value[14:16] + value[17:19]
+        if day is not None and value[13] == ':' and value[16] == ':' and clock.isascii() and clock.isdigit():
+            hour, minute, second = int(clock[0:2]), int(clock[2:4]), int(clock[4:6])
+            if hour < 24 and minute < 60 and second < 60:
+                return day, hour * 3600 + minute * 60 + second
+    event_time = datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+    return event_time.toordinal(), event_time.hour * 3600 + event_time.minute * 60 + event_time.second
+
+
+def _filename_timestamp(s3_key):
+    """Parse the delivery timestamp embedded in a CloudTrail file name, if any."""
     filename = s3_key.split('/')[-1]
-    time_match = re.search(r'_(\d{8}T\d{4}Z)_', filename)
-    filename_time = None
+    time_match = _FILENAME_TIME_PATTERN.search(filename)
     if time_match:
         try:
-            filename_time = datetime.strptime(time_match.group(1), '%Y%m%dT%H%MZ')
+            return datetime.strptime(time_match.group(1), '%Y%m%dT%H%MZ')
         except Exception:
             pass
+    return None
 
-    for record in records:
-        # Check 1: eventID must be valid UUID
-        event_id = record.get('eventID', '')
-        if event_id and not uuid_pattern.match(event_id):
+
+def _classify_record(record, s3_key, fraud_checks, registered_account_id, filename_seconds):
+    """
+    Validate and score one record in a single walk over its fields.
+
+    With fraud_checks, applies Layer 1 (the event ARN belongs to the registered
+    account) and Layer 2 (eventID is a UUID, eventTime is within two hours of
+    the file's delivery time, sourceIPAddress is not a loopback address).
+    filename_seconds is the delivery time as ordinal * 86400 + second of day.
+
+    Returns _REJECT_ARN or _REJECT_METADATA if the file must be rejected, None if
+    the record scores nothing, else (day ordinal, service, action, score, event_id).
+    Raises ValueError if a scoreable record has a malformed eventTime.
+    """
+    event_id   = record.get('eventID')
+    event_time = record.get('eventTime')
+    parsed     = None
+
+    if fraud_checks:
+        if registered_account_id:
+            arn = (record.get('userIdentity') or {}).get('arn', '')
+            if arn:
+                parts = arn.split(':', 5)
+                if len(parts) >= 5 and parts[4] and parts[4] != registered_account_id:
+                    logger.warning(f"ARN mismatch: {arn} vs registered {registered_account_id}")
+                    return _REJECT_ARN
+
+        if event_id and not _UUID_PATTERN.match(event_id):
             logger.warning(f"Invalid eventID format: {event_id} in {s3_key}")
-            return False
+            return _REJECT_METADATA
 
-        # Check 2: eventTime must be within 2 hours of filename timestamp
-        if filename_time:
+        if filename_seconds is not None and event_time:
             try:
-                event_time = datetime.strptime(record['eventTime'], '%Y-%m-%dT%H:%M:%SZ')
-                if abs((event_time - filename_time).total_seconds()) > 7200:
-                    logger.warning(f"Event time {event_time} too far from filename time {filename_time}")
-                    return False
-            except Exception:
-                pass
-
-        # Check 3: Suspicious source IPs
+                parsed = _parse_event_time(event_time)
+            except ValueError:
+                parsed = None
+            else:
+                if abs(parsed[0] * 86400 + parsed[1] - filename_seconds) > _EVENT_TIME_WINDOW:
+                    logger.warning(f"Event time {event_time} too far from filename time in {s3_key}")
+                    return _REJECT_METADATA
+
         source_ip = record.get('sourceIPAddress', '')
-        if source_ip in ['127.0.0.1', 'localhost', '0.0.0.0']:
+        if source_ip in _SUSPICIOUS_SOURCE_IPS:
             logger.warning(f"Suspicious sourceIPAddress: {source_ip} in {s3_key}")
-            return False
+            return _REJECT_METADATA
 
-    return True
+    read_only = record.get('readOnly')
+    if read_only is True or (isinstance(read_only, str) and read_only.lower() == 'true'):
+        return None
 
+    event_source = record.get('eventSource', '')
+    event_name   = record.get('eventName', '')
+    if not event_time or not event_source or not event_name:
+        return None
 
-def _verify_sample_via_api(records, ak, sk, region, sample_rate=0.1):
-    """Layer 3: Randomly verify 10% of scoreable events via CloudTrail API - cannot be faked."""
-    if not ak or not sk:
-        return True
+    service, score = score_event(event_source, event_name)
+    if not service or score <= 0:
+        return None
 
-    # Only verify events that actually score points (not read-only actions)
-    from scoring import calculate_score, should_ignore_action
-    scoreable = [
-        r for r in records
-        if r.get('eventID')
-        and not r.get('readOnly', False)
-        and not should_ignore_action(r.get('eventName', ''))
-        and calculate_score(
-            r.get('eventSource', '').split('.')[0].upper(),
-            r.get('eventName', '')
-        ) > 0
-    ]
-    if not scoreable:
-        return True
+    if parsed is None:
+        parsed = _parse_event_time(event_time)
+    return parsed[0], service, event_name, score, event_id
 
-    sample_size = max(1, int(len(scoreable) * sample_rate))
-    sample = random.sample(scoreable, min(sample_size, len(scoreable)))
 
+def _verify_sample_via_api(sample, ak, sk, region, user_id=None):
+    """Layer 3, inline: look every sampled event up via the CloudTrail API - cannot be faked.
+    Used when API_VERIFICATION_MODE is 'inline'; the default queues samples instead (verification.py).
+    With a user_id, events confirmed recently are answered from the verified_events cache."""
+    if not ak or not sk or not sample:
+        return True
+
+    cached    = cached_event_names(user_id, [r.get('eventID') for r in sample]) if user_id else {}
+    confirmed = []
     try:
-        # Group records by region so we create one client per region, not per record
-        from collections import defaultdict
-        by_region = defaultdict(list)
         for record in sample:
-            event_region = record.get('awsRegion') or region
-            by_region[event_region].append(record)
-
-        for event_region, region_records in by_region.items():
-            cloudtrail = boto3.client(
-                'cloudtrail',
-                aws_access_key_id=ak,
-                aws_secret_access_key=sk,
-                region_name=event_region
-            )
-            for record in region_records:
-                event_id    = record.get('eventID')
-                event_name  = record.get('eventName')
-                event_time  = datetime.strptime(record['eventTime'], '%Y-%m-%dT%H:%M:%SZ')
-
-                response = cloudtrail.lookup_events(
-                    LookupAttributes=[{'AttributeKey': 'EventId', 'AttributeValue': event_id}],
-                    StartTime=event_time - timedelta(minutes=20),
-                    EndTime=event_time   + timedelta(minutes=20),
-                    MaxResults=1
-                )
-                if not response.get('Events'):
-                    logger.warning(f"Event {event_id} ({event_name}) not found in CloudTrail API - possible fake!")
-                    return False
-
-                api_name = response['Events'][0].get('EventName', '')
-                if api_name != event_name:
-                    logger.warning(f"Event name mismatch: log={event_name} api={api_name}")
-                    return False
+            event_id   = record.get('eventID')
+            event_name = record.get('eventName')
+            api_name   = cached.get(event_id)
+            if api_name is None:
+                cloudtrail = cloudtrail_client(ak, sk, record.get('awsRegion') or region)
+                api_name   = lookup_event_name(cloudtrail, event_id, record['eventTime'])
+                if api_name == event_name:
+                    confirmed.append((event_id, event_name))
+            if api_name is None:
+                logger.warning(f"Event {event_id} ({event_name}) not found in CloudTrail API - possible fake!")
+                return False
+            if api_name != event_name:
+                logger.warning(f"Event name mismatch: log={event_name} api={api_name}")
+                return False
 
     except Exception as e:
         logger.warning(f"CloudTrail API verification skipped: {e}")
 
-    return True
-
-
-# ── Main ingestion ────────────────────────────────────────────────────────────
+    finally:
+        if user_id:
+            remember_verified(user_id, confirmed)
 
-def process_user_s3_logs(
-    user_id: int,
-    bucket_name: str,
-    s3_prefix: str = '',
-    aws_region: str = 'us-east-1',
-    aws_access_key: str = None,
-    aws_secret_key: str = None,
-    progress_callback=None,
-) -> int:
-    """
-    Process CloudTrail logs for a specific user from their own S3 bucket.
-    If aws_access_key/aws_secret_key are provided, uses those credentials.
-    Otherwise falls back to the machine's ambient AWS credential chain.
+    return True
 
-    progress_callback(event, value) is called with:
-      ('total', n)       — total number of files to process
-      ('batch_done', n)  — n records processed in the latest batch
-    """
-    WORKERS = 25
 
-    if aws_access_key and aws_secret_key:
-        s3 = boto3.client(
-            's3',
-            region_name=aws_region,
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key,
-            config=boto3.session.Config(max_pool_connections=WORKERS),
-        )
-    else:
-        s3 = boto3.client(
-            's3',
-            region_name=aws_region,
-            config=boto3.session.Config(max_pool_connections=WORKERS),
-        )
+def _key_day(key):
+    """Delivery day of a CloudTrail key, as a date ordinal from its /YYYY/MM/DD/ partition, or None."""
+    match = _KEY_DAY_PATTERN.search(key)
+    if not match:
+        return None
+    try:
+        return date(*map(int, match.groups())).toordinal()
+    except ValueError:
+        return None
 
-    # Fetch registered AWS account ID for fraud validation
-    user_row = execute_query(
-        "SELECT aws_account_id FROM users WHERE id = %s",
-        (user_id,), fetch=True
-    )
-    registered_account_id = user_row[0]['aws_account_id'] if user_row else None
 
-    last_processed = get_last_processed_timestamp(user_id)
-    if last_processed is not None:
-        last_processed = last_processed.replace(tzinfo=None)
-
-    # ── Collect all eligible file keys first so we can report a total ─────────
-    file_keys = []
-    paginator = s3.get_paginator('list_objects_v2')
-    paginate_kwargs = {'Bucket': bucket_name}
-    if s3_prefix:
-        paginate_kwargs['Prefix'] = s3_prefix
-
-    for page in paginator.paginate(**paginate_kwargs):
-        for obj in page.get('Contents', []):
-            key = obj.get('Key')
-            if not key:
-                continue
-            if last_processed is not None:
-                if obj['LastModified'].replace(tzinfo=None) <= last_processed:
-                    continue
-            if not (key.endswith('.json') or key.endswith('.json.gz')):
-                continue
-            file_keys.append(key)
+class _InKeyOrder:
+    """Hands back (key, result) pairs in the order their keys were queued, whatever order they finish in."""
+
+    __slots__ = ('keys', 'position', 'next', 'ready')
+
+    def __init__(self, keys):
+        self.keys     = keys
+        self.position = {key: i for i, key in enumerate(keys)}
+        self.next     = 0
+        self.ready    = {}
+
+    def push(self, key, result):
+        """Accept one finished file; return the run of results now releasable, in order."""
+        self.ready[self.position[key]] = result
+        released = []
+        while self.next in self.ready:
+            released.append((self.keys[self.next], self.ready.pop(self.next)))
+            self.next += 1
+        return released
+
+    def drain(self):
+        """Everything still held, in order, skipping files that never reported."""
+        released = [(self.keys[i], self.ready[i]) for i in sorted(self.ready)]
+        self.ready.clear()
+        return released
+
+
+# ── Ingestion pipeline ────────────────────────────────────────────────────────
+# Every entry point runs the same staged pipeline:
+#
+#   list ─▶ [key queue] ─▶ fetch/parse/validate/score × N ─▶ [result queue]
+#        ─▶ collect (in key order) ─▶ cap ─▶ store (batched)
+#
+# Sources are pluggable: anything with list_keys(), iter_records(key) and
+# describe(key). Both queues are bounded, so fast listing cannot run far
+# ahead of the workers and fast workers cannot run far ahead of the collector.
+#
+# Keys are processed in delivery-day order and the collector releases results
+# in that order whatever order they finish in, so caps come out as they would
+# from one sequential pass. Each day is stored as soon as a later day's file
+# arrives, and the per-service/action cap totals of days already behind are
+# dropped; memory holds the open day, not the sync's history. While one slow
+# file holds up the release, at most READ_AHEAD_PER_SLOT files per fetch slot
+# are started past it, so the finished results waiting behind it stay bounded.
+#
+# Days already at DAILY_SCORE_CAP — in daily_scores before the sync, or
+# filled by it — cannot gain anything, so their remaining files are skipped
+# before download. Skipped files stay out of the manifest.
+#
+# Hybrid mode (parse_processes > 0): the fetch threads only do I/O, pulling
+# each file's raw compressed bytes via source.fetch_bytes(key), and hand them
+# to a process pool that inflates, parses, validates and scores outside the GIL.
+#
+# Async mode (INGEST_BACKEND=asyncio, needs aiobotocore): the fetch threads are
+# replaced by one event loop running up to INGEST_ASYNC_CONCURRENCY GETs at
+# once; see AsyncIngestionPipeline.
+
+INGEST_WORKERS         = int(os.getenv('INGEST_FETCH_WORKERS', '25'))     # Fetch threads per pipeline
+INGEST_PARSE_PROCESSES = int(os.getenv('INGEST_PARSE_PROCESSES', '0'))    # 0 = parse in the fetch threads
+STORE_BATCH_SIZE  = 5000   # Activities per store_activities() call
+PROGRESS_EVERY    = 10     # Files between progress_callback('batch_done') calls
+FLUSH_EVERY_FILES = 100    # Completed files between store + manifest flushes
+READ_AHEAD_PER_SLOT = 4    # Files per fetch slot that may start before the oldest unreleased one is collected
+MAX_FILE_ATTEMPTS   = int(os.getenv('INGEST_MAX_FILE_ATTEMPTS', '3'))  # Failed syncs before a file is given up on
+
+API_VERIFICATION_MODE    = os.getenv('API_VERIFICATION_MODE', 'queue').lower()  # or 'inline'
+INGEST_BACKEND           = os.getenv('INGEST_BACKEND', 'threads').lower()   # or 'asyncio'
+INGEST_ASYNC_CONCURRENCY = int(os.getenv('INGEST_ASYNC_CONCURRENCY', '256'))  # In-flight GETs on the event loop
+S3_ENDPOINT_URL          = os.getenv('S3_ENDPOINT_URL') or None  # e.g. a local moto server
+
+S3_LISTING_MODE       = os.getenv('S3_LISTING_MODE', 'partitioned').lower()  # or 'flat'
+LISTING_LOOKBACK_DAYS = 1  # Days re-listed behind a region checkpoint for late deliveries
+
+_LOG_SUFFIXES = ('.json', '.json.gz')
+_KEY_DATE_PATTERN = re.compile(r'^(\d{4})/(\d{2})/(\d{2})/')
+_STAGE_DONE = object()
+
+
+class S3LogSource:
+    """CloudTrail log files in an S3 bucket, optionally only those modified after a cutoff."""
+
+    def __init__(self, s3, bucket_name, prefix='', modified_after=None, suffixes=_LOG_SUFFIXES):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.modified_after = modified_after.replace(tzinfo=None) if modified_after else None
+        self.suffixes = suffixes
+        self.etags = {}
+
+    def _wanted(self, obj):
+        """True if a listed object is a log file newer than the cutoff; remembers its ETag."""
+        key = obj.get('Key')
+        if not key or not key.endswith(self.suffixes):
+            return False
+        # S3 returns timezone-aware datetimes; strip tzinfo before comparison.
+        if self.modified_after is not None:
+            if obj['LastModified'].replace(tzinfo=None) <= self.modified_after:
+                return False
+        self.etags[key] = obj.get('ETag', '')
+        return True
 
-    if progress_callback:
-        progress_callback('total', len(file_keys))
+    def list_keys(self):
+        paginate_kwargs = {'Bucket': self.bucket_name}
+        if self.prefix:
+            paginate_kwargs['Prefix'] = self.prefix
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**paginate_kwargs):
+            for obj in page.get('Contents', []):
+                if self._wanted(obj):
+                    yield obj['Key']
 
-    # ── Per-file download + parse (runs in parallel) ──────────────────────────
-    def download_and_parse(key):
-        """Download one S3 file, validate it, and return scored activities."""
+    def iter_records(self, key):
+        body = self.s3.get_object(Bucket=self.bucket_name, Key=key)['Body']
         try:
-            s3_obj = s3.get_object(Bucket=bucket_name, Key=key)
-            if key.endswith('.gz'):
-                with gzip.GzipFile(fileobj=BytesIO(s3_obj['Body'].read())) as gz:
-                    log_data = json.loads(gz.read())
-            else:
-                log_data = json.loads(s3_obj['Body'].read().decode('utf-8'))
-        except Exception as e:
-            logger.warning(f"Error reading s3://{bucket_name}/{key}: {e}")
-            return []
+            yield from iter_cloudtrail_records(body, compressed=key.endswith('.gz'))
+        finally:
+            body.close()
 
-        records = log_data.get('Records', [])
+    def fetch_bytes(self, key):
+        """Raw (still compressed) object bytes, for hand-off to the parse processes."""
+        body = self.s3.get_object(Bucket=self.bucket_name, Key=key)['Body']
+        try:
+            return body.read()
+        finally:
+            body.close()
 
-        # 3-Layer fraud validation
-        if not _validate_arn_ownership(records, registered_account_id):
-            logger.warning(f"FRAUD: ARN mismatch in {key} for user {user_id} - skipping")
-            return []
-        if not _validate_log_metadata(records, key):
-            logger.warning(f"FRAUD: Metadata invalid in {key} for user {user_id} - skipping")
-            return []
-        if not _verify_sample_via_api(records, aws_access_key, aws_secret_key, aws_region):
-            logger.warning(f"FRAUD: API verification failed in {key} for user {user_id} - skipping")
-            return []
+    def describe(self, key):
+        return f"s3://{self.bucket_name}/{key}"
 
-        file_activities = []
-        for record in records:
-            try:
-                read_only = record.get('readOnly')
-                if isinstance(read_only, str):
-                    if read_only.lower() == 'true':
-                        continue
-                elif read_only is True:
-                    continue
 
-                event_time_str = record.get('eventTime')
-                event_source   = record.get('eventSource', '')
-                event_name     = record.get('eventName', '')
+class PartitionedS3LogSource(S3LogSource):
+    """
+    S3 source that understands the CloudTrail key layout
+    <prefix>/AWSLogs/[o-org/]<account>/CloudTrail/<region>/YYYY/MM/DD/<file>.
+
+    Regions are discovered with delimiter listings, then each region is listed
+    with StartAfter from the user's stored checkpoint (rewound LISTING_LOOKBACK_DAYS
+    to catch late deliveries), so an incremental sync costs LIST requests in
+    proportion to new data rather than total history. Falls back to a flat
+    listing when the bucket does not use the standard layout.
+
+    A checkpoint never passes a listed file that is not in the manifest yet
+    (it failed, or the sync stopped before reaching it), so the next sync
+    lists that file again.
+    """
 
-                if not event_time_str or not event_source or not event_name:
-                    continue
+    def __init__(self, s3, bucket_name, user_id, prefix='', modified_after=None,
+                 lookback_days=None):
+        super().__init__(s3, bucket_name, prefix=prefix, modified_after=modified_after)
+        self.user_id = user_id
+        self.lookback_days = LISTING_LOOKBACK_DAYS if lookback_days is None else lookback_days
+        self.listed = {}   # Region prefix → log keys listed this sync, in key order
+
+    def _child_prefixes(self, prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'):
+            for common in page.get('CommonPrefixes', []):
+                yield common['Prefix']
+
+    def region_prefixes(self):
+        """Return every .../CloudTrail/<region>/ prefix under the configured prefix."""
+        if 'AWSLogs/' in self.prefix:
+            return []  # Custom deep prefix — let the flat listing handle it
+        base = self.prefix
+        if base and not base.endswith('/'):
+            base += '/'
+
+        accounts = []
+        for child in self._child_prefixes(base + 'AWSLogs/'):
+            # Organization trails add an o-<org id>/ level above the accounts
+            if child.rstrip('/').rsplit('/', 1)[-1].startswith('o-'):
+                accounts.extend(self._child_prefixes(child))
+            else:
+                accounts.append(child)
+
+        regions = []
+        for account in accounts:
+            regions.extend(self._child_prefixes(account + 'CloudTrail/'))
+        return regions
+
+    def _start_after(self, region_prefix, last_key):
+        """Resume point for a region: the start of the checkpoint's day minus the lookback."""
+        if not last_key:
+            return None
+        match = _KEY_DATE_PATTERN.search(last_key[len(region_prefix):])
+        if not match:
+            return last_key
+        day = datetime(*map(int, match.groups())).date() - timedelta(days=self.lookback_days)
+        return f"{region_prefix}{day:%Y/%m/%d}/"
+
+    def list_keys(self):
+        regions = self.region_prefixes()
+        if not regions:
+            yield from super().list_keys()
+            return
+
+        checkpoints = get_listing_checkpoints(self.user_id, self.bucket_name)
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for region_prefix in regions:
+            paginate_kwargs = {'Bucket': self.bucket_name, 'Prefix': region_prefix}
+            start_after = self._start_after(region_prefix, checkpoints.get(region_prefix))
+            if start_after:
+                paginate_kwargs['StartAfter'] = start_after
+
+            listed = []
+            for page in paginator.paginate(**paginate_kwargs):
+                for obj in page.get('Contents', []):
+                    key = obj.get('Key')
+                    if key and key.endswith(self.suffixes):
+                        listed.append(key)
+                    if self._wanted(obj):
+                        yield key
+            if listed:
+                self.listed[region_prefix] = listed
+
+    def commit_checkpoints(self, manifest, settled=()):
+        """
+        Persist each region's checkpoint after a sync: its last listed key, unless a
+        file it listed is still unfinished in the manifest (and not in settled, the
+        files the pipeline passed over on purpose). Then the checkpoint stops at the
+        key listed just before the earliest such file, or stays where it was if
+        there is none.
+        """
+        checkpoints = {}
+        for region_prefix, listed in self.listed.items():
+            wanted     = [key for key in listed if key in self.etags and key not in settled]
+            unfinished = manifest.pending(wanted)
+            if not unfinished:
+                checkpoints[region_prefix] = listed[-1]
+                continue
+            before = bisect_left(listed, min(unfinished))   # S3 lists in key order
+            if before:
+                checkpoints[region_prefix] = listed[before - 1]
+        update_listing_checkpoints(self.user_id, self.bucket_name, checkpoints)
 
-                event_time = datetime.strptime(event_time_str, '%Y-%m-%dT%H:%M:%SZ')
-                service    = event_source.split('.')[0].upper()
-                score      = calculate_score(service, event_name)
-                if score <= 0:
-                    continue
 
-                file_activities.append({
-                    'user_id':  user_id,
-                    'date':     event_time.date(),
-                    'service':  service,
-                    'action':   event_name,
-                    'score':    score,
-                    'event_id': record.get('eventID'),
-                })
-            except Exception as e:
-                logger.warning(f"Error processing record from {key}: {e}")
-                continue
+class LocalDirectorySource:
+    """CloudTrail-style JSON / JSON.GZ files in a local directory."""
 
-        return file_activities
+    def __init__(self, directory, suffixes=_LOG_SUFFIXES):
+        self.directory = directory
+        self.suffixes = suffixes
 
-    # ── Run downloads in parallel (25 workers) ────────────────────────────────
-    all_activities = []
-    files_done = 0
-    lock = threading.Lock()
+    def list_keys(self):
+        for entry in sorted(os.listdir(self.directory)):
+            if entry.endswith(self.suffixes) and os.path.isfile(os.path.join(self.directory, entry)):
+                yield entry
 
-    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-        futures = {executor.submit(download_and_parse, key): key for key in file_keys}
-        for future in as_completed(futures):
-            result = future.result()
-            with lock:
-                all_activities.extend(result)
-                files_done += 1
-            if progress_callback and files_done % 10 == 0:
-                progress_callback('batch_done', 10)
-
-    remainder = files_done % 10
-    if progress_callback and remainder > 0:
-        progress_callback('batch_done', remainder)
-
-    # ── Apply daily caps across all collected activities ───────────────────────
-    # Must be done sequentially after parallel download to keep caps consistent
-    daily_totals         = {}
-    daily_service_scores = {}
-    daily_action_scores  = {}
-    capped_activities    = []
-
-    # Sort by date so caps are applied chronologically
-    all_activities.sort(key=lambda x: x['date'])
-
-    for activity in all_activities:
-        date_key    = activity['date']
-        service_key = f"{date_key}_{activity['service']}"
-        action_key  = f"{date_key}_{activity['service']}_{activity['action']}"
-
-        daily_totals.setdefault(date_key, 0)
-        daily_service_scores.setdefault(service_key, 0)
-        daily_action_scores.setdefault(action_key, 0)
-
-        if daily_totals[date_key]            >= DAILY_SCORE_CAP:   continue
-        if daily_service_scores[service_key] >= SERVICE_DAILY_CAP: continue
-        if daily_action_scores[action_key]   >= ACTION_DAILY_CAP:  continue
-
-        capped_activities.append(activity)
-        daily_totals[date_key]            += activity['score']
-        daily_service_scores[service_key] += activity['score']
-        daily_action_scores[action_key]   += activity['score']
-
-    # ── Store and return ──────────────────────────────────────────────────────
-    total_records = 0
-    if capped_activities:
-        store_activities(capped_activities)
-        total_records = len(capped_activities)
-        logger.info(f"Parallel sync complete: {total_records} activities for user {user_id} from {len(file_keys)} files")
+    def iter_records(self, key):
+        with open(os.path.join(self.directory, key), 'rb') as f:
+            yield from iter_cloudtrail_records(f, compressed=key.endswith('.gz'))
 
-    try:
-        update_last_processed_timestamp(user_id, datetime.now())
-    except Exception as e:
-        logger.error(f"Error updating last processed timestamp: {str(e)}")
+    def fetch_bytes(self, key):
+        with open(os.path.join(self.directory, key), 'rb') as f:
+            return f.read()
 
-    return total_records
+    def describe(self, key):
+        return os.path.join(self.directory, key)
 
 
-def process_local_cloudtrail_logs():
+class RecordsSource:
     """
-    Process CloudTrail-style JSON or JSON.GZ log files from the local
-    backend/sample_logs directory and update activity and daily scores.
+    In-memory CloudTrail records — for tests, dev seeding and replays.
+    Accepts a list of records (one pseudo-file) or a {key: [records]} mapping.
     """
-    sample_logs_dir = os.path.join(os.path.dirname(__file__), "sample_logs")
 
-    if not os.path.isdir(sample_logs_dir):
-        logger.warning(f"Sample logs directory not found: {sample_logs_dir}")
-        return 0
-
-    user_id_value = (
-        os.getenv("LOCAL_CLOUDTRAIL_USER_ID")
-        or os.getenv("LOCAL_INGEST_USER_ID")
-        or "1"
-    )
+    def __init__(self, records):
+        self.files = records if isinstance(records, dict) else {'memory': list(records)}
 
-    try:
-        user_id = int(user_id_value)
-    except ValueError:
-        logger.warning(
-            f"Invalid LOCAL_CLOUDTRAIL_USER_ID/LOCAL_INGEST_USER_ID value "
-            f"'{user_id_value}', defaulting to 1"
-        )
-        user_id = 1
+    def list_keys(self):
+        return iter(self.files)
 
-    activities = []
-    daily_service_scores = {}
-    daily_totals = {}
-    daily_action_scores = {}
+    def iter_records(self, key):
+        return iter(self.files[key])
 
-    for entry in os.listdir(sample_logs_dir):
-        file_path = os.path.join(sample_logs_dir, entry)
+    def describe(self, key):
+        return f"memory:{key}" if key else "memory"
 
-        if not os.path.isfile(file_path):
-            continue
 
-        if not (entry.endswith(".json") or entry.endswith(".json.gz")):
-            continue
+def _scan_records(records, key, user_id, fraud_checks, registered_account_id, collect_sample):
+    """
+    Validate and score one file's records in a single pass.
+    Returns (ActivityBatch, verify_sample), or None if a fraud check rejected the file.
+    Raises if the stream cannot be read or parsed.
+    """
+    filename_time    = _filename_timestamp(key) if fraud_checks else None
+    filename_seconds = None
+    if filename_time:
+        filename_seconds = filename_time.toordinal() * 86400 + filename_time.hour * 3600 + filename_time.minute * 60
+    file_activities  = ActivityBatchBuilder(user_id, key)
+    verify_sample    = []
 
+    for record in records:
         try:
-            if entry.endswith(".gz"):
-                with gzip.open(file_path, "rt", encoding="utf-8") as f:
-                    log_data = json.load(f)
-            else:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    log_data = json.load(f)
+            activity = _classify_record(record, key, fraud_checks, registered_account_id, filename_seconds)
         except Exception as e:
-            logger.warning(f"Error reading local log file {file_path}: {str(e)}")
+            logger.warning(f"Error processing record from {key}: {e}")
+            continue
+        if activity is None:
             continue
+        if activity is _REJECT_ARN:
+            logger.warning(f"FRAUD: ARN mismatch in {key} for user {user_id} - skipping")
+            return None
+        if activity is _REJECT_METADATA:
+            logger.warning(f"FRAUD: Metadata invalid in {key} for user {user_id} - skipping")
+            return None
 
-        for record in log_data.get("Records", []):
-            try:
-                # Skip read-only events
-                read_only = record.get("readOnly")
-                if isinstance(read_only, str):
-                    if read_only.lower() == "true":
-                        continue
-                elif read_only is True:
-                    continue
+        file_activities.append(*activity)
+        if collect_sample and activity[4]:
+            verify_sample.append({f: record.get(f) for f in _VERIFY_FIELDS})
 
-                event_time_str = record.get("eventTime")
-                event_source = record.get("eventSource", "")
-                event_name = record.get("eventName", "")
+    return file_activities.build(), verify_sample
 
-                if not event_time_str or not event_source or not event_name:
-                    continue
 
-                event_time = datetime.strptime(
-                    event_time_str, "%Y-%m-%dT%H:%M:%SZ"
-                )
-                service = event_source.split(".")[0].upper()
-                action = event_name
+def _scan_log_blob(key, blob, scan_args):
+    """Parse-process entry point: decode one raw log file and scan it."""
+    records = iter_cloudtrail_records(io.BytesIO(blob), compressed=key.endswith('.gz'))
+    return _scan_records(records, key, *scan_args)
 
-                if not service or not action:
-                    continue
 
-                score = calculate_score(service, action)
-                if score <= 0:
-                    continue
+_parse_pools = {}
+_parse_pools_lock = threading.Lock()
 
-                date_key = event_time.date()
-                service_key = f"{date_key}_{service}"
-                action_key = f"{date_key}_{service}_{action}"
 
-                if date_key not in daily_totals:
-                    daily_totals[date_key] = 0
-                if service_key not in daily_service_scores:
-                    daily_service_scores[service_key] = 0
-                if action_key not in daily_action_scores:
-                    daily_action_scores[action_key] = 0
+def _get_parse_pool(processes):
+    """Shared process pool for the parse stage, created once per size and reused across syncs.
+    Uses spawn so workers never inherit locks held by the fetch threads."""
+    with _parse_pools_lock:
+        pool = _parse_pools.get(processes)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            _parse_pools[processes] = pool
+        return pool
 
-                if daily_totals[date_key] >= DAILY_SCORE_CAP:
-                    continue
-                if daily_service_scores[service_key] >= SERVICE_DAILY_CAP:
-                    continue
-                if daily_action_scores[action_key] >= ACTION_DAILY_CAP:
-                    continue
 
-                activities.append(
-                    {
-                        "user_id": user_id,
-                        "date": date_key,
-                        "service": service,
-                        "action": action,
-                        "score": score,
-                        "event_id": record.get("eventID"),
-                    }
-                )
-
-                daily_totals[date_key] += score
-                daily_service_scores[service_key] += score
-                daily_action_scores[action_key] += score
+class ObjectManifest:
+    """
+    Per-user record of (object key, ETag) pairs that are fully ingested.
+
+    Entries are written in batches only after the file's activities have been
+    committed, so a crashed sync resumes where it stopped and a re-uploaded
+    object (new ETag) is picked up again. A file that cannot be read is
+    recorded as 'failed' and retried; after MAX_FILE_ATTEMPTS syncs it is
+    'abandoned' and treated as finished, so it no longer holds back the listing
+    checkpoint. The source must expose etags[key].
+    """
 
-            except Exception as e:
-                logger.warning(
-                    f"Error processing local record in {entry}: {str(e)}"
-                )
-                continue
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, user_id, source):
+        self.user_id = user_id
+        self.source = source
+
+    def pending(self, keys):
+        """Return the keys whose current ETag has not been ingested (or abandoned) yet, in order."""
+        done = set()
+        for start in range(0, len(keys), self.LOOKUP_CHUNK):
+            chunk = keys[start:start + self.LOOKUP_CHUNK]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            rows = execute_query(
+                f"SELECT object_key, etag FROM processed_objects "
+                f"WHERE user_id = %s AND status <> 'failed' AND object_key IN ({placeholders})",
+                (self.user_id, *chunk), fetch=True
+            )
+            done.update((row['object_key'], row['etag']) for row in rows)
+        return [key for key in keys if (key, self.source.etags.get(key, '')) not in done]
+
+    def mark_done(self, keys):
+        if not keys:
+            return
+        from database import run_write, DB_ENGINE
+
+        placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+        sql = (
+            "INSERT INTO processed_objects (user_id, object_key, etag) "
+            f"VALUES ({placeholder}, {placeholder}, {placeholder}) "
+            "ON CONFLICT (user_id, object_key, etag) DO UPDATE SET status = 'done'"
+        )
+        rows = [(self.user_id, key, self.source.etags.get(key, '')) for key in keys]
+        run_write(lambda cursor: cursor.executemany(sql, rows))
+
+    def mark_failed(self, keys):
+        """Count one more failed read of each key, abandoning it at MAX_FILE_ATTEMPTS."""
+        if not keys:
+            return
+        from database import run_write, DB_ENGINE
+
+        placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+        sql = (
+            "INSERT INTO processed_objects (user_id, object_key, etag, status, attempts) "
+            f"VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, 1) "
+            "ON CONFLICT (user_id, object_key, etag) DO UPDATE SET "
+            "attempts = processed_objects.attempts + 1, "
+            "status = CASE WHEN processed_objects.status = 'done' THEN 'done' "
+            f"WHEN processed_objects.attempts + 1 >= {placeholder} THEN 'abandoned' ELSE 'failed' END"
+        )
+        first = 'abandoned' if MAX_FILE_ATTEMPTS <= 1 else 'failed'
+        rows = [(self.user_id, key, self.source.etags.get(key, ''), first, MAX_FILE_ATTEMPTS) for key in keys]
+        run_write(lambda cursor: cursor.executemany(sql, rows))
 
-    if activities:
-        store_activities(activities)
-        logger.info(
-            f"Stored {len(activities)} local activities for user {user_id} "
-            f"from sample_logs"
+
+class IngestionPipeline:
+    """
+    Staged, parallel ingestion of one source for one user.
+
+    fraud_checks enables the per-record ARN/metadata layers and, when
+    verify_credentials=(access_key, secret_key) is given, CloudTrail API
+    sampling: one budgeted sample across the whole sync, queued for the
+    background verifier once everything is stored (the sync's activities stay
+    provisional until then), or per file inline if API_VERIFICATION_MODE is
+    'inline'. Stored activities carry this run's sync_id. workers sets the
+    fetch threads; parse_processes > 0 moves decompression, validation and scoring into a shared process pool for
+    sources that support fetch_bytes(). Files are processed in delivery-day
+    order and stored a day at a time (or every FLUSH_EVERY_FILES files /
+    batch_size activities, whichever comes first). With a manifest,
+    already-ingested objects are skipped and completed files are recorded
+    right after their activities are stored. Files of days already at
+    DAILY_SCORE_CAP are not fetched at all. progress_callback(event, value) receives
+    ('total', n) once the listing is complete and ('batch_done', n) as files
+    finish.
+    """
+
+    def __init__(
+        self,
+        source,
+        user_id,
+        fraud_checks=False,
+        registered_account_id=None,
+        verify_credentials=None,
+        aws_region='us-east-1',
+        workers=INGEST_WORKERS,
+        batch_size=STORE_BATCH_SIZE,
+        progress_callback=None,
+        manifest=None,
+        parse_processes=INGEST_PARSE_PROCESSES,
+    ):
+        self.source = source
+        self.user_id = user_id
+        self.fraud_checks = fraud_checks
+        self.registered_account_id = registered_account_id
+        self.verify_credentials = verify_credentials or (None, None)
+        self.aws_region = aws_region
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+        self.manifest = manifest
+        self.parse_processes = parse_processes if hasattr(source, 'fetch_bytes') else 0
+        self.files_total = 0
+        self.sync_id = uuid.uuid4().hex
+        self.capped_days   = set()   # Date ordinals at DAILY_SCORE_CAP
+        self.skipped_keys  = set()   # Files not fetched because their day was capped
+        self.failed_keys   = set()   # Files that could not be read; retried by later syncs
+        self.stage_error   = None    # Exception that stopped a stage early; run() re-raises it
+        self.read_ahead    = threading.Semaphore(self.workers * READ_AHEAD_PER_SLOT)
+
+    # ── Stages ────────────────────────────────────────────────────────────────
+
+    def _list_stage(self, keys, key_queue, readers):
+        try:
+            for key in keys:
+                self.read_ahead.acquire()   # Released when the collector hands this file on
+                key_queue.put(key)
+        finally:
+            for _ in range(readers):
+                key_queue.put(_STAGE_DONE)
+
+    def _fetch_stage(self, key_queue, result_queue):
+        try:
+            while True:
+                key = key_queue.get()
+                if key is _STAGE_DONE:
+                    break
+                try:
+                    result = self.process_file(key)
+                except Exception as e:
+                    logger.warning(f"Error processing {self.source.describe(key)}: {e}")
+                    self.failed_keys.add(key)
+                    result = None
+                result_queue.put((key, result))
+        finally:
+            result_queue.put(_STAGE_DONE)
+
+    def _scan_args(self):
+        """Trailing arguments to _scan_records / _scan_log_blob for this pipeline."""
+        ak, _ = self.verify_credentials
+        return (self.user_id, self.fraud_checks, self.registered_account_id, bool(self.fraud_checks and ak))
+
+    def process_file(self, key):
+        """
+        Fetch, parse, validate and score one log file.
+        Returns (ActivityBatch, samples) as _finish_file does, or None if the file
+        could not be read (retry next sync).
+        """
+        if self._day_capped(key):
+            return None
+        scan_args = self._scan_args()
+        try:
+            if self.parse_processes:
+                blob    = self.source.fetch_bytes(key)
+                scanned = _get_parse_pool(self.parse_processes).submit(_scan_log_blob, key, blob, scan_args).result()
+            else:
+                scanned = _scan_records(self.source.iter_records(key), key, *scan_args)
+        except Exception as e:
+            logger.warning(f"Error reading {self.source.describe(key)}: {e}")
+            self.failed_keys.add(key)
+            return None
+        return self._finish_file(key, scanned)
+
+    def _day_capped(self, key):
+        """
+        True if every activity key could hold is already over the cap, so it need
+        not be fetched. Files delivered in the first hour of a day still carry the
+        previous day's events, so that day must be capped too.
+        """
+        day = _key_day(key)
+        if day is None or day not in self.capped_days:
+            return False
+        if day - 1 not in self.capped_days:
+            delivered = _filename_timestamp(key)
+            if delivered is None or delivered.hour < 1:
+                return False
+        self.skipped_keys.add(key)
+        return True
+
+    def _queues_samples(self):
+        """True if stored activities wait as provisional on the sync's queued API sample."""
+        ak, sk = self.verify_credentials
+        return bool(self.fraud_checks and ak and sk) and API_VERIFICATION_MODE != 'inline'
+
+    def _finish_file(self, key, scanned):
+        """
+        Apply Layer 3 to one scanned file. Returns (ActivityBatch, samples): the batch
+        is empty if the file was rejected; samples holds the (key, records) offered to
+        the sync's VerificationPlanner, in which case the batch is provisional.
+        """
+        if scanned is None:
+            return ActivityBatch.empty(self.user_id), []
+        file_activities, verify_sample = scanned
+
+        # Layer 3 needs the whole file's scoreable events, so it runs once scanning is done
+        if self._queues_samples():
+            # The sync is verified as a whole, so every file in it waits on the shared sample
+            return file_activities.with_status(PROVISIONAL), ([(key, verify_sample)] if verify_sample else [])
+        ak, sk = self.verify_credentials
+        if not (self.fraud_checks and ak and sk):
+            return file_activities, []
+        if not _verify_sample_via_api(pick_sample(verify_sample), ak, sk, self.aws_region, self.user_id):
+            logger.warning(f"FRAUD: API verification failed in {key} for user {self.user_id} - skipping")
+            return ActivityBatch.empty(self.user_id), []
+        return file_activities, []
+
+    # ── Driver ────────────────────────────────────────────────────────────────
+
+    def _start_stages(self, keys, result_queue):
+        """
+        Start the list and fetch threads feeding result_queue.
+        Returns (threads, number of _STAGE_DONE markers the collector should wait for).
+        """
+        workers   = min(self.workers, len(keys))
+        key_queue = queue.Queue(maxsize=workers * 2)
+
+        threads = [threading.Thread(target=self._list_stage, args=(keys, key_queue, workers), daemon=True)]
+        threads.extend(
+            threading.Thread(target=self._fetch_stage, args=(key_queue, result_queue), daemon=True)
+            for _ in range(workers)
         )
+        for t in threads:
+            t.start()
+        return threads, workers
+
+    def _cap(self, batch, totals):
+        """Apply the caps to one released file and note the days it filled."""
+        capped = apply_caps(batch, totals)
+        for day in set(batch.day.tolist()):
+            if totals.daily.get(date.fromordinal(day), 0) >= DAILY_SCORE_CAP:
+                self.capped_days.add(day)
+        return capped
+
+    def _flush(self, batches, done_keys):
+        """Store one chunk of capped results, then record their files in the manifest."""
+        capped_activities = ActivityBatch.concat(batches).to_dicts()
+        for activity in capped_activities:
+            activity['sync_id'] = self.sync_id
+        for start in range(0, len(capped_activities), self.batch_size):
+            store_activities(capped_activities[start:start + self.batch_size])
+        if self.manifest:
+            self.manifest.mark_done(done_keys)
+        return len(capped_activities)
+
+    def _released(self, keys, result_queue, running):
+        """Finished files from result_queue, in key order, until every stage is done."""
+        in_order = _InKeyOrder(keys)
+        while running:
+            item = result_queue.get()
+            if item is _STAGE_DONE:
+                running -= 1
+                continue
+            for released in in_order.push(*item):
+                self.read_ahead.release()
+                yield released
+        yield from in_order.drain()
+
+    def run(self):
+        """
+        Run every stage to completion and return the number of activities stored.
+        If a stage failed as a whole, re-raises its error once the files it did
+        report are stored.
+        """
+        keys = list(self.source.list_keys())
+        if self.manifest:
+            keys = self.manifest.pending(keys)
+        self.files_total = len(keys)
+        if self.progress_callback:
+            self.progress_callback('total', self.files_total)
+        if not keys:
+            return 0
+        keys.sort(key=lambda k: (_key_day(k) or 0, k))
+
+        # Caps carry over between flushes so they stay consistent across the whole sync;
+        # days stored at the cap by earlier syncs start out full, before any worker checks them
+        totals     = CapTotals()
+        for day in get_capped_days(self.user_id):
+            totals.daily[date.fromordinal(day)] = DAILY_SCORE_CAP
+            self.capped_days.add(day)
+
+        result_queue = queue.Queue(maxsize=self.workers * 2)
+        threads, running = self._start_stages(keys, result_queue)
+
+        planner    = VerificationPlanner()
+        pending    = []   # Capped ActivityBatches not yet stored
+        pending_n  = 0    # Activities across `pending`
+        done_keys  = []   # Files whose activities are all in `pending`
+        open_day   = 0    # Delivery day of the latest file released
+        stored     = 0
+        files_done = 0
+        reported   = 0
+        try:
+            for key, result in self._released(keys, result_queue, running):
+                day = _key_day(key)
+                if day is not None and day > open_day:
+                    # Earlier days are complete: commit them and drop their fine-grained totals.
+                    # Files delivered just after midnight still log the previous day's events.
+                    if done_keys:
+                        stored += self._flush(pending, done_keys)
+                        pending, pending_n, done_keys = [], 0, []
+                    totals.forget_before(date.fromordinal(day - 1))
+                    open_day = day
 
-    return len(activities)
+                files_done += 1
+                if result is not None:
+                    batch, file_samples = result
+                    batch = self._cap(batch, totals) if len(batch) else batch
+                    if len(batch):
+                        pending.append(batch)
+                        pending_n += len(batch)
+                    for sample_key, records in file_samples:
+                        planner.offer(sample_key, records)
+                    done_keys.append(key)
+                if len(done_keys) >= FLUSH_EVERY_FILES or pending_n >= self.batch_size:
+                    stored += self._flush(pending, done_keys)
+                    pending, pending_n, done_keys = [], 0, []
+                if self.progress_callback and files_done - reported >= PROGRESS_EVERY:
+                    self.progress_callback('batch_done', files_done - reported)
+                    reported = files_done
+
+            for t in threads:
+                t.join()
+            stored += self._flush(pending, done_keys)
+            if self.manifest and self.failed_keys:
+                self.manifest.mark_failed(sorted(self.failed_keys))
+            if self.stage_error is not None:
+                raise self.stage_error
+        finally:
+            # Whatever was stored stays provisional until its sample is checked; a sync
+            # that offered no samples (every event past the LookupEvents window, or
+            # without an eventID) is settled by commit() straight away
+            if self._queues_samples():
+                planner.commit(self.user_id, self.sync_id, self.aws_region)
+        if self.progress_callback and files_done > reported:
+            self.progress_callback('batch_done', files_done - reported)
+
+        if stored:
+            logger.info(
+                f"Stored {stored} activities for user {self.user_id} "
+                f"from {files_done} files in {self.source.describe('')}"
+            )
+        if self.skipped_keys:
+            logger.info(f"Skipped {len(self.skipped_keys)} files of days already at the daily cap for user {self.user_id}")
+        if self.failed_keys:
+            logger.warning(
+                f"{len(self.failed_keys)} files could not be read for user {self.user_id}; "
+                f"each is retried for up to {MAX_FILE_ATTEMPTS} syncs"
+            )
+        return stored
 
 
-def process_s3_cloudtrail_logs(bucket_name):
+class AsyncIngestionPipeline(IngestionPipeline):
     """
-    Process CloudTrail-style JSON or JSON.GZ log files from the given S3
-    bucket and update activity and daily scores.
-    Uses the same scoring and aggregation logic as process_local_cloudtrail_logs().
+    IngestionPipeline whose fetch stage is a single asyncio event loop.
+
+    The source (an S3LogSource) still does the listing; objects are read
+    through an aiobotocore client built from client_kwargs, with at most
+    `concurrency` files in flight. Fetched bytes are parsed in the shared
+    process pool when parse_processes > 0, otherwise in `workers` threads.
+    Capping, storage, manifest and progress reporting are inherited unchanged.
     """
-    # Reuse the same user id resolution logic as local ingestion.
+
+    def __init__(self, source, user_id, client_kwargs=None, concurrency=INGEST_ASYNC_CONCURRENCY, **kwargs):
+        try:
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import get_session
+        except ImportError:
+            raise RuntimeError("INGEST_BACKEND=asyncio requires aiobotocore (pip install aiobotocore)")
+        super().__init__(source, user_id, **kwargs)
+        self.client_kwargs = client_kwargs or {}
+        self.concurrency = max(1, concurrency)
+        self.read_ahead  = threading.Semaphore(self.concurrency * READ_AHEAD_PER_SLOT)
+        self._session = get_session()
+        self._client_config = AioConfig(max_pool_connections=self.concurrency)
+
+    def _start_stages(self, keys, result_queue):
+        thread = threading.Thread(
+            target=asyncio.run, args=(self._async_fetch_stage(keys, result_queue),), daemon=True
+        )
+        thread.start()
+        return [thread], 1
+
+    async def _async_fetch_stage(self, keys, result_queue):
+        loop      = asyncio.get_running_loop()
+        scan_args = self._scan_args()
+        slots     = asyncio.Semaphore(self.concurrency)
+        own_executor   = not self.parse_processes
+        parse_executor = ThreadPoolExecutor(max_workers=self.workers) if own_executor \
+            else _get_parse_pool(self.parse_processes)
+
+        async def handle(client, key):
+            try:
+                if self._day_capped(key):
+                    result = None
+                else:
+                    result = await fetch_and_scan(client, key)
+            except Exception as e:
+                logger.warning(f"Error processing {self.source.describe(key)}: {e}")
+                self.failed_keys.add(key)
+                result = None
+            try:
+                await asyncio.to_thread(result_queue.put, (key, result))
+            finally:
+                slots.release()
+
+        async def fetch_and_scan(client, key):
+            try:
+                response = await client.get_object(Bucket=self.source.bucket_name, Key=key)
+                async with response['Body'] as body:
+                    blob = await body.read()
+                scanned = await loop.run_in_executor(parse_executor, _scan_log_blob, key, blob, scan_args)
+            except Exception as e:
+                logger.warning(f"Error reading {self.source.describe(key)}: {e}")
+                self.failed_keys.add(key)
+                return None
+            if self.fraud_checks:
+                # API sampling uses blocking boto3 calls; keep them off the loop
+                return await asyncio.to_thread(self._finish_file, key, scanned)
+            return self._finish_file(key, scanned)
+
+        tasks = set()
+        try:
+            async with self._session.create_client('s3', config=self._client_config, **self.client_kwargs) as client:
+                for key in keys:
+                    if not self.read_ahead.acquire(blocking=False):
+                        await asyncio.to_thread(self.read_ahead.acquire)
+                    await slots.acquire()
+                    task = asyncio.create_task(handle(client, key))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+        except Exception as e:
+            # Stop the files still in flight; run() re-raises once what was reported is stored,
+            # so the caller does not treat the sync as complete
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.error(f"Async fetch stage failed for {self.source.describe('')}: {e}")
+            self.stage_error = e
+        finally:
+            if own_executor:
+                parse_executor.shutdown(wait=False)
+            result_queue.put(_STAGE_DONE)
+
+
+# ── Entry points ──────────────────────────────────────────────────────────────
+
+def _s3_client_kwargs(aws_region=None, aws_access_key=None, aws_secret_key=None, session_token=None):
+    """Region, credential and endpoint arguments shared by the boto3 and aiobotocore S3 clients."""
+    kwargs = {}
+    if aws_region:
+        kwargs['region_name'] = aws_region
+    if aws_access_key and aws_secret_key:
+        kwargs['aws_access_key_id'] = aws_access_key
+        kwargs['aws_secret_access_key'] = aws_secret_key
+        if session_token:
+            kwargs['aws_session_token'] = session_token
+    if S3_ENDPOINT_URL:
+        kwargs['endpoint_url'] = S3_ENDPOINT_URL
+    return kwargs
+
+
+def _s3_client(aws_region=None, aws_access_key=None, aws_secret_key=None, session_token=None,
+               max_connections=INGEST_WORKERS):
+    """S3 client sized for max_connections concurrent requests (one per fetch thread)."""
+    return boto3.client(
+        's3',
+        config=boto3.session.Config(max_pool_connections=max_connections),
+        **_s3_client_kwargs(aws_region, aws_access_key, aws_secret_key, session_token),
+    )
+
+
+def _local_ingest_user_id():
+    """User id that local/legacy ingestion attributes activity to."""
     user_id_value = (
         os.getenv("LOCAL_CLOUDTRAIL_USER_ID")
         or os.getenv("LOCAL_INGEST_USER_ID")
@@ -589,137 +1174,156 @@ def process_s3_cloudtrail_logs(bucket_name):
     )
 
     try:
-        user_id = int(user_id_value)
+        return int(user_id_value)
     except ValueError:
         logger.warning(
             f"Invalid LOCAL_CLOUDTRAIL_USER_ID/LOCAL_INGEST_USER_ID value "
             f"'{user_id_value}', defaulting to 1"
         )
-        user_id = 1
+        return 1
 
-    s3 = boto3.client("s3")
 
-    # Fetch last processed timestamp to avoid reprocessing older objects.
-    last_processed = get_last_processed_timestamp(user_id)
-    if last_processed is not None:
-        # Normalize to naive datetime for safe comparison.
-        last_processed = last_processed.replace(tzinfo=None)
-
-    activities = []
-    daily_service_scores = {}
-    daily_totals = {}
-    daily_action_scores = {}
-
-    paginator = s3.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=bucket_name)
-
-    for page in page_iterator:
-        for obj in page.get("Contents", []):
-            key = obj.get("Key")
-            if not key:
-                continue
+def process_cloudtrail_logs(user_id, role_arn, bucket_name):
+    try:
+        credentials = assume_role(role_arn)
 
-            if last_processed is not None:
-                # S3 returns timezone-aware datetimes; strip tzinfo before comparison.
-                if obj["LastModified"].replace(tzinfo=None) <= last_processed:
-                    continue
+        s3 = _s3_client(
+            aws_access_key=credentials['AccessKeyId'],
+            aws_secret_key=credentials['SecretAccessKey'],
+            session_token=credentials['SessionToken'],
+        )
 
-            if not (key.endswith(".json") or key.endswith(".json.gz")):
-                continue
+        last_processed = get_last_processed_timestamp(user_id)
+        cutoff_time = last_processed or datetime.now() - timedelta(days=7)
 
-            try:
-                s3_obj = s3.get_object(Bucket=bucket_name, Key=key)
-
-                if key.endswith(".gz"):
-                    with gzip.GzipFile(
-                        fileobj=BytesIO(s3_obj["Body"].read())
-                    ) as gzipfile:
-                        content = gzipfile.read()
-                        log_data = json.loads(content)
-                else:
-                    body_bytes = s3_obj["Body"].read()
-                    log_data = json.loads(body_bytes.decode("utf-8"))
-            except Exception as e:
-                logger.warning(
-                    f"Error reading S3 log file s3://{bucket_name}/{key}: {str(e)}"
-                )
-                continue
+        source = S3LogSource(
+            s3, bucket_name, prefix='AWSLogs/',
+            modified_after=cutoff_time, suffixes=('.json.gz',),
+        )
+        count = IngestionPipeline(source, user_id).run()
 
-            for record in log_data.get("Records", []):
-                try:
-                    # Skip read-only events (same as local ingestion).
-                    read_only = record.get("readOnly")
-                    if isinstance(read_only, str):
-                        if read_only.lower() == "true":
-                            continue
-                    elif read_only is True:
-                        continue
-
-                    event_time_str = record.get("eventTime")
-                    event_source = record.get("eventSource", "")
-                    event_name = record.get("eventName", "")
-
-                    if not event_time_str or not event_source or not event_name:
-                        continue
-
-                    event_time = datetime.strptime(
-                        event_time_str, "%Y-%m-%dT%H:%M:%SZ"
-                    )
-                    service = event_source.split(".")[0].upper()
-                    action = event_name
-
-                    if not service or not action:
-                        continue
-
-                    score = calculate_score(service, action)
-                    if score <= 0:
-                        continue
-
-                    date_key = event_time.date()
-                    service_key = f"{date_key}_{service}"
-                    action_key = f"{date_key}_{service}_{action}"
-
-                    if date_key not in daily_totals:
-                        daily_totals[date_key] = 0
-                    if service_key not in daily_service_scores:
-                        daily_service_scores[service_key] = 0
-                    if action_key not in daily_action_scores:
-                        daily_action_scores[action_key] = 0
-
-                    if daily_totals[date_key] >= DAILY_SCORE_CAP:
-                        continue
-                    if daily_service_scores[service_key] >= SERVICE_DAILY_CAP:
-                        continue
-                    if daily_action_scores[action_key] >= ACTION_DAILY_CAP:
-                        continue
-
-                    activities.append(
-                        {
-                            "user_id": user_id,
-                            "date": date_key,
-                            "service": service,
-                            "action": action,
-                            "score": score,
-                            "event_id": record.get("eventID"),
-                        }
-                    )
-
-                    daily_totals[date_key] += score
-                    daily_service_scores[service_key] += score
-                    daily_action_scores[action_key] += score
+        update_last_processed_timestamp(user_id, datetime.now())
 
-                except Exception as e:
-                    logger.warning(
-                        f"Error processing S3 record from {key}: {str(e)}"
-                    )
-                    continue
+        return count
 
-    if activities:
-        store_activities(activities)
-        logger.info(
-            f"Stored {len(activities)} S3 activities for user {user_id} "
-            f"from bucket {bucket_name}"
+    except Exception as e:
+        logger.error(f"Error in process_cloudtrail_logs: {str(e)}")
+        raise
+
+
+def process_user_s3_logs(
+    user_id: int,
+    bucket_name: str,
+    s3_prefix: str = '',
+    aws_region: str = 'us-east-1',
+    aws_access_key: str = None,
+    aws_secret_key: str = None,
+    progress_callback=None,
+    listing_mode: str = None,
+    fetch_workers: int = None,
+    parse_processes: int = None,
+    backend: str = None,
+) -> int:
+    """
+    Process CloudTrail logs for a specific user from their own S3 bucket.
+    If aws_access_key/aws_secret_key are provided, uses those credentials.
+    Otherwise falls back to the machine's ambient AWS credential chain.
+
+    listing_mode is 'partitioned' (resume per region from stored checkpoints)
+    or 'flat' (list the whole prefix); defaults to S3_LISTING_MODE.
+    fetch_workers / parse_processes size the I/O threads and the CPU process
+    pool; they default to INGEST_FETCH_WORKERS / INGEST_PARSE_PROCESSES.
+    backend is 'threads' (one fetch thread per request) or 'asyncio' (one
+    event loop, INGEST_ASYNC_CONCURRENCY GETs in flight); defaults to
+    INGEST_BACKEND.
+
+    progress_callback(event, value) is called with:
+      ('total', n)       — total number of files to process
+      ('batch_done', n)  — n records processed in the latest batch
+    """
+    fetch_workers   = fetch_workers or INGEST_WORKERS
+    parse_processes = INGEST_PARSE_PROCESSES if parse_processes is None else parse_processes
+    s3 = _s3_client(aws_region, aws_access_key, aws_secret_key, max_connections=fetch_workers)
+
+    # Fetch registered AWS account ID for fraud validation
+    user_row = execute_query(
+        "SELECT aws_account_id FROM users WHERE id = %s",
+        (user_id,), fetch=True
+    )
+    registered_account_id = user_row[0]['aws_account_id'] if user_row else None
+
+    # The per-object manifest decides what is new. The LastModified cutoff is only
+    # used once, to bootstrap users who synced before the manifest existed.
+    modified_after = None
+    if not has_processed_objects(user_id):
+        modified_after = get_last_processed_timestamp(user_id)
+
+    if (listing_mode or S3_LISTING_MODE) == 'partitioned':
+        source = PartitionedS3LogSource(s3, bucket_name, user_id, prefix=s3_prefix, modified_after=modified_after)
+    else:
+        source = S3LogSource(s3, bucket_name, prefix=s3_prefix, modified_after=modified_after)
+
+    pipeline_kwargs = dict(
+        fraud_checks=True,
+        registered_account_id=registered_account_id,
+        verify_credentials=(aws_access_key, aws_secret_key),
+        aws_region=aws_region,
+        progress_callback=progress_callback,
+        manifest=ObjectManifest(user_id, source),
+        workers=fetch_workers,
+        parse_processes=parse_processes,
+    )
+    if (backend or INGEST_BACKEND) == 'asyncio':
+        pipeline = AsyncIngestionPipeline(
+            source, user_id,
+            client_kwargs=_s3_client_kwargs(aws_region, aws_access_key, aws_secret_key),
+            **pipeline_kwargs,
         )
+    else:
+        pipeline = IngestionPipeline(source, user_id, **pipeline_kwargs)
+    total_records = pipeline.run()
+
+    try:
+        update_last_processed_timestamp(user_id, datetime.now())
+    except Exception as e:
+        logger.error(f"Error updating last processed timestamp: {str(e)}")
+    if isinstance(source, PartitionedS3LogSource):
+        try:
+            source.commit_checkpoints(pipeline.manifest, settled=pipeline.skipped_keys)
+        except Exception as e:
+            # The next sync lists from the previous checkpoints; the manifest skips what is done
+            logger.error(f"Error committing listing checkpoints for user {user_id}: {str(e)}")
+
+    return total_records
+
+
+def process_local_cloudtrail_logs():
+    """
+    Process CloudTrail-style JSON or JSON.GZ log files from the local
+    backend/sample_logs directory and update activity and daily scores.
+    """
+    sample_logs_dir = os.path.join(os.path.dirname(__file__), "sample_logs")
+
+    if not os.path.isdir(sample_logs_dir):
+        logger.warning(f"Sample logs directory not found: {sample_logs_dir}")
+        return 0
+
+    return IngestionPipeline(LocalDirectorySource(sample_logs_dir), _local_ingest_user_id()).run()
+
+
+def process_s3_cloudtrail_logs(bucket_name):
+    """
+    Process CloudTrail-style JSON or JSON.GZ log files from the given S3
+    bucket and update activity and daily scores.
+    Uses the same pipeline as process_local_cloudtrail_logs().
+    """
+    user_id = _local_ingest_user_id()
+
+    # Fetch last processed timestamp to avoid reprocessing older objects.
+    last_processed = get_last_processed_timestamp(user_id)
+
+    source = S3LogSource(_s3_client(), bucket_name, modified_after=last_processed)
+    count = IngestionPipeline(source, user_id).run()
 
     # Update processing state after successful run to prevent duplicate processing.
     try:
@@ -729,98 +1333,155 @@ def process_s3_cloudtrail_logs(bucket_name):
             f"Error updating last processed timestamp after S3 ingestion: {str(e)}"
         )
 
-    return len(activities)
+    return count
+
+_ACTIVITY_COLUMNS = (
+    'user_id', 'date', 'service', 'action', 'score', 'event_id', 'source_key', 'verification_status', 'sync_id',
+)
+
+
+def _activity_rows(activities):
+    """Insert tuples for activities, keeping the first of any repeated (user_id, event_id)."""
+    rows, seen, day_text = [], set(), {}
+    for activity in activities:
+        user_id  = activity['user_id']
+        event_id = activity.get('event_id')
+        if event_id is not None:
+            key = (user_id, event_id)
+            if key in seen:
+                continue
+            seen.add(key)
+        day = activity['date']
+        text = day_text.get(day)
+        if text is None:
+            text = day_text[day] = str(day)   # A batch spans few days; format each once
+        rows.append((
+            user_id, text,
+            activity['service'], activity['action'],
+            int(activity['score']), event_id,
+            activity.get('source_key'), activity.get('verification_status') or VERIFIED,
+            activity.get('sync_id'),
+        ))
+    return rows
+
+
+def _copy_text(value):
+    """One field in PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _store_sqlite(cursor, rows):
+    # SQLite runs in-process, so an execute per row costs about what executemany does,
+    # and its rowcount tells which rows the insert accepted. Summing those here is
+    # cheaper than reading the batch back out of activity_logs with GROUP BY.
+    columns = ', '.join(_ACTIVITY_COLUMNS)
+    insert_sql = (
+        f"INSERT OR IGNORE INTO activity_logs ({columns}) VALUES ({', '.join(['?'] * len(_ACTIVITY_COLUMNS))})"
+    )
+    services = {}   # (user_id, date, service) → score accepted
+    for row in rows:
+        cursor.execute(insert_sql, row)
+        if cursor.rowcount > 0:
+            key = row[:3]
+            services[key] = services.get(key, 0) + row[4]
+
+    daily, credited = {}, {}
+    for (user_id, day, _), total in services.items():
+        daily[(user_id, day)] = daily.get((user_id, day), 0) + total
+        gained, first_day = credited.get(user_id, (0, day))
+        credited[user_id] = (gained + total, min(first_day, day))
+
+    cursor.executemany(
+        "INSERT INTO daily_scores (user_id, date, total_score) VALUES (?, ?, ?) "
+        "ON CONFLICT (user_id, date) DO UPDATE "
+        "SET total_score = MIN(daily_scores.total_score + excluded.total_score, ?)",
+        [(user_id, day, min(total, DAILY_SCORE_CAP), DAILY_SCORE_CAP) for (user_id, day), total in daily.items()]
+    )
+    cursor.executemany(
+        "INSERT INTO service_daily_totals (user_id, date, service, total) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (user_id, date, service) DO UPDATE "
+        "SET total = service_daily_totals.total + excluded.total",
+        [(user_id, day, service, total) for (user_id, day, service), total in services.items()]
+    )
+    return [(user_id, gained, first_day) for user_id, (gained, first_day) in credited.items()]
 
-# Global write lock for SQLite — prevents "database locked" under parallel ingestion
-_sqlite_write_lock = threading.Lock()
+
+def _store_postgres(cursor, rows):
+    columns = ', '.join(_ACTIVITY_COLUMNS)
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS staged_activities ("
+        "    user_id INTEGER, date DATE, service TEXT, action TEXT, score INTEGER, event_id TEXT,"
+        "    source_key TEXT, verification_status TEXT, sync_id TEXT"
+        ") ON COMMIT DELETE ROWS"
+    )
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_text(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY staged_activities ({columns}) FROM STDIN", buffer)
+    # daily_scores and service_daily_totals are credited from exactly the rows the insert accepted;
+    # the statement returns what each user gained for update_user_summaries()
+    cursor.execute(
+        "WITH inserted AS ("
+        f"    INSERT INTO activity_logs ({columns}) SELECT {columns} FROM staged_activities"
+        "    ON CONFLICT (user_id, event_id) DO NOTHING"
+        "    RETURNING user_id, date, service, score"
+        "), daily AS ("
+        "    INSERT INTO daily_scores (user_id, date, total_score)"
+        "    SELECT user_id, date, LEAST(SUM(score), %s) FROM inserted GROUP BY user_id, date"
+        "    ON CONFLICT (user_id, date) DO UPDATE"
+        "    SET total_score = LEAST(daily_scores.total_score + EXCLUDED.total_score, %s)"
+        "), services AS ("
+        "    INSERT INTO service_daily_totals (user_id, date, service, total)"
+        "    SELECT user_id, date, service, SUM(score) FROM inserted GROUP BY user_id, date, service"
+        "    ON CONFLICT (user_id, date, service) DO UPDATE"
+        "    SET total = service_daily_totals.total + EXCLUDED.total"
+        ") "
+        "SELECT user_id, SUM(score), MIN(date) FROM inserted GROUP BY user_id",
+        (DAILY_SCORE_CAP, DAILY_SCORE_CAP)
+    )
+    return cursor.fetchall()
 
 
 def store_activities(activities):
     """
-    Bulk-insert scored activities using INSERT OR IGNORE for dedup,
-    then upsert daily_scores — all in a single DB connection.
+    Bulk-insert scored activities, skipping event_ids already stored, and add
+    the newly stored scores to daily_scores and service_daily_totals — one transaction.
+    Postgres streams the rows in with COPY through a temp staging table and
+    credits the rollups in one statement. SQLite, where a round trip costs
+    nothing, inserts row by row on the writer thread, sums what was accepted
+    and upserts the rollups once per day/service, sharing a commit with
+    whatever else is queued. The
+    user_summary rows and data_version of the users credited are updated in the
+    same transaction, and their leaderboard entries once it commits.
     """
     if not activities:
         return
 
-    from contextlib import nullcontext
-    from database import get_db_connection, DB_ENGINE, _convert_sqlite_placeholders
-
-    lock_ctx = _sqlite_write_lock if DB_ENGINE == 'sqlite' else nullcontext()
-    with lock_ctx:
-        conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        daily_aggregates = {}
-
-        if DB_ENGINE == 'sqlite':
-            insert_sql = (
-                "INSERT OR IGNORE INTO activity_logs "
-                "(user_id, date, service, action, score, event_id) "
-                "VALUES (?, ?, ?, ?, ?, ?)"
-            )
-        else:
-            insert_sql = (
-                "INSERT INTO activity_logs "
-                "(user_id, date, service, action, score, event_id) "
-                "VALUES (%s, %s, %s, %s, %s, %s) "
-                "ON CONFLICT (user_id, event_id) DO NOTHING"
-            )
+    from database import run_write, DB_ENGINE
 
-        for activity in activities:
-            try:
-                row = (
-                    activity['user_id'], activity['date'],
-                    activity['service'], activity['action'],
-                    activity['score'], activity.get('event_id'),
-                )
-                cursor.execute(insert_sql, row)
-                if cursor.rowcount > 0:
-                    key = (activity['user_id'], activity['date'])
-                    daily_aggregates[key] = daily_aggregates.get(key, 0) + int(activity['score'])
-            except Exception as e:
-                logger.error(f"Error storing activity: {e}")
-                continue
+    rows = _activity_rows(activities)
+    store = _store_sqlite if DB_ENGINE == 'sqlite' else _store_postgres
 
-        # Upsert daily_scores in the same connection
-        for (user_id, date_value), day_total in daily_aggregates.items():
-            try:
-                if DB_ENGINE == 'sqlite':
-                    cursor.execute(
-                        "SELECT total_score FROM daily_scores WHERE user_id = ? AND date = ?",
-                        (user_id, date_value)
-                    )
-                    row = cursor.fetchone()
-                    existing_total = int(row[0]) if row else 0
-                    new_total = min(existing_total + day_total, DAILY_SCORE_CAP)
-                    if row:
-                        cursor.execute(
-                            "UPDATE daily_scores SET total_score = ? WHERE user_id = ? AND date = ?",
-                            (new_total, user_id, date_value)
-                        )
-                    else:
-                        cursor.execute(
-                            "INSERT INTO daily_scores (user_id, date, total_score) VALUES (?, ?, ?)",
-                            (user_id, date_value, new_total)
-                        )
-                else:
-                    cursor.execute(
-                        "INSERT INTO daily_scores (user_id, date, total_score) VALUES (%s, %s, %s) "
-                        "ON CONFLICT (user_id, date) DO UPDATE "
-                        "SET total_score = LEAST(daily_scores.total_score + EXCLUDED.total_score, %s)",
-                        (user_id, date_value, min(day_total, DAILY_SCORE_CAP), DAILY_SCORE_CAP)
-                    )
-            except Exception as e:
-                logger.error(f"Error updating daily score for user_id={user_id} date={date_value}: {e}")
-                continue
+    def write(cursor):
+        credited = store(cursor, rows)
+        update_user_summaries(cursor, credited)
+        user_ids = [user_id for user_id, _, _ in credited]
+        bump_data_version(cursor, user_ids)
+        return user_ids
 
-        conn.commit()
+    try:
+        credited = run_write(write)
     except Exception as e:
-        conn.rollback()
         logger.error(f"store_activities failed: {e}")
         raise
-    finally:
-        conn.close()
+    try:
+        refresh_users(credited)
+    except Exception as e:
+        logger.warning(f"Leaderboard refresh failed, boards catch up on rebuild: {e}")
 
 def get_last_processed_timestamp(user_id):
     try:
@@ -836,23 +1497,63 @@ def get_last_processed_timestamp(user_id):
 
 def update_last_processed_timestamp(user_id, timestamp):
     try:
-        from database import DB_ENGINE
-        existing = execute_query(
-            "SELECT id FROM processing_state WHERE user_id = %s",
+        execute_query(
+            "INSERT INTO processing_state (user_id, last_processed_timestamp) VALUES (%s, %s) "
+            "ON CONFLICT (user_id) DO UPDATE SET last_processed_timestamp = excluded.last_processed_timestamp",
+            (user_id, timestamp)
+        )
+    except Exception as e:
+        logger.error(f"Error updating last processed timestamp: {str(e)}")
+        raise
+
+
+def has_processed_objects(user_id):
+    """True once at least one object has been ingested and recorded in the user's manifest."""
+    try:
+        return bool(execute_query(
+            "SELECT 1 FROM processed_objects WHERE user_id = %s AND status = 'done' LIMIT 1",
             (user_id,), fetch=True
+        ))
+    except Exception as e:
+        logger.warning(f"Error checking processed objects: {str(e)}")
+        return False
+
+def get_capped_days(user_id):
+    """Date ordinals whose stored daily score has reached DAILY_SCORE_CAP."""
+    try:
+        rows = execute_query(
+            "SELECT date FROM daily_scores WHERE user_id = %s AND total_score >= %s",
+            (user_id, DAILY_SCORE_CAP), fetch=True
         )
-        if existing:
-            execute_query(
-                "UPDATE processing_state SET last_processed_timestamp = %s WHERE user_id = %s",
-                (timestamp, user_id)
-            )
-        else:
+        return {date.fromisoformat(str(row['date'])[:10]).toordinal() for row in rows}
+    except Exception as e:
+        logger.warning(f"Error getting capped days: {str(e)}")
+        return set()
+
+def get_listing_checkpoints(user_id, bucket):
+    """Return {region_prefix: last_key} for a user's bucket."""
+    try:
+        rows = execute_query(
+            "SELECT region_prefix, last_key FROM s3_listing_checkpoints WHERE user_id = %s AND bucket = %s",
+            (user_id, bucket), fetch=True
+        )
+        return {row['region_prefix']: row['last_key'] for row in rows}
+    except Exception as e:
+        logger.warning(f"Error getting listing checkpoints: {str(e)}")
+        return {}
+
+def update_listing_checkpoints(user_id, bucket, checkpoints):
+    try:
+        for region_prefix, last_key in checkpoints.items():
             execute_query(
-                "INSERT INTO processing_state (user_id, last_processed_timestamp) VALUES (%s, %s)",
-                (user_id, timestamp)
+                "INSERT INTO s3_listing_checkpoints (user_id, bucket, region_prefix, last_key) "
+                "VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (user_id, bucket, region_prefix) DO UPDATE "
+                "SET last_key = EXCLUDED.last_key, updated_at = CURRENT_TIMESTAMP",
+                (user_id, bucket, region_prefix, last_key)
             )
     except Exception as e:
-        logger.error(f"Error updating last processed timestamp: {str(e)}")
+        logger.error(f"Error updating listing checkpoints: {str(e)}")
         raise
 
 
@@ -860,11 +1561,12 @@ def update_last_processed_timestamp(user_id, timestamp):
 # If the ingestion module is imported and the environment variable
 # PROCESS_LOCAL_CLOUDTRAIL_LOGS_ON_START is set to a truthy value,
 # local CloudTrail logs in backend/sample_logs/ will be processed.
+# Parse-pool worker processes import this module too; they must not re-run it.
 if os.getenv("PROCESS_LOCAL_CLOUDTRAIL_LOGS_ON_START", "").lower() in (
     "1",
     "true",
     "yes",
-):
+) and multiprocessing.parent_process() is None:
     try:
         logger.info(
             "PROCESS_LOCAL_CLOUDTRAIL_LOGS_ON_START is set; "
@@ -0,0 +1,218 @@
+# CloudProof leaderboards
+#
+# A board ranks users by score over a window — all time, the last 7 days or the
+# last 30 — either overall or for one service. Each board is a RankingIndex: the
+# users' scores in a list kept sorted by bisection, so "rank of user X" is a
+# binary search and top-N is a slice, however many users there are.
+#
+# Boards are built on first use from the rollups (user_summary for the all-time
+# overall board, service_daily_totals for the rest) and kept current by
+# store_activities() and revoke_files(), which call refresh_users() for the
+# users they changed. Writes made by another process (the scheduler) reach a
+# board when it is rebuilt: after BOARD_MAX_AGE seconds, or when a windowed
+# board's first day moves on. At most MAX_BOARDS boards are kept; the least
+# recently used one is dropped to make room.
+
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from config import CREDIBILITY_TIERS
+from database import execute_query
+from scoring import SCORING_RULES
+
+WINDOWS = {'all': None, 'week': 7, 'month': 30}   # Window name → days, None for all time
+BOARD_MAX_AGE = 300     # Seconds before a board is rebuilt from the database
+MAX_LIMIT     = 100     # Most entries one top-N request returns
+MAX_BOARDS    = 32      # Boards kept in memory; each holds a score per ranked user
+SERVICES      = frozenset(SCORING_RULES)   # Services a board can be filtered to
+
+_TIER_COLORS = {tier['name']: tier['color'] for tier in CREDIBILITY_TIERS}
+
+
+class RankingIndex:
+    """Users ordered by score, highest first, with ties broken by user id."""
+
+    __slots__ = ('scores', 'order')
+
+    def __init__(self, scores=None):
+        self.scores = {user_id: score for user_id, score in (scores or {}).items() if score > 0}
+        self.order  = sorted((-score, user_id) for user_id, score in self.scores.items())
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self, user_id, score):
+        old = self.scores.pop(user_id, None)
+        if old is not None:
+            del self.order[bisect_left(self.order, (-old, user_id))]
+        if score > 0:
+            self.scores[user_id] = score
+            insort(self.order, (-score, user_id))
+
+    def rank(self, user_id):
+        """1 + the number of users with a higher score, or None if user_id has no score."""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self.order, (-score,)) + 1
+
+    def top(self, n):
+        """(rank, user_id, score) of the first n users; tied users share a rank."""
+        entries = []
+        for position, (negated, user_id) in enumerate(self.order[:n]):
+            if entries and entries[-1][2] == -negated:
+                rank = entries[-1][0]
+            else:
+                rank = position + 1
+            entries.append((rank, user_id, -negated))
+        return entries
+
+
+class _Board:
+    __slots__ = ('index', 'since', 'built_at')
+
+    def __init__(self, index, since):
+        self.index    = index
+        self.since    = since          # First date counted, None for all time
+        self.built_at = time.monotonic()
+
+
+_boards = OrderedDict()   # (window, service or None) → _Board, least recently used first
+_boards_lock = threading.Lock()
+
+
+def _window_start(window):
+    days = WINDOWS[window]
+    return date.today() - timedelta(days=days - 1) if days else None
+
+
+def _load_scores(since, service):
+    """{user_id: score} for every user with a score on one board."""
+    if since is None and service is None:
+        rows = execute_query(
+            "SELECT user_id, total_score AS score FROM user_summary WHERE total_score > 0",
+            fetch=True, read_only=True
+        )
+    else:
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("date >= %s")
+            params.append(since.isoformat())
+        if service is not None:
+            conditions.append("service = %s")
+            params.append(service)
+        rows = execute_query(
+            f"SELECT user_id, SUM(total) AS score FROM service_daily_totals "
+            f"WHERE {' AND '.join(conditions)} GROUP BY user_id",
+            tuple(params), fetch=True, read_only=True
+        )
+    return {row['user_id']: int(row['score']) for row in rows}
+
+
+def _user_scores(user_id, since):
+    """{service: score} for one user from since (or all time), plus None → their overall score."""
+    if since is None:
+        rows = execute_query(
+            "SELECT service, SUM(total) AS score FROM service_daily_totals WHERE user_id = %s GROUP BY service",
+            (user_id,), fetch=True
+        )
+    else:
+        rows = execute_query(
+            "SELECT service, SUM(total) AS score FROM service_daily_totals "
+            "WHERE user_id = %s AND date >= %s GROUP BY service",
+            (user_id, since.isoformat()), fetch=True
+        )
+    scores = {row['service']: int(row['score']) for row in rows}
+    scores[None] = sum(scores.values())
+    return scores
+
+
+def _board(window, service):
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown leaderboard window: {window}")
+    if service is not None and service not in SERVICES:
+        raise ValueError(f"Unknown leaderboard service: {service}")
+    key   = (window, service)
+    since = _window_start(window)
+    with _boards_lock:
+        board = _boards.get(key)
+        if board is not None and board.since == since and time.monotonic() - board.built_at < BOARD_MAX_AGE:
+            _boards.move_to_end(key)
+            return board
+    board = _Board(RankingIndex(_load_scores(since, service)), since)
+    with _boards_lock:
+        _boards[key] = board
+        _boards.move_to_end(key)
+        while len(_boards) > MAX_BOARDS:
+            _boards.popitem(last=False)
+    return board
+
+
+def refresh_users(user_ids):
+    """Re-read the scores of user_ids on every board built so far (after their activity changed)."""
+    with _boards_lock:
+        boards = list(_boards.items())
+    if not boards or not user_ids:
+        return
+    for user_id in set(user_ids):
+        by_since = {}
+        for (window, service), board in boards:
+            if board.since not in by_since:
+                by_since[board.since] = _user_scores(user_id, board.since)
+            score = by_since[board.since].get(service, 0)
+            with _boards_lock:
+                board.index.update(user_id, score)
+
+
+def _profiles(user_ids):
+    if not user_ids:
+        return {}
+    rows = execute_query(
+        "SELECT u.id, u.username, u.name, s.tier FROM users u "
+        "LEFT JOIN user_summary s ON s.user_id = u.id "
+        f"WHERE u.id IN ({', '.join(['%s'] * len(user_ids))})",
+        tuple(user_ids), fetch=True, read_only=True
+    )
+    return {row['id']: row for row in rows}
+
+
+def _entry(rank, score, profile):
+    tier = (profile or {}).get('tier') or CREDIBILITY_TIERS[0]['name']
+    return {
+        'rank':     rank,
+        'username': profile['username'] if profile else None,
+        'name':     profile['name'] if profile else None,
+        'score':    score,
+        'tier':     tier,
+        'color':    _TIER_COLORS.get(tier),
+    }
+
+
+def top(window='all', service=None, limit=20):
+    """The first `limit` entries of a board."""
+    board = _board(window, service)
+    with _boards_lock:
+        ranked = board.index.top(min(limit, MAX_LIMIT))
+        total  = len(board.index)
+    profiles = _profiles([user_id for _, user_id, _ in ranked])
+    return {
+        'window':  window,
+        'service': service,
+        'total':   total,
+        'entries': [_entry(rank, score, profiles.get(user_id)) for rank, user_id, score in ranked],
+    }
+
+
+def rank_of(user_id, window='all', service=None):
+    """A user's entry on a board; rank is None when they have no score in it."""
+    board = _board(window, service)
+    with _boards_lock:
+        rank  = board.index.rank(user_id)
+        score = board.index.scores.get(user_id, 0)
+        total = len(board.index)
+    entry = _entry(rank, score, _profiles([user_id]).get(user_id))
+    entry.update({'window': window, 'service': service, 'total': total})
+    return entry
@@ -0,0 +1,107 @@
+# CloudProof score percentiles
+#
+# score_histogram counts users by total score in fixed-width buckets: bucket b
+# holds scores from b * BUCKET_WIDTH up to the next bucket, and the last bucket
+# is open-ended. Ingestion keeps it current — whenever a user_summary total
+# changes, the user moves from their old bucket to their new one in the same
+# transaction — and rebuild_histogram(), run hourly by the scheduler, recounts
+# it from user_summary to pick up deleted users and any drift.
+#
+# percentile() answers from an in-memory copy with running counts, reloaded
+# every HISTOGRAM_MAX_AGE seconds: one index and one multiply per lookup, with
+# users spread evenly across the width of a bucket. histogram_version() names
+# that copy by its contents, for caches of responses that carry a percentile.
+
+import hashlib
+import threading
+import time
+from array import array
+
+from database import execute_query, run_write, DB_ENGINE
+
+BUCKET_WIDTH      = 10
+BUCKETS           = 5000    # Scores of BUCKET_WIDTH * (BUCKETS - 1) and up share the last bucket
+HISTOGRAM_MAX_AGE = 60      # Seconds the in-memory copy is reused
+
+_cache = None   # (loaded_at, counts per bucket, users below each bucket, total users, version)
+_cache_lock = threading.Lock()
+
+
+def _bucket(score):
+    return min(max(int(score), 0) // BUCKET_WIDTH, BUCKETS - 1)
+
+
+def move_score(cursor, old_score, new_score):
+    """Move one user from old_score's bucket to new_score's (old_score None for a new user)."""
+    if old_score is not None and _bucket(old_score) == _bucket(new_score):
+        return
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    if old_score is not None:
+        cursor.execute(
+            f"UPDATE score_histogram SET users = users - 1 WHERE bucket = {placeholder} AND users > 0",
+            (_bucket(old_score),)
+        )
+    cursor.execute(
+        f"INSERT INTO score_histogram (bucket, users) VALUES ({placeholder}, 1) "
+        f"ON CONFLICT (bucket) DO UPDATE SET users = score_histogram.users + 1",
+        (_bucket(new_score),)
+    )
+
+
+def rebuild_histogram():
+    """Recount score_histogram from user_summary in one transaction."""
+    def rebuild(cursor):
+        cursor.execute("DELETE FROM score_histogram")
+        cursor.execute(
+            f"INSERT INTO score_histogram (bucket, users) "
+            f"SELECT bucket, COUNT(*) FROM ("
+            f"    SELECT CASE WHEN total_score >= {BUCKET_WIDTH * (BUCKETS - 1)} THEN {BUCKETS - 1} "
+            f"                WHEN total_score < 0 THEN 0 "
+            f"                ELSE total_score / {BUCKET_WIDTH} END AS bucket"
+            f"    FROM user_summary"
+            f") buckets GROUP BY bucket"
+        )
+        return cursor.rowcount
+
+    buckets = run_write(rebuild)
+    global _cache
+    with _cache_lock:
+        _cache = None
+    return buckets
+
+
+def _distribution():
+    global _cache
+    with _cache_lock:
+        if _cache is not None and time.monotonic() - _cache[0] < HISTOGRAM_MAX_AGE:
+            return _cache
+    counts = [0] * BUCKETS
+    for row in execute_query("SELECT bucket, users FROM score_histogram WHERE users > 0", fetch=True, read_only=True):
+        counts[min(int(row['bucket']), BUCKETS - 1)] += int(row['users'])
+    below, running = [], 0
+    for count in counts:
+        below.append(running)
+        running += count
+    version = hashlib.blake2s(array('q', counts).tobytes(), digest_size=8).hexdigest()
+    with _cache_lock:
+        _cache = (time.monotonic(), counts, below, running, version)
+        return _cache
+
+
+def percentile(score):
+    """Share of users (0–100) with a lower total score than score, or None before any are counted."""
+    _, counts, below, total, _ = _distribution()
+    if not total:
+        return None
+    bucket = _bucket(score)
+    within = 0.0 if bucket == BUCKETS - 1 else (max(int(score), 0) - bucket * BUCKET_WIDTH) / BUCKET_WIDTH
+    return round(100.0 * (below[bucket] + counts[bucket] * within) / total, 1)
+
+
+def histogram_version():
+    """
+    Digest of the bucket counts percentile() currently answers from. It changes
+    whenever a percentile could, and is the same in every process that loaded
+    the same histogram.
+    """
+    return _distribution()[4]
@@ -11,6 +11,7 @@ from datetime import datetime
 from database import execute_query
 from ingestion import process_user_s3_logs
 from credentials import decrypt_credential
+from percentiles import rebuild_histogram
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +22,7 @@ logger = logging.getLogger(__name__)
 # ── Config ────────────────────────────────────────────────────────────────────
 SYNC_TIME      = "02:00"   # Run daily at 2:00 AM
 MAX_WORKERS    = 3         # Max users syncing simultaneously
+HISTOGRAM_REBUILD_MINUTES = 60   # Recount the score percentile histogram this often
 
 
 def sync_all_users():
@@ -84,17 +86,31 @@ def sync_all_users():
     logger.info(f"=== Auto-sync complete: {success} succeeded, {failed} failed ===")
 
 
+def rebuild_score_histogram():
+    """Recount score_histogram from user_summary; ingestion keeps it current in between."""
+    try:
+        buckets = rebuild_histogram()
+        logger.info(f"Score histogram rebuilt: {buckets} bucket(s)")
+    except Exception as e:
+        logger.error(f"Score histogram rebuild failed: {e}")
+
+
 # ── Schedule ──────────────────────────────────────────────────────────────────
 # Only register the schedule when running as a standalone script,
 # NOT when imported by app.py (which registers its own schedule).
 if __name__ == '__main__':
     schedule.every().day.at(SYNC_TIME).do(sync_all_users)
+    schedule.every(HISTOGRAM_REBUILD_MINUTES).minutes.do(rebuild_score_histogram)
 
 if __name__ == '__main__':
     logger.info(f"CloudProof Auto-Sync Scheduler started.")
     logger.info(f"Scheduled daily at {SYNC_TIME}.")
     logger.info("Press Ctrl+C to stop.")
 
+    # Verify the samples queued by each sync in the background
+    from verification import start_verifier
+    start_verifier()
+
     # Run once immediately on startup
     logger.info("Running initial sync on startup...")
     sync_all_users()
@@ -31,6 +31,7 @@ CREATE TABLE IF NOT EXISTS users (
     aws_account_id            TEXT,
     aws_user_arn              TEXT,
     last_auto_synced_at       TIMESTAMP,
+    data_version              INTEGER NOT NULL DEFAULT 0,
     created_at                TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -61,6 +62,9 @@ CREATE TABLE IF NOT EXISTS activity_logs (
     score       INTEGER NOT NULL,
     event_id    TEXT,
     timestamp   TIMESTAMP,
+    source_key  TEXT,
+    verification_status TEXT DEFAULT 'verified',
+    sync_id     TEXT,
     created_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(user_id, event_id)
 );
@@ -73,6 +77,38 @@ CREATE TABLE IF NOT EXISTS daily_scores (
     UNIQUE(user_id, date)
 );
 
+-- Per-service rollup of activity_logs.score, maintained by store_activities;
+-- fill it for existing data with: python backfill.py service-daily-totals
+CREATE TABLE IF NOT EXISTS service_daily_totals (
+    id           SERIAL PRIMARY KEY,
+    user_id      INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    date         DATE NOT NULL,
+    service      TEXT NOT NULL,
+    total        INTEGER NOT NULL,
+    UNIQUE(user_id, date, service)
+);
+
+-- Profile header figures, maintained by store_activities (see summaries.py)
+CREATE TABLE IF NOT EXISTS user_summary (
+    id                SERIAL PRIMARY KEY,
+    user_id           INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    total_score       INTEGER NOT NULL DEFAULT 0,
+    current_streak    INTEGER NOT NULL DEFAULT 0,
+    longest_streak    INTEGER NOT NULL DEFAULT 0,
+    last_active_date  DATE,
+    tier              TEXT,
+    updated_at        TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id)
+);
+
+-- Users per total-score bucket for percentile lookups (see percentiles.py)
+CREATE TABLE IF NOT EXISTS score_histogram (
+    id          SERIAL PRIMARY KEY,
+    bucket      INTEGER NOT NULL,
+    users       INTEGER NOT NULL DEFAULT 0,
+    UNIQUE(bucket)
+);
+
 CREATE TABLE IF NOT EXISTS processing_state (
     id                         SERIAL PRIMARY KEY,
     user_id                    INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
@@ -80,6 +116,54 @@ CREATE TABLE IF NOT EXISTS processing_state (
     UNIQUE(user_id)
 );
 
+CREATE TABLE IF NOT EXISTS processed_objects (
+    id              SERIAL PRIMARY KEY,
+    user_id         INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    object_key      TEXT NOT NULL,
+    etag            TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'done',   -- or 'failed' (retried) / 'abandoned' (gave up)
+    attempts        INTEGER NOT NULL DEFAULT 0,     -- Syncs that failed to read this ETag
+    processed_at    TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, object_key, etag)
+);
+
+CREATE TABLE IF NOT EXISTS s3_listing_checkpoints (
+    id              SERIAL PRIMARY KEY,
+    user_id         INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    bucket          TEXT NOT NULL,
+    region_prefix   TEXT NOT NULL,
+    last_key        TEXT NOT NULL,
+    updated_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, bucket, region_prefix)
+);
+
+CREATE TABLE IF NOT EXISTS verification_queue (
+    id              SERIAL PRIMARY KEY,
+    user_id         INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    sync_id         TEXT,
+    object_key      TEXT NOT NULL,
+    event_id        TEXT NOT NULL,
+    event_name      TEXT NOT NULL,
+    event_time      TEXT NOT NULL,
+    aws_region      TEXT,
+    status          TEXT NOT NULL DEFAULT 'pending',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    created_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    checked_at      TIMESTAMP,
+    UNIQUE(user_id, event_id)
+);
+
+CREATE TABLE IF NOT EXISTS verified_events (
+    id              SERIAL PRIMARY KEY,
+    user_id         INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    event_id        TEXT NOT NULL,
+    event_name      TEXT NOT NULL,
+    verified_at     TIMESTAMP NOT NULL,
+    UNIQUE(user_id, event_id)
+);
+
+-- Served with a data_version ETag: whatever writes here must call
+-- summaries.bump_data_version() for the user in the same transaction
 CREATE TABLE IF NOT EXISTS resource_state (
     id                  SERIAL PRIMARY KEY,
     user_id             INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
@@ -92,7 +176,22 @@ CREATE TABLE IF NOT EXISTS resource_state (
     UNIQUE(user_id, resource_type, resource_id)
 );
 
+-- Columns added after the initial release (safe to re-run on existing databases)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE activity_logs ADD COLUMN IF NOT EXISTS source_key TEXT;
+ALTER TABLE activity_logs ADD COLUMN IF NOT EXISTS verification_status TEXT DEFAULT 'verified';
+ALTER TABLE activity_logs ADD COLUMN IF NOT EXISTS sync_id TEXT;
+ALTER TABLE verification_queue ADD COLUMN IF NOT EXISTS sync_id TEXT;
+ALTER TABLE processed_objects ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'done';
+ALTER TABLE processed_objects ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
 CREATE INDEX IF NOT EXISTS idx_activity_logs_user_date  ON activity_logs(user_id, date);
 CREATE INDEX IF NOT EXISTS idx_activity_logs_event_id   ON activity_logs(user_id, event_id) WHERE event_id IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_daily_scores_user_date   ON daily_scores(user_id, date);
 CREATE INDEX IF NOT EXISTS idx_resource_state_user      ON resource_state(user_id, resource_type, state);
+CREATE INDEX IF NOT EXISTS idx_activity_logs_source     ON activity_logs(user_id, source_key) WHERE source_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_verification_queue_status ON verification_queue(status, id);
+CREATE INDEX IF NOT EXISTS idx_verification_queue_object ON verification_queue(user_id, object_key);
+CREATE INDEX IF NOT EXISTS idx_activity_logs_sync       ON activity_logs(user_id, sync_id) WHERE sync_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_verification_queue_sync  ON verification_queue(user_id, sync_id, status);
+CREATE INDEX IF NOT EXISTS idx_verified_events_verified_at ON verified_events(verified_at);
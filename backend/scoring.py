@@ -677,7 +677,52 @@ def should_ignore_action(action):
     return False
 
 
+# ── Compiled lookup ───────────────────────────────────────────────────────────
+# SCORING_RULES is flattened once at import into a single dict keyed on
+# (SERVICE, action), with ignored/read-only actions pre-resolved to 0.
+# Raw CloudTrail (eventSource, eventName) pairs are resolved through a second
+# memo so callers never split/upper the event source per record. Misses
+# (unknown or read-only actions) are memoized as 0 as well.
+
+_IGNORED_PREFIXES = tuple(IGNORED_ACTIONS)
+_EVENT_CACHE_LIMIT = 100_000
+
+_SCORE_TABLE = {
+    (service, action): (0 if action.startswith(_IGNORED_PREFIXES) else points)
+    for service, actions in SCORING_RULES.items()
+    for action, points in actions.items()
+}
+_score_memo = dict(_SCORE_TABLE)
+_event_memo = {}
+
+
+def _resolve_score(service, action):
+    """Slow path: score an action that is not in the compiled table yet."""
+    score = 0 if action.startswith(_IGNORED_PREFIXES) else _SCORE_TABLE.get((service, action), 0)
+    if len(_score_memo) < _EVENT_CACHE_LIMIT:
+        _score_memo[(service, action)] = score
+    return score
+
+
+def score_event(event_source, event_name):
+    """
+    Score a raw CloudTrail event. Returns (service, score), e.g.
+    ('ec2.amazonaws.com', 'RunInstances') → ('EC2', 5).
+    """
+    try:
+        return _event_memo[(event_source, event_name)]
+    except KeyError:
+        pass
+    service = event_source.split('.')[0].upper()
+    result  = (service, calculate_score(service, event_name))
+    # Bounded so crafted logs full of junk event names cannot grow it forever
+    if len(_event_memo) < _EVENT_CACHE_LIMIT:
+        _event_memo[(event_source, event_name)] = result
+    return result
+
+
 def calculate_score(service, action):
-    if should_ignore_action(action):
-        return 0
-    return SCORING_RULES.get(service, {}).get(action, 0)
+    try:
+        return _score_memo[(service, action)]
+    except KeyError:
+        return _resolve_score(service, action)
@@ -0,0 +1,142 @@
+# CloudProof per-user summaries
+#
+# user_summary keeps one row per user with what a profile header shows: the
+# all-time total score, the current and longest runs of consecutive active days,
+# the last active date and the credibility tier. A page view reads that row
+# instead of replaying the user's daily_scores.
+#
+# store_activities() updates the rows of the users it credited inside its own
+# write transaction. New days almost always land on or after last_active_date,
+# so the streaks are extended from just the days past it and the total grows by
+# the score added. A batch that reaches back before last_active_date (a late
+# log file, a test sync) and a revocation recompute that user from daily_scores
+# and service_daily_totals instead. Every change of total also moves the user
+# between score_histogram buckets (see percentiles.py).
+
+from datetime import date
+
+from config import get_credibility
+from database import execute_query, DB_ENGINE
+from percentiles import move_score
+
+
+def _ordinal(value):
+    return date.fromisoformat(str(value)[:10]).toordinal()
+
+
+def _streaks(days, current=0, longest=0, previous=None):
+    """(current, longest) run of consecutive days after walking the sorted date ordinals in days,
+    continuing from a run of `current` days ending on `previous`."""
+    for day in days:
+        current = current + 1 if previous is not None and day == previous + 1 else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+
+def _save(cursor, user_id, total_score, current, longest, last_active, previous_total):
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    values = ', '.join([placeholder] * 6)
+    cursor.execute(
+        f"INSERT INTO user_summary (user_id, total_score, current_streak, longest_streak, last_active_date, tier) "
+        f"VALUES ({values}) "
+        f"ON CONFLICT (user_id) DO UPDATE SET total_score = excluded.total_score, "
+        f"current_streak = excluded.current_streak, longest_streak = excluded.longest_streak, "
+        f"last_active_date = excluded.last_active_date, tier = excluded.tier, updated_at = CURRENT_TIMESTAMP",
+        (user_id, total_score, current, longest,
+         date.fromordinal(last_active).isoformat() if last_active else None,
+         get_credibility(total_score)['tier'])
+    )
+    move_score(cursor, previous_total, total_score)
+
+
+def refresh_user_summary(cursor, user_id):
+    """Recompute user_id's summary row from daily_scores and service_daily_totals."""
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    cursor.execute(f"SELECT total_score FROM user_summary WHERE user_id = {placeholder}", (user_id,))
+    previous = cursor.fetchone()
+    cursor.execute(f"SELECT date FROM daily_scores WHERE user_id = {placeholder} ORDER BY date", (user_id,))
+    days = [_ordinal(row[0]) for row in cursor.fetchall()]
+    cursor.execute(
+        f"SELECT COALESCE(SUM(total), 0) FROM service_daily_totals WHERE user_id = {placeholder}", (user_id,)
+    )
+    total_score = int(cursor.fetchone()[0])
+    current, longest = _streaks(days)
+    _save(cursor, user_id, total_score, current, longest, days[-1] if days else None,
+          previous[0] if previous else None)
+
+
+def update_user_summaries(cursor, credited):
+    """
+    Bring the summaries of credited users up to date after a store.
+    credited holds (user_id, score added, earliest date stored) per user.
+    """
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    for user_id, added, first_day in credited:
+        cursor.execute(
+            f"SELECT total_score, current_streak, longest_streak, last_active_date "
+            f"FROM user_summary WHERE user_id = {placeholder}",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        if row is None or row[3] is None or _ordinal(first_day) < _ordinal(row[3]):
+            refresh_user_summary(cursor, user_id)
+            continue
+
+        last_active = _ordinal(row[3])
+        cursor.execute(
+            f"SELECT date FROM daily_scores WHERE user_id = {placeholder} AND date > {placeholder} ORDER BY date",
+            (user_id, date.fromordinal(last_active).isoformat())
+        )
+        days = [_ordinal(r[0]) for r in cursor.fetchall()]
+        current, longest = _streaks(days, row[1], row[2], last_active)
+        _save(cursor, user_id, int(row[0]) + int(added), current, longest, days[-1] if days else last_active, row[0])
+
+
+def bump_data_version(cursor, user_ids):
+    """
+    Mark the public data of user_ids as changed; profile ETags are derived from users.data_version.
+    Every write to activity_logs, daily_scores, service_daily_totals, user_summary or
+    resource_state must call this in the same transaction, or clients keep a stale 304.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    cursor.execute(
+        f"UPDATE users SET data_version = data_version + 1 WHERE id IN ({', '.join([placeholder] * len(user_ids))})",
+        tuple(user_ids)
+    )
+
+
+def get_user_summary(user_id, read_only=True):
+    """
+    The user's summary row. Users stored before user_summary existed have none
+    until `python backfill.py user-summary` runs; for them it is computed from
+    the rollups without being saved, so a page view never writes.
+    read_only=False reads from the primary even when a replica is configured.
+    """
+    rows = execute_query(
+        "SELECT total_score, current_streak, longest_streak, last_active_date, tier "
+        "FROM user_summary WHERE user_id = %s",
+        (user_id,), fetch=True, read_only=read_only
+    )
+    if rows:
+        return rows[0]
+    days = execute_query(
+        "SELECT date FROM daily_scores WHERE user_id = %s ORDER BY date", (user_id,), fetch=True, read_only=read_only
+    )
+    days = [_ordinal(row['date']) for row in days]
+    total = execute_query(
+        "SELECT COALESCE(SUM(total), 0) AS total FROM service_daily_totals WHERE user_id = %s",
+        (user_id,), fetch=True, read_only=read_only
+    )
+    total_score = int(total[0]['total'])
+    current, longest = _streaks(days)
+    return {
+        'total_score': total_score,
+        'current_streak': current,
+        'longest_streak': longest,
+        'last_active_date': date.fromordinal(days[-1]).isoformat() if days else None,
+        'tier': get_credibility(total_score)['tier'],
+    }
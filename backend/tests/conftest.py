@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DB_ENGINE'] = 'sqlite'
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'postgres: needs a PostgreSQL server (CLOUDPROOF_TEST_POSTGRES_DSN)')
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Point the SQLite backend at a fresh database file for one test."""
+    import database
+
+    monkeypatch.setattr(database, 'SQLITE_DB_PATH', str(tmp_path / 'cloudproof.db'))
+    monkeypatch.setattr(database, 'SQLITE_INITIALIZED', False)
+    return database
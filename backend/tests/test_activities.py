@@ -0,0 +1,58 @@
+import random
+from datetime import date
+
+import pytest
+
+from activities import ActivityBatchBuilder, CapTotals, apply_caps
+from benchmarks import _legacy_apply_daily_caps
+
+SERVICES = {
+    'EC2': ['RunInstances', 'CreateVpc'], 'S3': ['CreateBucket', 'PutBucketPolicy'], 'IAM': ['CreateRole'],
+    'LAMBDA': ['CreateFunction'], 'RDS': ['CreateDBInstance'],
+}
+
+
+def _events(seed, n, first_day, days):
+    rng = random.Random(seed)
+    events = []
+    for i in range(n):
+        service = rng.choice(sorted(SERVICES))
+        events.append((first_day + rng.randrange(days), service, rng.choice(SERVICES[service]),
+                       rng.choice((1, 2, 5, 10, 15)), f"{seed}-{i}"))
+    return events
+
+
+def _batch(events):
+    builder = ActivityBatchBuilder(1)
+    for event in events:
+        builder.append(*event)
+    return builder.build()
+
+
+def _dicts(events):
+    return [{'date': date.fromordinal(d), 'service': s, 'action': a, 'score': sc, 'event_id': e}
+            for d, s, a, sc, e in events]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_vectorized_caps_match_the_per_record_loop(seed):
+    first = date(2025, 1, 1).toordinal()
+    # Dense days, so every cap (daily, service, action) is reached
+    events = _events(seed, 600, first, 4)
+    expected = _legacy_apply_daily_caps(_dicts(events), CapTotals())
+    got = apply_caps(_batch(events), CapTotals())
+    assert [a['event_id'] for a in got.to_dicts()] == [a['event_id'] for a in expected]
+
+
+def test_caps_carry_over_between_batches():
+    first = date(2025, 1, 1).toordinal()
+    events = _events(7, 400, first, 3)
+    expected = _legacy_apply_daily_caps(_dicts(events), CapTotals())
+
+    # The same events in two flushes, sharing one CapTotals, keep the same rows
+    events.sort(key=lambda event: event[0])
+    totals = CapTotals()
+    kept = []
+    for part in (events[:150], events[150:]):
+        kept += [a['event_id'] for a in apply_caps(_batch(part), totals).to_dicts()]
+    assert kept == [a['event_id'] for a in expected]
@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+
+def _insert_user(name):
+    def write(cursor):
+        cursor.execute("INSERT INTO users (username, name, email) VALUES (?, ?, ?)", (name, name, f'{name}@example.com'))
+        return name
+    return write
+
+
+def _held_writer(database):
+    """Occupy the writer thread until the returned event is set, so later jobs queue up behind it."""
+    running, release = threading.Event(), threading.Event()
+
+    def hold(cursor):
+        running.set()
+        release.wait(5)
+
+    held = database.submit_write(hold)
+    assert running.wait(5)
+    return held, release
+
+
+@pytest.fixture
+def batches(sqlite_db, monkeypatch):
+    """Sizes of the batches the SQLite writer commits."""
+    sqlite_db.execute_query("SELECT 1", fetch=True)   # Create the schema first
+    sizes = []
+    writer = sqlite_db._sqlite_writer
+    commit = writer._commit
+
+    def record(batch):
+        sizes.append(len(batch))
+        commit(batch)
+
+    monkeypatch.setattr(writer, '_commit', record)
+    return sizes
+
+
+def test_queued_writes_are_committed_together(sqlite_db, batches):
+    held, release = _held_writer(sqlite_db)
+    futures = [sqlite_db.submit_write(_insert_user(f'user{n}')) for n in range(5)]
+    release.set()
+
+    assert [future.result(5) for future in futures] == [f'user{n}' for n in range(5)]
+    held.result(5)
+    assert batches[-2:] == [1, 5]
+    assert sqlite_db.execute_query("SELECT COUNT(*) AS n FROM users", fetch=True)[0]['n'] == 5
+
+
+def test_a_failing_job_rolls_back_only_itself(sqlite_db, batches):
+    def insert_then_fail(cursor):
+        _insert_user('doomed')(cursor)
+        raise RuntimeError('job failed')
+
+    held, release = _held_writer(sqlite_db)
+    first  = sqlite_db.submit_write(_insert_user('first'))
+    failed = sqlite_db.submit_write(insert_then_fail)
+    last   = sqlite_db.submit_write(_insert_user('last'))
+    release.set()
+
+    assert first.result(5) == 'first' and last.result(5) == 'last'
+    with pytest.raises(RuntimeError):
+        failed.result(5)
+    held.result(5)
+    assert batches[-1] == 3
+    rows = sqlite_db.execute_query("SELECT username FROM users ORDER BY id", fetch=True)
+    assert [row['username'] for row in rows] == ['first', 'last']
@@ -0,0 +1,299 @@
+import gzip
+import io
+import json
+import time
+import uuid
+from datetime import date, timedelta
+
+import boto3
+import pytest
+
+import ingestion
+
+
+class _Chunks(io.RawIOBase):
+    """A binary stream whose read() hands back one fixed chunk per call."""
+
+    def __init__(self, chunks):
+        self.chunks = [chunk.encode() for chunk in chunks]
+
+    def read(self, size=-1):
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+def _records(chunks):
+    return list(ingestion.iter_cloudtrail_records(_Chunks(chunks)))
+
+
+@pytest.mark.parametrize('chunks, expected', [
+    (['{"Records": [3.', '25]}'], [3.25]),
+    (['{"Records": [1e', '5]}'], [1e5]),
+    (['{"Records": [1E', '-2, 7', '5]}'], [1e-2, 75]),
+    (['{"Records": [-', '0.5e+', '1]}'], [-5.0]),
+    (['{"Records": [12', '.5, {"a": 1.', '5}]}'], [12.5, {'a': 1.5}]),
+])
+def test_numbers_split_across_chunks(chunks, expected):
+    assert _records(chunks) == expected
+
+
+def test_every_chunk_boundary():
+    document = json.dumps({
+        'Records': [3.25, 1e5, -0.001, 42, {'eventName': 'RunInstances', 'n': 6.02e23}, True, None, 'x'],
+        'Digest': 1.5,
+    })
+    expected = json.loads(document)['Records']
+    for cut in range(1, len(document)):
+        assert _records([document[:cut], document[cut:]]) == expected, document[:cut]
+    assert _records(list(document)) == expected
+
+
+ACCOUNT = '123456789012'
+
+
+def _log_records(day, hour):
+    """Two scored events logged on day at hour."""
+    return [{
+        'eventVersion': '1.08',
+        'userIdentity': {'arn': f'arn:aws:iam::{ACCOUNT}:user/dev'},
+        'eventTime': f"{day:%Y-%m-%d}T{hour:02d}:0{n}:00Z",
+        'eventSource': 'ec2.amazonaws.com',
+        'eventName': 'RunInstances',
+        'awsRegion': 'us-east-1',
+        'sourceIPAddress': '203.0.113.7',
+        'eventID': str(uuid.UUID(int=day.toordinal() * 1000 + hour * 10 + n)),
+    } for n in range(2)]
+
+
+def _log_key(day, hour, index):
+    """Key of a CloudTrail file delivered on day at hour:05."""
+    stamp = f"{day:%Y%m%d}T{hour:02d}05Z"
+    return (f"AWSLogs/{ACCOUNT}/CloudTrail/us-east-1/{day:%Y/%m/%d}/"
+            f"{ACCOUNT}_CloudTrail_us-east-1_{stamp}_{index:016x}.json.gz")
+
+
+def _put_log_file(s3, day, hour, index):
+    """One CloudTrail file delivered on day at hour:05 with two scored events."""
+    body = gzip.compress(json.dumps({'Records': _log_records(day, hour)}).encode())
+    s3.put_object(Bucket='trail', Key=_log_key(day, hour, index), Body=body)
+
+
+def test_failed_files_are_listed_again_on_the_next_sync(sqlite_db, monkeypatch):
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='trail')
+        for offset in range(5):
+            for hour in range(4):
+                _put_log_file(s3, date(2024, 1, 1) + timedelta(days=offset), hour * 6 + 2, offset * 4 + hour)
+        sqlite_db.execute_query(
+            "INSERT INTO users (username, name, email, aws_account_id) VALUES (%s, %s, %s, %s)",
+            ('dev', 'Dev', 'dev@example.com', ACCOUNT)
+        )
+        user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+
+        # The first day's files cannot be read on the first sync
+        iter_records = ingestion.S3LogSource.iter_records
+        failing = {'/2024/01/01/'}
+
+        def flaky_iter_records(source, key):
+            if any(part in key for part in failing):
+                raise OSError('connection reset')
+            return iter_records(source, key)
+
+        monkeypatch.setattr(ingestion.S3LogSource, 'iter_records', flaky_iter_records)
+        sync = dict(user_id=user_id, bucket_name='trail', listing_mode='partitioned', fetch_workers=4, parse_processes=0)
+        ingestion.process_user_s3_logs(**sync)
+        failing.clear()
+        ingestion.process_user_s3_logs(**sync)
+
+        days = sqlite_db.execute_query(
+            "SELECT date FROM daily_scores WHERE user_id = %s ORDER BY date", (user_id,), fetch=True
+        )
+        assert [str(row['date']) for row in days] == [f"2024-01-0{n}" for n in range(1, 6)]
+        objects = sqlite_db.execute_query(
+            "SELECT COUNT(*) AS n FROM processed_objects WHERE user_id = %s", (user_id,), fetch=True
+        )
+        assert objects[0]['n'] == 20
+
+
+def test_backfill_with_nothing_to_sample_is_settled(sqlite_db):
+    # Every event predates the LookupEvents window, so the planner is offered no samples
+    sqlite_db.execute_query(
+        "INSERT INTO users (username, name, email, aws_account_id) VALUES (%s, %s, %s, %s)",
+        ('dev', 'Dev', 'dev@example.com', ACCOUNT)
+    )
+    user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+    day = date.today() - timedelta(days=200)
+    records = [{
+        'eventVersion': '1.08',
+        'userIdentity': {'arn': f'arn:aws:iam::{ACCOUNT}:user/dev'},
+        'eventTime': f"{day:%Y-%m-%d}T10:0{n}:00Z",
+        'eventSource': 'ec2.amazonaws.com',
+        'eventName': 'RunInstances',
+        'awsRegion': 'us-east-1',
+        'sourceIPAddress': '203.0.113.7',
+        'eventID': str(uuid.UUID(int=n + 1)),
+    } for n in range(3)]
+
+    stored = ingestion.IngestionPipeline(
+        ingestion.RecordsSource(records), user_id, fraud_checks=True,
+        registered_account_id=ACCOUNT, verify_credentials=('key', 'secret'),
+    ).run()
+
+    assert stored == 3
+    statuses = sqlite_db.execute_query(
+        "SELECT DISTINCT verification_status AS status FROM activity_logs WHERE user_id = %s", (user_id,), fetch=True
+    )
+    assert [row['status'] for row in statuses] == ['verified']
+    queued = sqlite_db.execute_query("SELECT COUNT(*) AS n FROM verification_queue", fetch=True)
+    assert queued[0]['n'] == 0
+
+
+def test_unreadable_file_is_abandoned_after_max_attempts(sqlite_db, monkeypatch):
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(ingestion, 'MAX_FILE_ATTEMPTS', 2)
+
+    with moto.mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='trail')
+        for offset in range(3):
+            for hour in range(2):
+                _put_log_file(s3, date(2024, 1, 1) + timedelta(days=offset), hour * 6 + 2, offset * 2 + hour)
+        sqlite_db.execute_query(
+            "INSERT INTO users (username, name, email, aws_account_id) VALUES (%s, %s, %s, %s)",
+            ('dev', 'Dev', 'dev@example.com', ACCOUNT)
+        )
+        user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+
+        # One file of the first day is corrupt for good
+        iter_records = ingestion.S3LogSource.iter_records
+        reads = []
+
+        def corrupt_iter_records(source, key):
+            reads.append(key)
+            if key.endswith('_0000000000000001.json.gz'):
+                raise ValueError('Malformed log JSON')
+            return iter_records(source, key)
+
+        monkeypatch.setattr(ingestion.S3LogSource, 'iter_records', corrupt_iter_records)
+        sync = dict(user_id=user_id, bucket_name='trail', listing_mode='partitioned', fetch_workers=2, parse_processes=0)
+
+        def checkpoint():
+            rows = sqlite_db.execute_query("SELECT last_key FROM s3_listing_checkpoints", fetch=True)
+            return rows[0]['last_key'] if rows else None
+
+        def manifest_row():
+            return sqlite_db.execute_query(
+                "SELECT status, attempts FROM processed_objects WHERE object_key LIKE %s",
+                ('%_0000000000000001.json.gz',), fetch=True
+            )[0]
+
+        ingestion.process_user_s3_logs(**sync)
+        assert dict(manifest_row()) == {'status': 'failed', 'attempts': 1}
+        assert checkpoint().endswith('_0000000000000000.json.gz')
+
+        ingestion.process_user_s3_logs(**sync)
+        assert dict(manifest_row()) == {'status': 'abandoned', 'attempts': 2}
+        assert checkpoint().endswith('_0000000000000005.json.gz')
+
+        reads.clear()
+        ingestion.process_user_s3_logs(**sync)
+        assert not any(key.endswith('_0000000000000001.json.gz') for key in reads)
+        days = sqlite_db.execute_query("SELECT COUNT(*) AS n FROM daily_scores WHERE user_id = %s", (user_id,), fetch=True)
+        assert days[0]['n'] == 3
+
+
+def _add_user(db):
+    db.execute_query(
+        "INSERT INTO users (username, name, email, aws_account_id) VALUES (%s, %s, %s, %s)",
+        ('dev', 'Dev', 'dev@example.com', ACCOUNT)
+    )
+    return db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+
+
+def test_in_key_order_holds_results_until_earlier_keys_finish():
+    in_order = ingestion._InKeyOrder(['a', 'b', 'c', 'd'])
+    assert in_order.push('c', 3) == []
+    assert in_order.push('b', 2) == []
+    assert in_order.push('a', 1) == [('a', 1), ('b', 2), ('c', 3)]
+    assert in_order.push('d', 4) == [('d', 4)]
+    assert in_order.drain() == []
+
+
+class _SlowFirstSource(ingestion.RecordsSource):
+    """The first file is held back until the workers have run as far ahead as they may."""
+
+    def __init__(self, files):
+        super().__init__(files)
+        self.first = min(files)
+        self.started = []
+        self.ahead = None
+
+    def iter_records(self, key):
+        if key == self.first:
+            time.sleep(0.5)
+            self.ahead = len(self.started)
+        else:
+            self.started.append(key)
+        return super().iter_records(key)
+
+
+def test_results_are_released_in_key_order_with_bounded_read_ahead(sqlite_db, monkeypatch):
+    user_id = _add_user(sqlite_db)
+    first = date(2024, 1, 1)
+    files = {_log_key(first, hour, hour): _log_records(first, hour) for hour in range(24)}
+    source = _SlowFirstSource(files)
+    pipeline = ingestion.IngestionPipeline(source, user_id, workers=2, parse_processes=0)
+
+    released = []
+    collect = pipeline._released
+
+    def record_release(*args):
+        for key, result in collect(*args):
+            released.append(key)
+            yield key, result
+
+    monkeypatch.setattr(pipeline, '_released', record_release)
+    pipeline.run()
+    assert released == sorted(files)
+    # While the first file was held, the other worker ran ahead by at most the read-ahead window
+    assert 0 < source.ahead <= 2 * ingestion.READ_AHEAD_PER_SLOT - 1
+
+
+def test_files_of_capped_days_are_not_fetched(sqlite_db):
+    user_id = _add_user(sqlite_db)
+    capped, open_day = date(2024, 1, 2), date(2024, 1, 3)
+    sqlite_db.execute_query(
+        "INSERT INTO daily_scores (user_id, date, total_score) VALUES (%s, %s, %s)",
+        (user_id, capped.isoformat(), ingestion.DAILY_SCORE_CAP)
+    )
+    files = {
+        _log_key(capped, 6, 1): _log_records(capped, 6),
+        _log_key(capped, 12, 2): _log_records(capped, 12),
+        # Delivered just after midnight, so it may still hold the uncapped previous day's events
+        _log_key(open_day, 0, 3): _log_records(capped, 23),
+        _log_key(open_day, 8, 4): _log_records(open_day, 8),
+    }
+    source = ingestion.RecordsSource(files)
+    read = []
+    iter_records = source.iter_records
+    source.iter_records = lambda key: read.append(key) or iter_records(key)
+
+    pipeline = ingestion.IngestionPipeline(source, user_id, workers=2, parse_processes=0)
+    pipeline.run()
+
+    assert pipeline.skipped_keys == {_log_key(capped, 6, 1), _log_key(capped, 12, 2)}
+    assert sorted(read) == sorted([_log_key(open_day, 0, 3), _log_key(open_day, 8, 4)])
+    days = sqlite_db.execute_query(
+        "SELECT date, total_score FROM daily_scores WHERE user_id = %s ORDER BY date", (user_id,), fetch=True
+    )
+    assert [(str(row['date']), row['total_score']) for row in days] == [
+        (capped.isoformat(), ingestion.DAILY_SCORE_CAP), (open_day.isoformat(), 10),
+    ]
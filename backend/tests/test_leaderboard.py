@@ -0,0 +1,41 @@
+import pytest
+
+import leaderboard
+
+
+def test_unknown_service_is_rejected_before_a_board_is_built(sqlite_db):
+    with pytest.raises(ValueError):
+        leaderboard.top('all', 'NOT-A-SERVICE')
+    assert ('all', 'NOT-A-SERVICE') not in leaderboard._boards
+
+
+def test_least_recently_used_board_is_dropped(sqlite_db, monkeypatch):
+    monkeypatch.setattr(leaderboard, '_boards', leaderboard.OrderedDict())
+    monkeypatch.setattr(leaderboard, 'MAX_BOARDS', 2)
+    leaderboard.top('all', 'EC2')
+    leaderboard.top('week', 'S3')
+    leaderboard.top('all', 'EC2')      # Used again, so S3 is now the oldest
+    leaderboard.top('month', 'LAMBDA')
+    assert list(leaderboard._boards) == [('all', 'EC2'), ('month', 'LAMBDA')]
+
+
+def test_api_rejects_unknown_service(sqlite_db):
+    from app import app
+    client = app.test_client()
+    assert client.get('/api/leaderboard?service=nope').status_code == 400
+    assert client.get('/api/leaderboard?service=ec2').get_json()['service'] == 'EC2'
+
+
+def test_ranking_index_ranks_and_ties():
+    index = leaderboard.RankingIndex({1: 50, 2: 80, 3: 50, 4: 0, 5: 20})
+    assert len(index) == 4                       # Users without a score are not ranked
+    assert [index.rank(user_id) for user_id in (2, 1, 3, 5)] == [1, 2, 2, 4]
+    assert index.rank(4) is None
+    assert index.top(3) == [(1, 2, 80), (2, 1, 50), (2, 3, 50)]
+
+    index.update(5, 90)
+    index.update(2, 0)
+    assert index.top(10) == [(1, 5, 90), (2, 1, 50), (2, 3, 50)]
+    assert index.rank(2) is None
+    index.update(3, 60)
+    assert [index.rank(user_id) for user_id in (5, 3, 1)] == [1, 2, 3]
@@ -0,0 +1,65 @@
+import itertools
+
+import pytest
+
+import percentiles
+from database import run_write
+from summaries import refresh_user_summary
+
+
+@pytest.fixture
+def histogram(sqlite_db, monkeypatch):
+    """Give users with the given all-time totals summary rows, as a sync would."""
+    monkeypatch.setattr(percentiles, '_cache', None)
+
+    names = itertools.count()
+
+    def add(*totals):
+        for total in totals:
+            name = f'user{next(names)}'
+            sqlite_db.execute_query(
+                "INSERT INTO users (username, name, email) VALUES (%s, %s, %s)", (name, name, f'{name}@example.com')
+            )
+            user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = %s", (name,), fetch=True)[0]['id']
+            sqlite_db.execute_query(
+                "INSERT INTO service_daily_totals (user_id, date, service, total) VALUES (%s, '2025-01-01', 'EC2', %s)",
+                (user_id, total)
+            )
+            run_write(lambda cursor: refresh_user_summary(cursor, user_id))
+        monkeypatch.setattr(percentiles, '_cache', None)
+    return add
+
+
+def _buckets(db):
+    rows = db.execute_query("SELECT bucket, users FROM score_histogram WHERE users > 0 ORDER BY bucket", fetch=True)
+    return [(row['bucket'], row['users']) for row in rows]
+
+
+def test_no_users_no_percentile(histogram):
+    assert percentiles.percentile(50) is None
+
+
+def test_percentile_counts_lower_scores(histogram):
+    histogram(5, 15, 25, 35)
+    assert percentiles.percentile(0) == 0.0
+    assert percentiles.percentile(20) == 50.0
+    assert percentiles.percentile(25) == 62.5          # Half of its bucket's user counted as lower
+    assert percentiles.percentile(10 ** 9) == 100.0
+
+
+def test_incremental_histogram_matches_a_rebuild(sqlite_db, histogram):
+    histogram(0, 7, 12, 12, 480, percentiles.BUCKET_WIDTH * percentiles.BUCKETS * 2)
+    incremental = _buckets(sqlite_db)
+    version = percentiles.histogram_version()
+
+    percentiles.rebuild_histogram()
+    assert _buckets(sqlite_db) == incremental
+    assert percentiles.histogram_version() == version
+    assert incremental[-1] == (percentiles.BUCKETS - 1, 1)
+
+
+def test_version_follows_the_counts(histogram):
+    histogram(10)
+    before = percentiles.histogram_version()
+    histogram(500)
+    assert percentiles.histogram_version() != before
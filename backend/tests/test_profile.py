@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+
+import pytest
+
+from config import get_credibility
+from ingestion import store_activities
+from summaries import bump_data_version
+
+
+@pytest.fixture
+def client(sqlite_db):
+    from app import app
+    sqlite_db.execute_query(
+        "INSERT INTO users (username, name, email) VALUES (%s, %s, %s)", ('dev', 'Dev', 'dev@example.com')
+    )
+    return app.test_client()
+
+
+def test_resources_are_revalidated_by_data_version(client, sqlite_db):
+    first = client.get('/api/profile/dev/resources')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert 'must-revalidate' in first.headers['Cache-Control']
+
+    again = client.get('/api/profile/dev/resources', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+    sqlite_db.execute_query(
+        "INSERT INTO resource_state (user_id, resource_type, resource_id, state) "
+        "SELECT id, 'ec2:instance', 'i-1', 'running' FROM users WHERE username = 'dev'"
+    )
+    user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+    sqlite_db.run_write(lambda cursor: bump_data_version(cursor, [user_id]))
+    changed = client.get('/api/profile/dev/resources', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert [r['resource_id'] for r in changed.get_json()['resources']] == ['i-1']
+
+
+def _activity(user_id, day, score, n):
+    return {'user_id': user_id, 'date': day, 'service': 'EC2', 'action': 'RunInstances', 'score': score,
+            'event_id': f'event-{n}', 'source_key': None, 'verification_status': 'verified', 'sync_id': None}
+
+
+def test_profile_total_covers_the_requested_window(client, sqlite_db):
+    user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+    today = date.today()
+    store_activities([
+        _activity(user_id, today - timedelta(days=100), 40, 1),
+        _activity(user_id, today - timedelta(days=1), 10, 2),
+        _activity(user_id, today, 5, 3),
+    ])
+
+    month = client.get('/api/profile/dev?days=30').get_json()
+    assert month['total_score'] == 15
+    assert month['services'] == {'EC2': 15}
+    assert month['credibility'] == get_credibility(15)
+    assert month['streaks'] == {'current': 2, 'longest': 2}
+    assert client.get('/api/profile/dev?days=365').get_json()['total_score'] == 55
+
+
+@pytest.mark.parametrize('path, other', [
+    ('/api/profile/dev?days=30', '/api/profile/dev?days=7'),
+    ('/api/profile/dev/dashboard', '/api/profile/dev/dashboard?days=7'),
+])
+def test_profile_pages_revalidate_until_a_sync_stores(client, sqlite_db, path, other):
+    user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+    store_activities([_activity(user_id, date.today(), 10, 1)])
+
+    first = client.get(path)
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+    # Another window of the same page is a different response
+    windowed = client.get(other, headers={'If-None-Match': etag})
+    assert windowed.status_code == 200 and windowed.headers['ETag'] != etag
+
+    store_activities([_activity(user_id, date.today(), 5, 2)])
+    changed = client.get(path, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
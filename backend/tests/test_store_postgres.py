@@ -0,0 +1,85 @@
+import os
+import uuid
+
+import pytest
+
+import ingestion
+from scoring import DAILY_SCORE_CAP
+
+DSN = os.environ.get('CLOUDPROOF_TEST_POSTGRES_DSN')
+
+pytestmark = [
+    pytest.mark.postgres,
+    pytest.mark.skipif(not DSN, reason='set CLOUDPROOF_TEST_POSTGRES_DSN to run against PostgreSQL'),
+]
+
+
+@pytest.fixture
+def pg_schema():
+    """A connection whose search_path is a throwaway schema holding the CloudProof tables."""
+    psycopg2 = pytest.importorskip('psycopg2')
+    schema = f"cloudproof_test_{uuid.uuid4().hex[:8]}"
+    conn = psycopg2.connect(DSN)
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.sql')) as f:
+        ddl = f.read()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {schema}")
+            cursor.execute(f"SET search_path TO {schema}")
+            cursor.execute(ddl)
+            cursor.execute("INSERT INTO users (username, name, email) VALUES ('dev', 'Dev', 'dev@example.com') RETURNING id")
+            user_id = cursor.fetchone()[0]
+        conn.commit()
+        yield conn, user_id
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def _store(conn, rows):
+    """One store transaction, as store_activities runs it."""
+    with conn.cursor() as cursor:
+        credited = ingestion._store_postgres(cursor, rows)
+    conn.commit()
+    return [(user_id, int(gained), str(first_day)) for user_id, gained, first_day in credited]
+
+
+def _row(user_id, day, service, score, event_id):
+    return (user_id, day, service, 'Action', score, event_id, 'file', 'verified', None)
+
+
+def _fetch(conn, sql):
+    with conn.cursor() as cursor:
+        cursor.execute(sql)
+        return [tuple(str(value) if not isinstance(value, int) else value for value in row) for row in cursor.fetchall()]
+
+
+def test_rollups_credit_only_the_rows_inserted(pg_schema):
+    conn, user_id = pg_schema
+    first = [
+        _row(user_id, '2025-01-01', 'EC2', 10, 'a'),
+        _row(user_id, '2025-01-01', 'EC2', 10, 'a'),          # Repeated within the batch
+        _row(user_id, '2025-01-01', 'S3', 5, 'b'),
+        _row(user_id, '2025-01-02', 'EC2', DAILY_SCORE_CAP, 'c'),
+    ]
+    assert _store(conn, first) == [(user_id, 15 + DAILY_SCORE_CAP, '2025-01-01')]
+
+    second = [
+        _row(user_id, '2025-01-01', 'EC2', 10, 'a'),          # Already stored
+        _row(user_id, '2025-01-02', 'EC2', 7, 'd'),           # Day already at the cap
+        _row(user_id, '2025-01-03', 'IAM', 3, 'e'),
+    ]
+    assert _store(conn, second) == [(user_id, 10, '2025-01-02')]
+    assert _store(conn, second) == []
+
+    assert _fetch(conn, "SELECT COUNT(*) FROM activity_logs") == [(5,)]
+    assert _fetch(conn, "SELECT date, total_score FROM daily_scores ORDER BY date") == [
+        ('2025-01-01', 15), ('2025-01-02', DAILY_SCORE_CAP), ('2025-01-03', 3),
+    ]
+    assert _fetch(conn, "SELECT date, service, total FROM service_daily_totals ORDER BY date, service") == [
+        ('2025-01-01', 'EC2', 10), ('2025-01-01', 'S3', 5),
+        ('2025-01-02', 'EC2', DAILY_SCORE_CAP + 7), ('2025-01-03', 'IAM', 3),
+    ]
@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+from summaries import get_user_summary
+
+
+def test_missing_summary_is_computed_without_writing(sqlite_db):
+    sqlite_db.execute_query(
+        "INSERT INTO users (username, name, email) VALUES (%s, %s, %s)", ('dev', 'Dev', 'dev@example.com')
+    )
+    user_id = sqlite_db.execute_query("SELECT id FROM users WHERE username = 'dev'", fetch=True)[0]['id']
+    today = date.today()
+    for offset, score in ((5, 30), (1, 20), (0, 10)):
+        day = (today - timedelta(days=offset)).isoformat()
+        sqlite_db.execute_query(
+            "INSERT INTO daily_scores (user_id, date, total_score) VALUES (%s, %s, %s)", (user_id, day, score)
+        )
+        sqlite_db.execute_query(
+            "INSERT INTO service_daily_totals (user_id, date, service, total) VALUES (%s, %s, 'EC2', %s)",
+            (user_id, day, score)
+        )
+
+    summary = get_user_summary(user_id)
+    assert summary['total_score'] == 60
+    assert (summary['current_streak'], summary['longest_streak']) == (2, 2)
+    assert summary['last_active_date'] == today.isoformat()
+    assert sqlite_db.execute_query("SELECT COUNT(*) AS n FROM user_summary", fetch=True)[0]['n'] == 0
+    assert sqlite_db.execute_query("SELECT COUNT(*) AS n FROM score_histogram", fetch=True)[0]['n'] == 0
@@ -0,0 +1,135 @@
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import verification
+from activities import PROVISIONAL, VERIFIED
+from ingestion import store_activities
+
+ACCOUNT = '123456789012'
+
+
+def _user(db, username, account):
+    db.execute_query(
+        "INSERT INTO users (username, name, email, aws_account_id) VALUES (%s, %s, %s, %s)",
+        (username, username, f'{username}@example.com', account)
+    )
+    return db.execute_query("SELECT id FROM users WHERE username = %s", (username,), fetch=True)[0]['id']
+
+
+def _event(n, when=None):
+    when = when or datetime.utcnow() - timedelta(days=1)
+    return {
+        'eventID': f'event-{n}', 'eventName': 'RunInstances', 'awsRegion': 'us-east-1',
+        'eventTime': when.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+
+
+def _queue(db, user_id, sync_id, events, age=None):
+    verification.enqueue_samples(user_id, sync_id, [('file', events)])
+    if age is not None:
+        db.execute_query(
+            "UPDATE verification_queue SET created_at = datetime('now', %s) WHERE sync_id = %s",
+            (f'-{age} minutes', sync_id)
+        )
+
+
+def test_hourly_budget_is_shared_by_the_account(sqlite_db, monkeypatch):
+    monkeypatch.setattr(verification, 'VERIFY_HOURLY_BUDGET', 20)
+    first  = _user(sqlite_db, 'first', ACCOUNT)
+    second = _user(sqlite_db, 'second', ACCOUNT)
+    other  = _user(sqlite_db, 'other', '210987654321')
+    _queue(sqlite_db, first, 'old', [_event(n) for n in range(100, 130)], age=90)
+    _queue(sqlite_db, first, 'recent', [_event(n) for n in range(12)], age=10)
+
+    def commit(user_id, sync_id, base):
+        planner = verification.VerificationPlanner(budget=50, rng=random.Random(1))
+        planner.offer('file', [_event(base + n) for n in range(50)])
+        return planner.commit(user_id, sync_id)
+
+    # 12 of the account's 20 were queued within the hour; the 90-minute-old rows have aged out
+    assert commit(second, 'second', 1000) == 8
+    # The budget is spent, so the sync gets the floor
+    assert commit(first, 'first', 2000) == verification.VERIFY_MIN_SAMPLES
+    # Another account still has its whole budget
+    assert commit(other, 'other', 3000) == 20
+
+
+def test_claimed_rows_are_not_handed_out_twice(sqlite_db):
+    user_id = _user(sqlite_db, 'dev', ACCOUNT)
+    _queue(sqlite_db, user_id, 'sync', [_event(n) for n in range(5)])
+
+    first  = verification._claim_rows(3)
+    second = verification._claim_rows(3)
+    assert [row['event_id'] for row in first] == ['event-0', 'event-1', 'event-2']
+    assert [row['event_id'] for row in second] == ['event-3', 'event-4']
+    assert verification._claim_rows(3) == []
+
+    # A claim whose lease ran out goes back to the queue
+    sqlite_db.execute_query(
+        "UPDATE verification_queue SET checked_at = datetime('now', '-1 hour') WHERE event_id = 'event-1'"
+    )
+    assert [row['event_id'] for row in verification._claim_rows(3)] == ['event-1']
+
+
+@pytest.fixture
+def checked_sync(sqlite_db, monkeypatch):
+    """Two provisional files of one sync, every event queued; returns (user_id, events by file)."""
+    monkeypatch.setattr(verification, '_user_credentials', lambda user_id: ('key', 'secret'))
+    monkeypatch.setattr(verification, 'cloudtrail_client', lambda ak, sk, region: None)
+    monkeypatch.setattr(verification._limiter, 'interval', 0.0)
+    user_id = _user(sqlite_db, 'dev', ACCOUNT)
+    today = date.today()
+    files = {'first': [_event(n) for n in range(3)], 'second': [_event(n) for n in range(3, 5)]}
+    store_activities([
+        {'user_id': user_id, 'date': today - timedelta(days=offset), 'service': 'EC2', 'action': 'RunInstances',
+         'score': 5, 'event_id': event['eventID'], 'source_key': key, 'verification_status': PROVISIONAL,
+         'sync_id': 'sync'}
+        for key, events in files.items() for offset, event in enumerate(events)
+    ])
+    verification.enqueue_samples(user_id, 'sync', list(files.items()))
+    return user_id, files
+
+
+def _lookups(monkeypatch, missing=()):
+    calls = []
+
+    def lookup(cloudtrail, event_id, event_time):
+        calls.append(event_id)
+        return None if event_id in missing else 'RunInstances'
+
+    monkeypatch.setattr(verification, 'lookup_event_name', lookup)
+    return calls
+
+
+def test_clean_sample_settles_the_sync(sqlite_db, checked_sync, monkeypatch):
+    user_id, files = checked_sync
+    calls = _lookups(monkeypatch)
+
+    assert verification.verify_pending() == 5
+    assert len(calls) == 5
+    statuses = sqlite_db.execute_query("SELECT DISTINCT verification_status AS s FROM activity_logs", fetch=True)
+    assert [row['s'] for row in statuses] == [VERIFIED]
+    queue = sqlite_db.execute_query("SELECT DISTINCT status FROM verification_queue", fetch=True)
+    assert [row['status'] for row in queue] == [verification.PASSED]
+    assert verification.verify_pending() == 0
+
+
+def test_failed_sample_revokes_the_whole_sync(sqlite_db, checked_sync, monkeypatch):
+    user_id, files = checked_sync
+    version = sqlite_db.execute_query("SELECT data_version FROM users WHERE id = %s", (user_id,), fetch=True)
+    calls = _lookups(monkeypatch, missing={files['first'][0]['eventID']})
+
+    verification.verify_pending()
+
+    # The first sample failed, so the rest of the sync was revoked without another lookup
+    assert calls == [files['first'][0]['eventID']]
+    queue = sqlite_db.execute_query("SELECT status, COUNT(*) AS n FROM verification_queue GROUP BY status", fetch=True)
+    assert {row['status']: row['n'] for row in queue} == {verification.FAILED: 1, verification.REVOKED: 4}
+    for table in ('activity_logs', 'daily_scores', 'service_daily_totals'):
+        assert sqlite_db.execute_query(f"SELECT COUNT(*) AS n FROM {table}", fetch=True)[0]['n'] == 0, table
+    summary = sqlite_db.execute_query("SELECT total_score FROM user_summary WHERE user_id = %s", (user_id,), fetch=True)
+    assert summary[0]['total_score'] == 0
+    after = sqlite_db.execute_query("SELECT data_version FROM users WHERE id = %s", (user_id,), fetch=True)
+    assert after[0]['data_version'] > version[0]['data_version']
@@ -0,0 +1,586 @@
+"""
+CloudProof CloudTrail API verification queue
+Layer 3 fraud prevention, off the sync's critical path.
+
+During a sync, every accepted activity is stored as 'provisional' under the
+sync's id, and a VerificationPlanner reservoir-samples the scored events of
+all its files down to a fixed call budget (VERIFY_SYNC_BUDGET, further capped
+by VERIFY_HOURLY_BUDGET per AWS account). The sample is uniform over the sync's
+events, so a clean result bounds the fraction of forged events in the whole
+sync — with k samples, below 1 - 0.05^(1/k) (about 3/k) at 95% confidence —
+for a fixed number of API calls however many files were read.
+
+A background verifier looks the sampled events up through the CloudTrail
+LookupEvents API (throttled by AWS to ~2 TPS per account and region), then:
+  - every sample found with the same eventName  → the sync's activities become 'verified'
+  - any sample missing or renamed               → the sync's unverified files are revoked in bulk
+API errors are retried a few times and then skipped, as inline verification did.
+Each verifier claims its batch atomically ('checking', under a lease), so the
+verifiers started by the API process and the scheduler never check a row twice.
+
+Events the API has confirmed are remembered in verified_events for
+VERIFIED_EVENT_TTL_DAYS, so resyncs and overlapping files are settled without
+another lookup, and CloudTrail clients are built once per credentials and region.
+"""
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+import boto3
+
+from activities import PROVISIONAL, VERIFIED
+from credentials import decrypt_credential
+from database import execute_query, run_write, DB_ENGINE
+from scoring import DAILY_SCORE_CAP
+from leaderboard import refresh_users
+from summaries import bump_data_version, refresh_user_summary
+
+logger = logging.getLogger(__name__)
+
+# ── Config ────────────────────────────────────────────────────────────────────
+VERIFY_SAMPLE_RATE    = 0.1    # Fraction of each file's scored events checked inline
+VERIFY_SYNC_BUDGET    = int(os.getenv('VERIFY_SYNC_BUDGET', '60'))     # Sampled events per sync
+VERIFY_HOURLY_BUDGET  = int(os.getenv('VERIFY_HOURLY_BUDGET', '600'))  # Queued events per AWS account per hour
+VERIFY_MIN_SAMPLES    = 5      # Floor per sync, even when the hourly budget is spent
+LOOKUP_WINDOW_DAYS    = 90     # LookupEvents only covers the last 90 days
+CLOUDTRAIL_LOOKUP_TPS = float(os.getenv('CLOUDTRAIL_LOOKUP_TPS', '2'))  # Per account and region
+VERIFY_BATCH_SIZE     = 50     # Queue rows claimed per verify_pending() call
+VERIFY_MAX_ATTEMPTS   = 5      # API errors tolerated before a sample is skipped
+VERIFY_CLAIM_SECONDS  = 600    # A claimed batch left unfinished this long is claimed again
+VERIFY_POLL_SECONDS   = 30     # Idle wait of the background verifier
+VERIFIED_EVENT_TTL_DAYS = int(os.getenv('VERIFIED_EVENT_TTL_DAYS', '30'))  # How long an API confirmation is trusted
+CLIENT_CACHE_SIZE     = 256    # CloudTrail clients kept across syncs
+
+# verification_queue.status values
+PENDING  = 'pending'
+CHECKING = 'checking'  # Claimed by a verifier; checked_at holds the claim time
+PASSED   = 'verified'
+FAILED   = 'failed'
+SKIPPED  = 'skipped'   # API kept erroring, or the user's credentials are gone
+REVOKED  = 'revoked'   # Another sample from the same sync failed first
+
+_IN_CHUNK = 500
+
+
+def pick_sample(scoreable, sample_rate=VERIFY_SAMPLE_RATE):
+    """Random sample of a file's scored events: sample_rate of them, at least one."""
+    if not scoreable:
+        return []
+    sample_size = max(1, int(len(scoreable) * sample_rate))
+    return random.sample(scoreable, min(sample_size, len(scoreable)))
+
+
+def lookup_event_name(cloudtrail, event_id, event_time):
+    """eventName CloudTrail reports for event_id around event_time ('YYYY-MM-DDTHH:MM:SSZ'), or None."""
+    event_time = datetime.strptime(event_time, '%Y-%m-%dT%H:%M:%SZ')
+    response = cloudtrail.lookup_events(
+        LookupAttributes=[{'AttributeKey': 'EventId', 'AttributeValue': event_id}],
+        StartTime=event_time - timedelta(minutes=20),
+        EndTime=event_time   + timedelta(minutes=20),
+        MaxResults=1
+    )
+    events = response.get('Events')
+    if not events:
+        return None
+    return events[0].get('EventName', '')
+
+
+def confidence_bound(samples, confidence=0.95):
+    """Largest forged-event fraction that k clean uniform samples fail to rule out."""
+    if samples <= 0:
+        return 1.0
+    return 1.0 - (1.0 - confidence) ** (1.0 / samples)
+
+
+class VerificationPlanner:
+    """
+    Uniform sample of up to `budget` scored events across every file of one sync.
+
+    offer() takes each file's candidate records as the sync streams; Algorithm L
+    skips ahead between replacements, so a file contributing nothing costs one
+    comparison rather than a pass over its records. Events older than the
+    LookupEvents window cannot be checked and are left out.
+    """
+
+    def __init__(self, budget=VERIFY_SYNC_BUDGET, rng=None):
+        self.budget    = max(1, budget)
+        self.reservoir = []   # (object_key, record)
+        self.seen      = 0    # Candidates offered so far
+        self._rng      = rng or random.Random()
+        self._weight   = math.exp(math.log(self._rng.random()) / self.budget)
+        self._next     = self.budget + self._skip()
+        self._cutoff   = (datetime.utcnow() - timedelta(days=LOOKUP_WINDOW_DAYS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _skip(self):
+        return int(math.log(self._rng.random()) / math.log(1.0 - self._weight))
+
+    def offer(self, object_key, records):
+        records = [r for r in records if (r.get('eventTime') or '') >= self._cutoff]
+        base = self.seen              # Stream position of records[0]
+        self.seen += len(records)
+
+        # Fill phase: the first `budget` candidates go straight in
+        fill = min(len(records), self.budget - len(self.reservoir))
+        self.reservoir.extend((object_key, record) for record in records[:fill])
+
+        while self._next < self.seen:
+            self.reservoir[self._rng.randrange(self.budget)] = (object_key, records[self._next - base])
+            self._weight *= math.exp(math.log(self._rng.random()) / self.budget)
+            self._next += self._skip() + 1
+
+    def commit(self, user_id, sync_id, default_region='us-east-1'):
+        """
+        Queue the sample for sync_id, trimmed to the AWS account's remaining hourly budget
+        (never below VERIFY_MIN_SAMPLES). With nothing to check, the sync is
+        settled straight away, as it is when every sampled event was already in the
+        queue (a re-sync). Returns the number of events queued.
+        """
+        if not self.reservoir:
+            # Nothing sampleable (every event past the lookup window or without an eventID)
+            _settle_syncs(user_id, [sync_id])
+            return 0
+        # LookupEvents is throttled per account, so the budget is shared by every user
+        # registered with the account. The cutoff is computed by the database, in the
+        # same clock and timezone as the created_at default.
+        cutoff = "datetime('now', '-1 hour')" if DB_ENGINE == 'sqlite' else "CURRENT_TIMESTAMP - INTERVAL '1 hour'"
+        recent = execute_query(
+            f"""
+            SELECT COUNT(*) AS n FROM verification_queue q JOIN users u ON u.id = q.user_id
+            WHERE q.created_at >= {cutoff}
+              AND (q.user_id = %s OR u.aws_account_id = (SELECT aws_account_id FROM users WHERE id = %s))
+            """,
+            (user_id, user_id), fetch=True
+        )
+        allowed = max(VERIFY_MIN_SAMPLES, VERIFY_HOURLY_BUDGET - (recent[0]['n'] if recent else 0))
+        sample  = self.reservoir
+        if len(sample) > allowed:
+            sample = self._rng.sample(sample, allowed)
+
+        by_key = defaultdict(list)
+        for object_key, record in sample:
+            by_key[object_key].append(record)
+        queued = enqueue_samples(user_id, sync_id, list(by_key.items()), default_region)
+        if not queued:
+            _settle_syncs(user_id, [sync_id])
+            return 0
+
+        logger.info(
+            f"Queued {queued} of {self.seen} scored events for CloudTrail verification "
+            f"(sync {sync_id}); a clean result bounds forged events below "
+            f"{confidence_bound(queued):.1%} at 95% confidence"
+        )
+        return queued
+
+
+def enqueue_samples(user_id, sync_id, samples, default_region='us-east-1'):
+    """
+    Queue sampled records for verification. samples is a list of
+    (object_key, records) pairs; call it only after the sync's activities
+    are stored, so a failing sample always has something to revoke.
+    Re-queuing the same event is a no-op. Returns the number of events
+    actually added to the queue.
+    """
+    rows = [
+        (user_id, sync_id, object_key, record['eventID'], record.get('eventName') or '',
+         record.get('eventTime') or '', record.get('awsRegion') or default_region)
+        for object_key, records in samples
+        for record in records
+    ]
+    if not rows:
+        return 0
+
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    sql = (
+        "INSERT INTO verification_queue "
+        "(user_id, sync_id, object_key, event_id, event_name, event_time, aws_region) "
+        f"VALUES ({', '.join([placeholder] * 7)}) "
+        "ON CONFLICT (user_id, event_id) DO NOTHING"
+    )
+
+    def write(cursor):
+        cursor.executemany(sql, rows)
+        return cursor.rowcount   # Events already queued are not counted
+
+    return max(run_write(write), 0)
+
+
+# ── Client and verified-event caches ──────────────────────────────────────────
+
+_clients = OrderedDict()   # (access key, secret key, region) → CloudTrail client
+_clients_lock = threading.Lock()
+
+
+def cloudtrail_client(ak, sk, region):
+    """
+    Shared CloudTrail client for these credentials and region. Clients are
+    thread-safe once built but slow to build, so they are created under a lock
+    and reused by every worker thread and sync; the least recently used beyond
+    CLIENT_CACHE_SIZE are dropped.
+    """
+    key = (ak, sk, region)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = boto3.client(
+                'cloudtrail', aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region
+            )
+            if len(_clients) > CLIENT_CACHE_SIZE:
+                _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(key)
+    return client
+
+
+def cached_event_names(user_id, event_ids):
+    """{event_id: eventName} for the events the API confirmed within VERIFIED_EVENT_TTL_DAYS."""
+    event_ids = list({e for e in event_ids if e})
+    cutoff = datetime.now() - timedelta(days=VERIFIED_EVENT_TTL_DAYS)
+    found = {}
+    for start in range(0, len(event_ids), _IN_CHUNK):
+        chunk = event_ids[start:start + _IN_CHUNK]
+        rows = execute_query(
+            f"SELECT event_id, event_name FROM verified_events "
+            f"WHERE user_id = %s AND verified_at >= %s AND event_id IN ({', '.join(['%s'] * len(chunk))})",
+            (user_id, cutoff, *chunk), fetch=True
+        )
+        found.update((row['event_id'], row['event_name']) for row in rows or [])
+    return found
+
+
+def remember_verified(user_id, events):
+    """Record (event_id, eventName) pairs the API has just confirmed."""
+    if not events:
+        return
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    sql = (
+        "INSERT INTO verified_events (user_id, event_id, event_name, verified_at) "
+        f"VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}) "
+        "ON CONFLICT (user_id, event_id) DO UPDATE "
+        "SET event_name = EXCLUDED.event_name, verified_at = EXCLUDED.verified_at"
+    )
+    rows = [(user_id, event_id, event_name, datetime.now()) for event_id, event_name in events]
+    try:
+        run_write(lambda cursor: cursor.executemany(sql, rows))
+    except Exception as e:
+        logger.warning(f"Could not cache verified events for user {user_id}: {e}")
+
+
+def prune_verified_events():
+    """Drop cache entries older than VERIFIED_EVENT_TTL_DAYS."""
+    execute_query(
+        "DELETE FROM verified_events WHERE verified_at < %s",
+        (datetime.now() - timedelta(days=VERIFIED_EVENT_TTL_DAYS),)
+    )
+
+
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+
+class _RateLimiter:
+    """Spaces calls per key (account, region) at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = {}
+
+    def wait(self, key):
+        now = time.monotonic()
+        slot = max(now, self.next_slot.get(key, now))
+        self.next_slot[key] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_limiter = _RateLimiter(CLOUDTRAIL_LOOKUP_TPS)
+
+
+def _is_throttle(error):
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+    return code in ('ThrottlingException', 'Throttling', 'TooManyRequestsException')
+
+
+# ── Verifier ──────────────────────────────────────────────────────────────────
+
+def _user_credentials(user_id):
+    rows = execute_query(
+        "SELECT aws_access_key_encrypted, aws_secret_key_encrypted FROM users WHERE id = %s",
+        (user_id,), fetch=True
+    )
+    if not rows or not rows[0].get('aws_access_key_encrypted'):
+        return None, None
+    return (
+        decrypt_credential(rows[0]['aws_access_key_encrypted']),
+        decrypt_credential(rows[0].get('aws_secret_key_encrypted') or ''),
+    )
+
+
+def _claim_rows(limit):
+    """
+    Atomically move up to `limit` pending rows (and claims whose lease has run
+    out) to 'checking' and return them in queue order. FOR UPDATE SKIP LOCKED
+    keeps concurrent verifiers on PostgreSQL from blocking on each other's batch;
+    SQLite's single writer already serializes claims.
+    """
+    if DB_ENGINE == 'sqlite':
+        stale, skip_locked = f"datetime('now', '-{VERIFY_CLAIM_SECONDS} seconds')", ''
+    else:
+        stale, skip_locked = f"CURRENT_TIMESTAMP - INTERVAL '{VERIFY_CLAIM_SECONDS} seconds'", ' FOR UPDATE SKIP LOCKED'
+    rows = execute_query(
+        f"""
+        UPDATE verification_queue SET status = %s, checked_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM verification_queue
+            WHERE status = %s OR (status = %s AND checked_at < {stale})
+            ORDER BY id LIMIT %s{skip_locked}
+        )
+        RETURNING id, user_id, sync_id, object_key, event_id, event_name, event_time, aws_region, attempts
+        """,
+        (CHECKING, PENDING, CHECKING, limit), fetch=True
+    )
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def _set_status(row_id, status, attempts):
+    # Only while the claim holds: a row revoked meanwhile stays revoked
+    execute_query(
+        "UPDATE verification_queue SET status = %s, attempts = %s, checked_at = %s WHERE id = %s AND status = %s",
+        (status, attempts, datetime.now(), row_id, CHECKING)
+    )
+
+
+def _check_row(row, ak, sk, cached):
+    """Look one queued event up, from the cache when possible, and return its new status."""
+    if row['event_id'] in cached:
+        if cached[row['event_id']] != row['event_name']:
+            logger.warning(f"Event name mismatch: log={row['event_name']} api={cached[row['event_id']]}")
+            return FAILED, row['attempts']
+        return PASSED, row['attempts']
+
+    region = row['aws_region'] or 'us-east-1'
+    cloudtrail = cloudtrail_client(ak, sk, region)
+    _limiter.wait((ak, region))
+    try:
+        api_name = lookup_event_name(cloudtrail, row['event_id'], row['event_time'])
+    except Exception as e:
+        attempts = row['attempts'] + 1
+        if _is_throttle(e):
+            logger.info(f"CloudTrail lookup throttled for event {row['event_id']}; will retry")
+        else:
+            logger.warning(f"CloudTrail verification error for event {row['event_id']}: {e}")
+        return (SKIPPED if attempts >= VERIFY_MAX_ATTEMPTS else PENDING), attempts
+
+    if api_name is None:
+        logger.warning(f"Event {row['event_id']} ({row['event_name']}) not found in CloudTrail API - possible fake!")
+        return FAILED, row['attempts'] + 1
+    if api_name != row['event_name']:
+        logger.warning(f"Event name mismatch: log={row['event_name']} api={api_name}")
+        return FAILED, row['attempts'] + 1
+    return PASSED, row['attempts'] + 1
+
+
+def verify_pending(limit=VERIFY_BATCH_SIZE):
+    """
+    Check up to `limit` queued events, then settle every sync they belong to.
+    Returns the number of queue rows examined (0 when the queue is empty).
+    """
+    rows = _claim_rows(limit)
+    if not rows:
+        return 0
+
+    by_user = defaultdict(list)
+    for row in rows:
+        by_user[row['user_id']].append(row)
+
+    for user_id, user_rows in by_user.items():
+        ak, sk = _user_credentials(user_id)
+        cached = cached_event_names(user_id, [row['event_id'] for row in user_rows])
+        confirmed = []
+        revoked = set()
+        for row in user_rows:
+            if row['sync_id'] in revoked:
+                continue
+            if not ak or not sk:
+                _set_status(row['id'], SKIPPED, row['attempts'])
+                continue
+            status, attempts = _check_row(row, ak, sk, cached)
+            _set_status(row['id'], status, attempts)
+            if status == PASSED and row['event_id'] not in cached:
+                confirmed.append((row['event_id'], row['event_name']))
+            if status == FAILED:
+                # One bad sample condemns the sync; stop spending API calls on it
+                if row['sync_id'] is None:
+                    revoke_files(user_id, [row['object_key']])   # Queued before syncs were tracked
+                else:
+                    revoke_sync(user_id, row['sync_id'], row['object_key'])
+                    revoked.add(row['sync_id'])
+        remember_verified(user_id, confirmed)
+        _settle_syncs(user_id, {row['sync_id'] for row in user_rows if row['sync_id']} - revoked)
+        _settle_files(user_id, {row['object_key'] for row in user_rows if row['sync_id'] is None})
+
+    return len(rows)
+
+
+def _settle_syncs(user_id, sync_ids):
+    """Promote the syncs whose samples have all been checked without a failure to 'verified'."""
+    for sync_id in sync_ids:
+        unsettled = execute_query(
+            "SELECT 1 FROM verification_queue WHERE user_id = %s AND sync_id = %s AND status IN (%s, %s, %s) LIMIT 1",
+            (user_id, sync_id, PENDING, CHECKING, FAILED), fetch=True
+        )
+        if unsettled:
+            continue
+        execute_query(
+            "UPDATE activity_logs SET verification_status = %s "
+            "WHERE user_id = %s AND sync_id = %s AND verification_status = %s",
+            (VERIFIED, user_id, sync_id, PROVISIONAL)
+        )
+
+
+def _settle_files(user_id, object_keys):
+    """File-level settling for queue rows that predate sync ids."""
+    for object_key in object_keys:
+        unsettled = execute_query(
+            "SELECT 1 FROM verification_queue WHERE user_id = %s AND object_key = %s AND status IN (%s, %s, %s) LIMIT 1",
+            (user_id, object_key, PENDING, CHECKING, FAILED), fetch=True
+        )
+        if unsettled:
+            continue
+        execute_query(
+            "UPDATE activity_logs SET verification_status = %s "
+            "WHERE user_id = %s AND source_key = %s AND verification_status = %s",
+            (VERIFIED, user_id, object_key, PROVISIONAL)
+        )
+
+
+def revoke_sync(user_id, sync_id, failed_key):
+    """Revoke failed_key and every still-provisional file of the same sync."""
+    rows = execute_query(
+        "SELECT DISTINCT source_key FROM activity_logs "
+        "WHERE user_id = %s AND sync_id = %s AND verification_status = %s AND source_key IS NOT NULL",
+        (user_id, sync_id, PROVISIONAL), fetch=True
+    )
+    object_keys = {row['source_key'] for row in rows}
+    object_keys.add(failed_key)
+    execute_query(
+        "UPDATE verification_queue SET status = %s WHERE user_id = %s AND sync_id = %s AND status IN (%s, %s)",
+        (REVOKED, user_id, sync_id, PENDING, CHECKING)
+    )
+    return revoke_files(user_id, sorted(object_keys))
+
+
+def revoke_files(user_id, object_keys):
+    """
+    Remove every activity ingested from object_keys, cancel their remaining
+    queued samples and recompute the affected daily_scores, service_daily_totals
+    and user_summary — in one transaction.
+    Returns the number of activities removed.
+    """
+    if not object_keys:
+        return 0
+
+    placeholder = '?' if DB_ENGINE == 'sqlite' else '%s'
+    least = 'MIN' if DB_ENGINE == 'sqlite' else 'LEAST'
+
+    def revoke(cursor):
+        removed = 0
+        for start in range(0, len(object_keys), _IN_CHUNK):
+            chunk = list(object_keys[start:start + _IN_CHUNK])
+            keys_in = ', '.join([placeholder] * len(chunk))
+
+            cursor.execute(
+                f"SELECT DISTINCT date FROM activity_logs "
+                f"WHERE user_id = {placeholder} AND source_key IN ({keys_in})",
+                (user_id, *chunk)
+            )
+            dates = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute(
+                f"DELETE FROM activity_logs WHERE user_id = {placeholder} AND source_key IN ({keys_in})",
+                (user_id, *chunk)
+            )
+            removed += cursor.rowcount
+            cursor.execute(
+                f"UPDATE verification_queue SET status = {placeholder} "
+                f"WHERE user_id = {placeholder} AND status IN ({placeholder}, {placeholder}) "
+                f"AND object_key IN ({keys_in})",
+                (REVOKED, user_id, PENDING, CHECKING, *chunk)
+            )
+            if not dates:
+                continue
+
+            dates_in = ', '.join([placeholder] * len(dates))
+            cursor.execute(
+                f"UPDATE daily_scores SET total_score = {least}(("
+                f"    SELECT COALESCE(SUM(a.score), 0) FROM activity_logs a"
+                f"    WHERE a.user_id = daily_scores.user_id AND a.date = daily_scores.date"
+                f"), {placeholder}) "
+                f"WHERE user_id = {placeholder} AND date IN ({dates_in})",
+                (DAILY_SCORE_CAP, user_id, *dates)
+            )
+            cursor.execute(
+                f"DELETE FROM daily_scores WHERE user_id = {placeholder} AND total_score = 0 "
+                f"AND date IN ({dates_in})",
+                (user_id, *dates)
+            )
+            cursor.execute(
+                f"DELETE FROM service_daily_totals WHERE user_id = {placeholder} AND date IN ({dates_in})",
+                (user_id, *dates)
+            )
+            cursor.execute(
+                f"INSERT INTO service_daily_totals (user_id, date, service, total) "
+                f"SELECT user_id, date, service, SUM(score) FROM activity_logs "
+                f"WHERE user_id = {placeholder} AND date IN ({dates_in}) GROUP BY user_id, date, service",
+                (user_id, *dates)
+            )
+        if removed:
+            refresh_user_summary(cursor, user_id)
+            bump_data_version(cursor, [user_id])
+        return removed
+
+    removed = run_write(revoke)
+    if removed:
+        try:
+            refresh_users([user_id])
+        except Exception as e:
+            logger.warning(f"Leaderboard refresh failed, boards catch up on rebuild: {e}")
+    logger.warning(f"FRAUD: revoked {removed} activities from {len(object_keys)} file(s) for user {user_id}")
+    return removed
+
+
+# ── Background worker ─────────────────────────────────────────────────────────
+
+_verifier_thread = None
+_verifier_lock = threading.Lock()
+
+
+def _run_verifier(poll_seconds):
+    pruned_at = 0.0
+    while True:
+        try:
+            examined = verify_pending()
+        except Exception as e:
+            logger.error(f"Verification queue error: {e}")
+            examined = 0
+        if not examined:
+            if time.monotonic() - pruned_at >= 3600:
+                try:
+                    prune_verified_events()
+                except Exception as e:
+                    logger.error(f"Verified event cache pruning error: {e}")
+                pruned_at = time.monotonic()
+            time.sleep(poll_seconds)
+
+
+def start_verifier(poll_seconds=VERIFY_POLL_SECONDS):
+    """Start the background verifier thread once per process."""
+    global _verifier_thread
+    with _verifier_lock:
+        if _verifier_thread is None:
+            _verifier_thread = threading.Thread(target=_run_verifier, args=(poll_seconds,), daemon=True)
+            _verifier_thread.start()
+            logger.info(f"CloudTrail verification worker started ({CLOUDTRAIL_LOOKUP_TPS:g} lookups/s per account)")
+    return _verifier_thread